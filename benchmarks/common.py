@@ -0,0 +1,75 @@
+"""
+Scenes and metrics shared by the benchmark scripts
+
+`load_scenes` loads sample.pickle and deterministic synthetic scenes by
+name, `tracking_error` measures how far a rollout strays from the logged
+future.
+
+"""
+import os
+import sys
+import pickle
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def make_synthetic_scene(num_agents=6, steps=40, seed=0):
+    """
+    Deterministic scene in the `state/...` schema: agents on straight and
+    curved lanes at different speeds, the first one is the SDC.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(steps) * 0.1
+    x = np.zeros((num_agents, steps), dtype=np.float32)
+    y = np.zeros((num_agents, steps), dtype=np.float32)
+    for i in range(num_agents):
+        speed = rng.uniform(3.0, 12.0)
+        heading = rng.uniform(-np.pi, np.pi)
+        turn = rng.choice([0.0, rng.uniform(-0.3, 0.3)])
+        yaw = heading + turn * t
+        x[i] = rng.uniform(-30, 30) + np.cumsum(speed * np.cos(yaw) * 0.1)
+        y[i] = rng.uniform(-30, 30) + np.cumsum(speed * np.sin(yaw) * 0.1)
+    # one short track with trailing invalid points
+    x[-1, steps // 2:] = -1
+    y[-1, steps // 2:] = -1
+
+    is_sdc = np.zeros(num_agents, dtype=np.float32)
+    is_sdc[0] = 1
+    return {
+        'scenario/id': 'synthetic_%d_%d_%d' % (num_agents, steps, seed),
+        'state/id': np.arange(num_agents, dtype=np.float32),
+        'state/is_sdc': is_sdc,
+        'state/future/x': x,
+        'state/future/y': y,
+        'state/future/valid': np.ones((num_agents, steps)),
+        'state/past/length': np.full((num_agents, 10), 4.5, dtype=np.float32),
+        'state/past/width': np.full((num_agents, 10), 2.0, dtype=np.float32),
+    }
+
+
+def load_scenes(names):
+    scenes = {}
+    for name in names:
+        if name == 'sample':
+            with open(os.path.join(ROOT, 'sample.pickle'), 'rb') as f:
+                scenes[name] = pickle.load(f)
+        elif name.startswith('synthetic'):
+            # synthetic[-agents[-steps[-seed]]]
+            args = [int(a) for a in name.split('-')[1:]]
+            scenes[name] = make_synthetic_scene(*args)
+        else:
+            raise ValueError('unknown scene: ' + name)
+    return scenes
+
+
+def tracking_error(scene, result):
+    x = np.asarray(result['state/future/x'], dtype=float)
+    y = np.asarray(result['state/future/y'], dtype=float)
+    steps = x.shape[1]
+    # the rollout starts from the first logged point
+    gx = np.asarray(scene['state/future/x'], dtype=float)[:, 1:steps + 1]
+    gy = np.asarray(scene['state/future/y'], dtype=float)[:, 1:steps + 1]
+    return float(np.mean(np.hypot(x - gx, y - gy)))
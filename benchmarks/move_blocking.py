@@ -0,0 +1,82 @@
+"""
+Solve time vs tracking error of move blocking
+
+Rolls out scenes (headless, compiled problems) for several horizon lengths
+and move blockings, and reports the mean solve time, the number of decision
+variables and the tracking error (mean distance between the rolled out and
+the logged future positions).
+
+Usage:
+    python benchmarks/move_blocking.py
+    python benchmarks/move_blocking.py --scenes synthetic-12-40-3 --solver OSQP
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import contextlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import load_scenes, tracking_error  # noqa: E402
+import mpc_module  # noqa: E402
+from utils import hooks as hooks_module  # noqa: E402
+from utils import mpc_problem  # noqa: E402
+
+# label: (T, MOVE_BLOCKING)
+CONFIGS = {
+    'T5': (5, None),
+    'T10': (10, None),
+    'T10 b2': (10, 2),
+    'T20': (20, None),
+    'T20 b4': (20, 4),
+    'T20 1-1-2-4-8': (20, (1, 1, 2, 4, 8)),
+    'T40 b8': (40, 8),
+    'T40 1-1-2-4-8-8-8': (40, (1, 1, 2, 4, 8, 8, 8)),
+}
+
+
+def run(scene, T, blocking, solver):
+    solve_times = []
+    hooks = hooks_module.Hooks()
+    hooks.on('solve', lambda event, info: solve_times.append(info['solve_time']))
+    mpc_module.SHOW_ANIMATION = False
+    mpc_module.MPC_PARAMS.clear()
+    mpc_module.MPC_PARAMS.update({'T': T, 'MOVE_BLOCKING': blocking, 'COMPILED_PROBLEM': True,
+                                  'SOLVER': solver})
+    try:
+        mpc_module.warm_up()  # compile outside of the measurement
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = mpc_module.mpc_forward(scene, hooks=hooks)
+        seconds = time.perf_counter() - start
+    finally:
+        mpc_module.MPC_PARAMS.clear()
+    return result, seconds, solve_times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenes', nargs='+', default=['sample', 'synthetic'],
+                        help='sample and/or synthetic[-agents[-steps[-seed]]]')
+    parser.add_argument('--configs', nargs='+', default=list(CONFIGS), help='one of ' + ', '.join(CONFIGS))
+    parser.add_argument('--solver', default='ECOS')
+    args = parser.parse_args(argv)
+
+    print('%-12s %-20s %9s %11s %9s %9s' % ('scene', 'config', 'inputs', 'solve[ms]', 'time[s]', 'error[m]'))
+    for name, scene in load_scenes(args.scenes).items():
+        for label in args.configs:
+            T, blocking = CONFIGS[label]
+            blocks = mpc_problem.move_blocks(T, blocking)
+            inputs = 2 * (T if blocks is None else len(blocks))
+            result, seconds, solve_times = run(scene, T, blocking, args.solver)
+            print('%-12s %-20s %9d %11.2f %9.2f %9.3f' % (
+                name, label, inputs, 1e3 * np.mean(solve_times), seconds, tracking_error(scene, result)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
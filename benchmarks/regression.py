@@ -0,0 +1,235 @@
+"""
+Golden-output regression and performance comparison harness
+
+Runs `mpc_forward` headless on sample.pickle and on synthetic scenes, stores
+golden trajectories and timing baselines, and compares new runs (in any
+mode: solver backend, tracking options, ...) against them with per-field
+tolerances and a speedup report.
+
+Modes that should reproduce the reference (compiled problems, kernels,
+bounded histories, partitioning, other solver backends at their own
+tolerance) PASS or FAIL, and `compare` exits 1 if any fails. Modes that
+change the controller on purpose (REPORT_ONLY) are listed as INFO with
+their difference to the reference.
+
+Usage:
+    python benchmarks/regression.py record                  # golden of the reference mode
+    python benchmarks/regression.py compare                 # every mode against it
+    python benchmarks/regression.py compare --modes osqp --atol 0.5
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import ROOT, load_scenes, make_synthetic_scene  # noqa: E402,F401
+import mpc_module  # noqa: E402
+
+GOLDEN_DIR = os.path.join(ROOT, 'benchmarks', 'golden')
+FIELDS = ('x', 'y', 'bbox_yaw', 'velocity_x', 'velocity_y', 'vel_yaw')
+
+# settings of each mode: upper case names that exist at module level in
+# mpc_module are set there, everything else goes to SINGLE_MPC (MPC_PARAMS)
+MODES = {
+    'default': {},
+    'frenet': {'FRENET_TRACKING': True},
+    'osqp': {'SOLVER': 'OSQP'},
+    'clarabel': {'SOLVER': 'CLARABEL'},
+    'float32': {'HISTORY_DTYPE': 'float32'},
+    'compiled': {'COMPILED_PROBLEM': True},
+    'compiled-osqp': {'COMPILED_PROBLEM': True, 'SOLVER': 'OSQP'},
+    'collision': {'COMPILED_PROBLEM': True, 'COLLISION_CONSTRAINTS': True},
+    'adaptive': {'COMPILED_PROBLEM': True, 'ADAPTIVE_HORIZON': True},
+    'replan3': {'COMPILED_PROBLEM': True, 'REPLAN_EVERY': 3},
+    'library': {'COMPILED_PROBLEM': True, 'SOLUTION_LIBRARY': 4096},
+    'admm': {'SOLVER': 'ADMM'},
+    'bounded': {'HISTORY_LIMIT': 'horizon'},
+    'bounded-float32': {'HISTORY_LIMIT': 'horizon', 'HISTORY_DTYPE': 'float32'},
+    'partition': {'PARTITION_WORKERS': 1},
+    'partition2': {'PARTITION_WORKERS': 2},
+    'compiled-partition': {'COMPILED_PROBLEM': True, 'PARTITION_WORKERS': 1},
+    'kernels': {'KERNELS': 'auto'},
+    'compiled-kernels': {'COMPILED_PROBLEM': True, 'KERNELS': 'auto'},
+}
+REFERENCE_MODE = 'default'
+
+# modes that change the controller on purpose (other tracking, constraints,
+# horizons, replanning, warm starts): their difference to the reference is
+# reported, but does not fail the comparison
+REPORT_ONLY = ('frenet', 'collision', 'adaptive', 'replan3', 'library')
+
+# (absolute, relative) tolerance per field
+DEFAULT_TOLERANCE = {'x': (1e-3, 0.0), 'y': (1e-3, 0.0), 'bbox_yaw': (1e-3, 0.0),
+                     'velocity_x': (1e-3, 0.0), 'velocity_y': (1e-3, 0.0),
+                     'vel_yaw': (1e-3, 1e-4)}
+# OSQP stops at a looser accuracy than the interior point solvers
+OSQP_TOLERANCE = {'x': (5e-3, 0.0), 'y': (5e-3, 0.0), 'bbox_yaw': (5e-2, 0.0),
+                  'velocity_x': (0.5, 0.0), 'velocity_y': (0.5, 0.0),
+                  'vel_yaw': (2e-2, 1e-3)}
+# modes compared at their own tolerance instead of DEFAULT_TOLERANCE
+MODE_TOLERANCE = {'osqp': OSQP_TOLERANCE, 'compiled-osqp': OSQP_TOLERANCE}
+
+
+def _inverse(values):
+    with np.errstate(divide='ignore'):
+        return np.where(values == 0, 0.0, 1.0 / np.where(values == 0, 1.0, values))
+
+
+# vel_yaw = v / L / tan(steering) blows up (and flips sign) for near zero
+# steering, so it is compared as its inverse, which is proportional to it
+COMPARE_AS = {'vel_yaw': _inverse}
+
+
+@contextlib.contextmanager
+def mode_settings(mode):
+    """
+    Apply the settings of a mode to mpc_module, restored on exit.
+    """
+    settings = MODES[mode]
+    saved_module = {}
+    saved_params = dict(mpc_module.MPC_PARAMS)
+    try:
+        for name, value in settings.items():
+            if name.isupper() and hasattr(mpc_module, name) and name != 'MPC_PARAMS':
+                saved_module[name] = getattr(mpc_module, name)
+                setattr(mpc_module, name, value)
+            else:
+                mpc_module.MPC_PARAMS[name] = value
+        yield
+    finally:
+        for name, value in saved_module.items():
+            setattr(mpc_module, name, value)
+        mpc_module.MPC_PARAMS.clear()
+        mpc_module.MPC_PARAMS.update(saved_params)
+
+
+def run(scene, mode, repeat=1):
+    """
+    Roll out a scene in a mode, returns the trajectories and the best time.
+    """
+    mpc_module.SHOW_ANIMATION = False
+    best, out = None, None
+    with mode_settings(mode):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                out = mpc_module.mpc_forward(scene)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+    return {f: np.asarray(out['state/future/' + f], dtype=float) for f in FIELDS}, best
+
+
+def golden_path(scene_name, mode):
+    return os.path.join(GOLDEN_DIR, '%s__%s.npz' % (scene_name, mode))
+
+
+def record(scenes, mode, repeat):
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    for name, scene in scenes.items():
+        trajectories, seconds = run(scene, mode, repeat)
+        np.savez_compressed(golden_path(name, mode), seconds=seconds, **trajectories)
+        print('recorded %-22s %-18s %8.2fs' % (name, mode, seconds))
+
+
+def compare(scenes, modes, reference, repeat, tolerance=None):
+    """
+    Compare every mode against the golden of the reference mode, returns
+    (all gated modes within tolerance, result rows). `tolerance` applies to
+    every mode, by default each mode uses MODE_TOLERANCE or
+    DEFAULT_TOLERANCE. Modes in REPORT_ONLY get the status INFO.
+    """
+    ok = True
+    rows = []
+    for name, scene in scenes.items():
+        path = golden_path(name, reference)
+        if not os.path.exists(path):
+            print('no golden for %s (%s), run `record` first' % (name, reference))
+            ok = False
+            continue
+        golden = np.load(path)
+        for mode in modes:
+            trajectories, seconds = run(scene, mode, repeat)
+            mode_tolerance = tolerance or MODE_TOLERANCE.get(mode, DEFAULT_TOLERANCE)
+            errors, passed = {}, True
+            for field in FIELDS:
+                a, b = trajectories[field], golden[field]
+                if field in COMPARE_AS:
+                    a, b = COMPARE_AS[field](a), COMPARE_AS[field](b)
+                if a.shape != b.shape:
+                    errors[field], passed = float('inf'), False
+                    continue
+                errors[field] = float(np.nanmax(np.abs(a - b))) if a.size else 0.0
+                atol, rtol = mode_tolerance[field]
+                if not np.allclose(a, b, rtol=rtol, atol=atol, equal_nan=True):
+                    passed = False
+            if mode in REPORT_ONLY:
+                status = 'INFO'
+            else:
+                ok &= passed
+                status = 'PASS' if passed else 'FAIL'
+            speedup = float(golden['seconds']) / seconds
+            rows.append((name, mode, status, seconds, speedup, errors))
+
+    print('%-22s %-18s %-5s %9s %8s  max abs error per field'
+          % ('scene', 'mode', '', 'time[s]', 'speedup'))
+    for name, mode, status, seconds, speedup, errors in rows:
+        print('%-22s %-18s %-5s %9.2f %7.2fx  %s'
+              % (name, mode, status, seconds, speedup,
+                 ' '.join('%s=%.2g' % (f, e) for f, e in errors.items())))
+    return ok, rows
+
+
+def write_report(path, rows):
+    report = [{'scene': name, 'mode': mode, 'status': status, 'seconds': seconds,
+               'speedup': speedup, 'max_abs_error': errors}
+              for name, mode, status, seconds, speedup, errors in rows]
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('command', choices=['record', 'compare'])
+    parser.add_argument('--scenes', nargs='+', default=['sample', 'synthetic'],
+                        help='sample and/or synthetic[-agents[-steps[-seed]]]')
+    parser.add_argument('--modes', nargs='+', default=None,
+                        help='modes to compare (default: all), one of ' + ', '.join(MODES))
+    parser.add_argument('--reference', default=REFERENCE_MODE,
+                        help='mode whose golden is recorded / compared against')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per measurement, best time is kept')
+    parser.add_argument('--atol', type=float, default=None,
+                        help='absolute tolerance for every field and mode (default: per mode)')
+    parser.add_argument('--rtol', type=float, default=None,
+                        help='relative tolerance for every field and mode (default: per mode)')
+    parser.add_argument('--json', default=None, help='also write the comparison to this JSON file')
+    args = parser.parse_args(argv)
+
+    scenes = load_scenes(args.scenes)
+    if args.command == 'record':
+        record(scenes, args.reference, args.repeat)
+        return 0
+
+    modes = args.modes or list(MODES)
+    for mode in modes:
+        if mode not in MODES:
+            parser.error('unknown mode: ' + mode)
+    tolerance = None
+    if args.atol is not None or args.rtol is not None:
+        tolerance = {field: (default[0] if args.atol is None else args.atol,
+                             default[1] if args.rtol is None else args.rtol)
+                     for field, default in DEFAULT_TOLERANCE.items()}
+    ok, rows = compare(scenes, modes, args.reference, args.repeat, tolerance)
+    if args.json:
+        write_report(args.json, rows)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
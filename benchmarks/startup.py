@@ -0,0 +1,64 @@
+"""
+Startup-time benchmark
+
+Measures, in fresh interpreters, how long a worker takes to import
+mpc_module and to get ready for its first scenario, and which heavy
+dependencies were pulled in on the way.
+
+Usage: python benchmarks/startup.py [--repeat N]
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = {
+    'import numpy': 'import numpy',
+    'import mpc_module': 'import mpc_module',
+    'import + setup': (
+        'import pickle, mpc_module\n'
+        'data = pickle.load(open("sample.pickle", "rb"))\n'
+        'for i in range(len(data["state/id"])):\n'
+        '    mpc_module.SINGLE_MPC().setup(data, i)\n'),
+    'import cvxpy': 'import cvxpy',
+    'import matplotlib.pyplot': 'import matplotlib.pyplot',
+}
+
+PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+exec(compile(%r, "<case>", "exec"))
+seconds = time.perf_counter() - start
+heavy = [m for m in ("cvxpy", "matplotlib", "scipy") if m in sys.modules]
+print(json.dumps({"seconds": seconds, "heavy": heavy}))
+'''
+
+
+def measure(code, repeat):
+    times, heavy = [], []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', PROBE % code], cwd=ROOT,
+                             capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        times.append(result['seconds'])
+        heavy = result['heavy']
+    times.sort()
+    return times[len(times) // 2], times[0], heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print('%-26s %10s %10s  %s' % ('case', 'median[s]', 'min[s]', 'heavy modules loaded'))
+    for name, code in CASES.items():
+        median, best, heavy = measure(code, args.repeat)
+        print('%-26s %10.3f %10.3f  %s' % (name, median, best, ', '.join(heavy) or '-'))
+
+
+if __name__ == '__main__':
+    main()
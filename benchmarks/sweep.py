@@ -0,0 +1,346 @@
+"""
+Parameter sweep of the MPC controller
+
+Rolls out scenes (headless, compiled problems) for every configuration of
+a parameter grid or of a random search, scenes x configurations spread
+over a process pool, and reports per configuration the tracking error
+(mean distance to the logged future positions), collisions (agent pairs
+that come closer than --collision-distance although they do not in the
+log), the smallest separation of any two agents, the goal-reach rate and
+the runtime.
+
+The reference courses of all scenes are preprocessed once, for every
+distinct course parameter (TARGET_SPEED, DL), and shared with the workers
+through their course cache. Jobs of one configuration are handed to a
+worker together, so the worker compiles the problem of the configuration
+once and reuses it for all its scenes.
+
+A spec is a JSON object of parameter values to try, matrices (Q, R, Rd,
+Qf) as their diagonals, and overriding Q also overrides Qf:
+
+    {"grid": {"T": [5, 10], "Q": [[1, 1, 0.5, 1], [2, 2, 0.5, 2]]}}
+    {"random": {"TARGET_SPEED": {"uniform": [8, 14]}, "T": {"int": [4, 10]},
+                "R": {"loguniform": [[0.01, 0.01], [1, 1]]}, "AI_PART": [0.7, 0.9]},
+     "samples": 20, "seed": 0}
+
+Usage:
+    python benchmarks/sweep.py --grid 'T=[5,10]' 'AI_PART=[0.7,0.8,0.9]' -j 4
+    python benchmarks/sweep.py --spec sweep.json --scenes sample synthetic-12-40-3 --json sweep.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import contextlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import load_scenes, tracking_error  # noqa: E402
+import mpc_module  # noqa: E402
+from utils import course_cache  # noqa: E402
+from utils import dataset  # noqa: E402
+from utils import hooks as hooks_module  # noqa: E402
+
+MATRIX_PARAMS = ('Q', 'R', 'Rd', 'Qf')
+BASE_PARAMS = {'COMPILED_PROBLEM': True}
+COLLISION_DISTANCE = 2.0  # [m] distance between agent centers counted as a collision
+# parameters that currently do not change the rollout, with the reason
+INEFFECTIVE_PARAMS = {'DI_PART': 'the blended steering command (self.di = self.u1) is disabled in SINGLE_MPC.update_steps'}
+
+
+def grid_configs(grid):
+    """
+    Every combination of the values of `grid` {name: [values]}.
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+
+def sample_value(rng, spec):
+    """
+    One value of a random search dimension: a list of choices or a dict
+    {'uniform': [low, high]}, {'loguniform': [low, high]} or
+    {'int': [low, high]} (inclusive), bounds may be lists (diagonals).
+    """
+    if isinstance(spec, list):
+        return spec[rng.integers(len(spec))]
+    (kind, (low, high)), = spec.items()
+    low, high = np.asarray(low, dtype=float), np.asarray(high, dtype=float)
+    if kind == 'uniform':
+        value = rng.uniform(low, high)
+    elif kind == 'loguniform':
+        value = np.exp(rng.uniform(np.log(low), np.log(high)))
+    elif kind == 'int':
+        value = rng.integers(low.astype(int), high.astype(int) + 1)
+    else:
+        raise ValueError('unknown distribution: ' + kind)
+    return np.asarray(value).tolist()
+
+
+def random_configs(space, samples, seed=0):
+    """
+    `samples` configurations drawn from `space` {name: dimension spec}.
+    """
+    rng = np.random.default_rng(seed)
+    return [{name: sample_value(rng, spec) for name, spec in space.items()} for _ in range(samples)]
+
+
+def load_spec(spec):
+    """
+    Configurations of a spec, see the module docstring.
+    """
+    configs = []
+    if 'grid' in spec:
+        configs += grid_configs(spec['grid'])
+    if 'random' in spec:
+        configs += random_configs(spec['random'], spec.get('samples', 10), spec.get('seed', 0))
+    if not configs:
+        raise ValueError("spec needs a 'grid' or 'random' entry")
+    return configs
+
+
+def check_configs(configs):
+    """
+    Reject configurations that sweep unknown parameters (SINGLE_MPC would
+    just set them as new attributes) or parameters without effect.
+    """
+    with params_applied({}):
+        known = vars(mpc_module.SINGLE_MPC())
+    for config in configs:
+        for name in config:
+            if name not in known:
+                raise ValueError('unknown parameter %s, SINGLE_MPC has no attribute of that name' % name)
+            if name in INEFFECTIVE_PARAMS:
+                raise ValueError('%s has no effect: %s' % (name, INEFFECTIVE_PARAMS[name]))
+
+
+def mpc_params(config, base=None):
+    """
+    MPC_PARAMS of a configuration.
+    """
+    params = dict(BASE_PARAMS if base is None else base)
+    for name, value in config.items():
+        params[name] = np.diag(np.asarray(value, dtype=float)) if name in MATRIX_PARAMS else value
+    if 'Q' in config and 'Qf' not in config:
+        params['Qf'] = params['Q']
+    return params
+
+
+def config_label(config):
+    return ' '.join('%s=%s' % (name, json.dumps(value)) for name, value in config.items()) or 'defaults'
+
+
+@contextlib.contextmanager
+def params_applied(params):
+    saved = dict(mpc_module.MPC_PARAMS)
+    mpc_module.MPC_PARAMS.clear()
+    mpc_module.MPC_PARAMS.update(params)
+    try:
+        yield
+    finally:
+        mpc_module.MPC_PARAMS.clear()
+        mpc_module.MPC_PARAMS.update(saved)
+
+
+def prepare_courses(scenes, configs, base=None):
+    """
+    Course cache with the reference courses of every scene for every
+    configuration, each distinct course computed once (as in `mpc_forward`).
+    """
+    cache = course_cache.CourseCache(max_entries=1 << 20)
+    for config in configs:
+        with params_applied(mpc_params(config, base)):
+            mpc = mpc_module.SINGLE_MPC()
+            for scene in scenes.values():
+                x, y = scene['state/future/x'], scene['state/future/y']
+                valid = scene.get('state/future/valid')
+                main_car = [i for i, sdc in enumerate(scene['state/is_sdc']) if sdc == 1]
+                main_car = main_car[-1] if main_car else -1
+                smoothing = [mpc_module.SPLINE_SMOOTHING and i != main_car for i in range(len(x))]
+                keys = [mpc.course_key(x[i], y[i], smoothing[i], None if valid is None else valid[i])
+                        for i in range(len(x))]
+                missing = [i for i, key in enumerate(keys) if key not in cache]
+                if not missing:
+                    continue
+                courses = [None] * len(x)
+                if mpc_module.SPLINE_SMOOTHING:
+                    courses = mpc_module.get_switch_back_courses(scene, mpc.DL)
+                for i in missing:
+                    cache.put(keys[i], mpc.prepare_course(x[i], y[i], courses[i], smoothing[i],
+                                                          None if valid is None else valid[i]))
+    return cache
+
+
+def collisions(scene, result, distance=COLLISION_DISTANCE):
+    """
+    (agent pairs closer than `distance` in the rollout but not in the log,
+    smallest separation of any two agents in the rollout)
+    """
+    x = np.asarray(result['state/future/x'], dtype=float)
+    y = np.asarray(result['state/future/y'], dtype=float)
+    steps = x.shape[1]
+    if len(x) < 2:
+        return 0, float('inf')
+    separation = np.hypot(x[:, None] - x[None], y[:, None] - y[None]).min(axis=2)
+    gx = np.asarray(scene['state/future/x'], dtype=float)[:, 1:steps + 1]
+    gy = np.asarray(scene['state/future/y'], dtype=float)[:, 1:steps + 1]
+    if 'state/future/valid' in scene:
+        valid = np.asarray(scene['state/future/valid'])[:, 1:steps + 1] > 0
+        gx, gy = np.where(valid, gx, np.nan), np.where(valid, gy, np.nan)
+    with np.errstate(invalid='ignore'):
+        logged = np.hypot(gx[:, None] - gx[None], gy[:, None] - gy[None])
+        logged = np.where(np.isnan(logged), np.inf, logged).min(axis=2)
+    pairs = np.triu(np.ones(separation.shape, dtype=bool), k=1)
+    count = int(np.sum(pairs & (separation < distance) & (logged >= distance)))
+    return count, float(separation[pairs].min())
+
+
+_worker = {}
+
+
+def init_worker(scenes, cache, base, collision_distance):
+    mpc_module.SHOW_ANIMATION = False
+    mpc_module.COURSE_CACHE = cache
+    _worker.update(scenes=scenes, base=base, collision_distance=collision_distance, warm=None)
+
+
+def run_job(job):
+    """
+    Roll out one scene with one configuration, returns a result row.
+    """
+    index, config, name = job
+    scene = _worker['scenes'][name]
+    goals = set()
+    hooks = hooks_module.Hooks()
+    hooks.on('goal_reached', lambda event, info: goals.add(info['agent']))
+    params = mpc_params(config, _worker['base'])
+    cache = mpc_module.COURSE_CACHE
+    hits, misses = cache.hits, cache.misses
+    with params_applied(params):
+        if _worker['warm'] != index:
+            mpc_module.warm_up()  # compile outside of the measurement
+            _worker['warm'] = index
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = mpc_module.mpc_forward(scene, hooks=hooks)
+        seconds = time.perf_counter() - start
+    count, separation = collisions(scene, result, _worker['collision_distance'])
+    return {'config': index, 'scene': name, 'tracking_error': tracking_error(scene, result),
+            'collisions': count, 'min_separation': separation,
+            'goal_rate': len(goals) / len(scene['state/id']), 'seconds': seconds,
+            'course_hits': cache.hits - hits, 'course_misses': cache.misses - misses}
+
+
+def sweep(scenes, configs, workers=1, base=None, collision_distance=COLLISION_DISTANCE):
+    """
+    Roll out every scene with every configuration, returns the result rows
+    (one per scene and configuration).
+    """
+    check_configs(configs)
+    cache = prepare_courses(scenes, configs, base)
+    jobs = [(index, config, name) for index, config in enumerate(configs) for name in scenes]
+    initargs = (scenes, cache, base, collision_distance)
+    if workers <= 1:
+        saved = mpc_module.SHOW_ANIMATION, mpc_module.COURSE_CACHE
+        init_worker(*initargs)
+        try:
+            return [run_job(job) for job in jobs]
+        finally:
+            mpc_module.SHOW_ANIMATION, mpc_module.COURSE_CACHE = saved
+    import multiprocessing
+    with multiprocessing.Pool(workers, init_worker, initargs) as pool:
+        # the scenes of a configuration go to one worker, which compiles its problem once
+        return list(pool.imap(run_job, jobs, chunksize=len(scenes)))
+
+
+def summarize(configs, rows):
+    """
+    One row per configuration: mean tracking error and goal rate, total
+    collisions and runtime, smallest separation; best tracking first.
+    """
+    summary = []
+    for index, config in enumerate(configs):
+        own = [row for row in rows if row['config'] == index]
+        summary.append({'config': index, 'params': config,
+                        'tracking_error': float(np.mean([r['tracking_error'] for r in own])),
+                        'collisions': sum(r['collisions'] for r in own),
+                        'min_separation': min(r['min_separation'] for r in own),
+                        'goal_rate': float(np.mean([r['goal_rate'] for r in own])),
+                        'seconds': sum(r['seconds'] for r in own)})
+    return sorted(summary, key=lambda s: s['tracking_error'])
+
+
+def print_table(summary):
+    print('%4s %9s %10s %10s %9s %9s  %s' % ('#', 'error[m]', 'collisions', 'min sep[m]', 'goal rate', 'time[s]',
+                                            'params'))
+    for s in summary:
+        print('%4d %9.3f %10d %10.2f %9.2f %9.2f  %s' % (s['config'], s['tracking_error'], s['collisions'],
+                                                       s['min_separation'], s['goal_rate'], s['seconds'],
+                                                       config_label(s['params'])))
+
+
+def parse_grid(items):
+    grid = {}
+    for item in items:
+        name, _, values = item.partition('=')
+        values = json.loads(values)
+        grid[name] = values if isinstance(values, list) else [values]
+    return grid
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--spec', default=None, help='JSON spec file, see the module docstring')
+    parser.add_argument('--grid', nargs='+', metavar='NAME=VALUES', default=None,
+                        help="grid dimensions, values as JSON, e.g. 'T=[5,10]' 'Q=[[1,1,0.5,1],[2,2,0.5,2]]'")
+    parser.add_argument('--scenes', nargs='+', default=['sample'],
+                        help='sample and/or synthetic[-agents[-steps[-seed]]]')
+    parser.add_argument('--inputs', nargs='+', default=None,
+                        help='also sweep the scenarios of these files, directories or globs')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--solver', default=None, help='cvxpy solver or ADMM (default: ECOS)')
+    parser.add_argument('--collision-distance', type=float, default=COLLISION_DISTANCE,
+                        help='distance between agent centers counted as a collision [m]')
+    parser.add_argument('--json', default=None, help='also write the per scene results and the summary here')
+    args = parser.parse_args(argv)
+
+    if args.spec is None and args.grid is None:
+        parser.error('give a --spec or a --grid')
+    configs = []
+    if args.spec is not None:
+        with open(args.spec) as f:
+            configs += load_spec(json.load(f))
+    if args.grid is not None:
+        configs += grid_configs(parse_grid(args.grid))
+    try:
+        check_configs(configs)
+    except ValueError as e:
+        parser.error(str(e))
+    scenes = load_scenes(args.scenes)
+    if args.inputs:
+        scenes.update(dataset.iter_scenarios(args.inputs))
+    base = dict(BASE_PARAMS)
+    if args.solver is not None:
+        base['SOLVER'] = args.solver.upper()
+
+    start = time.perf_counter()
+    rows = sweep(scenes, configs, args.workers, base, args.collision_distance)
+    wall = time.perf_counter() - start
+    summary = summarize(configs, rows)
+    print_table(summary)
+    print('%d configurations x %d scenes in %.1f s' % (len(configs), len(scenes), wall))
+    print('course cache: %d hits, %d misses' % (sum(r['course_hits'] for r in rows),
+                                               sum(r['course_misses'] for r in rows)))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'runs': rows, 'summary': summary}, f, indent=1)
+    return summary
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,50 @@
-import matplotlib.pyplot as plt
-import cvxpy
 import math
 import numpy as np
+import os
 import sys
-import random
 import pickle
 import utils.cubic_spline_planner as cubic_spline_planner
+import utils.course_cache as course_cache
+import utils.frenet as frenet
+import utils.resample as resample
+import utils.waypoints as waypoints
+import utils.dataset as dataset
+import utils.rollout_store as rollout_store
+import utils.checkpoint as checkpoint
+import utils.hooks as hooks_module
+import utils.mpc_problem as mpc_problem
+import utils.collision as collision
+import utils.history as history
+import utils.partition as partition
+import utils.batch_qp as batch_qp
+import utils.kernels as kernels
+import utils.solution_library as solution_library
 from utils.state import State
-import copy
+from utils.lazy_import import LazyModule
+import array
+import json
+import functools
+import argparse
+import contextlib
+import time
+
+# 延迟导入: 仅在显示动画/使用cvxpy求解时才加载
+plt = LazyModule('matplotlib.pyplot')
+cvxpy = LazyModule('cvxpy')
 
 SHOW_ANIMATION = True
+SPLINE_SMOOTHING = False
+COURSE_CACHE = None  # utils.course_cache.CourseCache, shared by all controllers
+HOOKS = None  # utils.hooks.Hooks, tick/solve/avoidance/goal事件回调
+MPC_PARAMS = {}  # 覆盖SINGLE_MPC默认参数, e.g. {'T': 10, 'DT': 0.1, 'SOLVER': 'OSQP'}
+OUTPUT_FIELDS = ('x', 'y', 'bbox_yaw', 'vel_yaw', 'velocity_x', 'velocity_y')  # mpc_forward输出的state/future/字段
+OUTPUT_DT = None  # [s] 输出的时间步长, e.g. 0.1: 每个tick (DT) 一个值的输出按时间重采样到M2I的时间轴; None: 每个tick一个值
+PARTITION_WORKERS = 0  # >0: 按交互图把场景分成互不影响的车群分别仿真 (utils.partition), >1时用该数量的进程并行
+PARTITION_EVERY = 5  # 分区仿真时每隔多少个tick重新分区
+
+# SINGLE_MPC中每个tick追加一个值的轨迹记录
+HISTORY_FIELDS = ('x', 'y', 'yaw', 'v', 'vel_x', 'vel_y', 'vel_yaw', 't', 'd', 'a',
+                  'state_future_vel_yaw', 'state_future_velocity_x', 'state_future_velocity_y')
 
 class SINGLE_MPC:
     """
@@ -59,6 +94,42 @@ class SINGLE_MPC:
         self.SHOW_ANIMATION = SHOW_ANIMATION
         self.SHOW_POTENTIAL_FIELD = True
         self.OBSTACLE_AVOIDANCE = True
+        self.COURSE_CACHE = COURSE_CACHE
+        self.FRENET_TRACKING = False  # 投影到连续弧长上跟踪, 而不是最近的waypoint索引
+        self.SOLVER = 'ECOS'  # cvxpy solver, 或'ADMM': 所有车辆的问题每个tick合并为一次批量ADMM求解 (utils.batch_qp)
+        self.ADMM_EPS = 1e-6  # ADMM的绝对/相对收敛容差 (1e-6时与ECOS的结果相差在回归测试容差1e-3以内)
+        self.ADMM_MAX_ITER = 4000
+        self.admm_warm_start = None  # 上次ADMM求解的 (原始解, 对偶解)
+        self.COMPILED_PROBLEM = False  # 复用编译好的参数化cvxpy问题, 跳过每次求解的建模/规范化
+        self.DI_PART = 0.5  # 势场避障时转向指令中MPC转角的权重 (其余为势场方向)
+        self.AI_PART = 0.9  # 势场避障时加速度中MPC加速度的权重 (其余为势场速度)
+        self.COLLISION_CONSTRAINTS = False  # 用线性化的分离半平面约束避障, 代替人工势场
+        self.MAX_OBSTACLE_CONSTRAINTS = 4  # 每个控制器最多约束的障碍物数 (按碰撞时间选取)
+        self.COLLISION_DISTANCE = 4.0  # [m] 与障碍物中心的最小距离
+        self.COLLISION_SLACK_WEIGHT = 1e3  # 软约束违反代价 (每米)
+        self.collision_obstacles = collision.as_obstacle_array([])
+        self.MOVE_BLOCKING = None  # 输入分块保持不变: 块长 (int) 或各块长度 (tuple), 减少决策变量
+        self.REPLAN_EVERY = 1  # 每k个tick重新求解一次, 其间执行上次求解的开环控制序列 (mpc_forward中错开各车)
+        self.REPLAN_ERROR = 0.5  # [m] 偏离计划轨迹超过该距离时立即重新求解
+        self.REPLAN_OBSTACLE_DISTANCE = 8.0  # [m] 障碍物进入该距离时立即重新求解
+        self.replan_due = True  # 由mpc_forward的调度设置
+        self.SOLUTION_LIBRARY = 0  # >0: 各场景共享的历史解库大小 (每个时域), 冷启动时用最近邻的解热启动, 求解失败时作为备用计划
+        self.KERNELS = None  # 'auto', 'numba' 或 'numpy': 用utils.kernels的数组内核做预测与线性化
+        self.ADAPTIVE_HORIZON = False  # 每个tick按速度/曲率/离终点距离选择MPC时域 (T, DT)
+        self.HORIZON_VARIANTS = ((3, 0.25), (5, 0.2), (8, 0.15))  # 简单/普通/困难工况的 (T, DT)
+        self.EASY_SPEED = 4.0  # [m/s] 低于该速度且路径平直时使用短时域
+        self.HARD_SPEED = 10.0  # [m/s] 高于该速度时使用长时域
+        self.EASY_TURN = 0.05  # [rad] 前方路径的转角 (曲率沿弧长的积分) 低于该值视为直行
+        self.HARD_TURN = 0.3  # [rad] 前方转角高于该值时使用长时域
+        self.HOOKS = HOOKS
+        self.HISTORY_DTYPE = None  # 'float32': 轨迹记录为紧凑的array.array, 输出为float32数组
+        self.HISTORY_LIMIT = None  # 有界轨迹记录 (utils.history.RingBuffer): 'horizon' 只保留输出的步数 (输出不变), 整数N 保留最近N个值
+        self.HISTORY_WINDOWS = False  # 只能与整数HISTORY_LIMIT一起使用 ('horizon'或None时报错): 每N个值作为'history'事件发出, 内存恒定
+        self.history_capacity = None  # setup中由HISTORY_LIMIT确定
+        self.agent_index = -1
+
+        for name, value in MPC_PARAMS.items():
+            setattr(self, name, value)
 
 
     def pi_2_pi(self, angle):
@@ -75,22 +146,14 @@ class SINGLE_MPC:
 
         return angle
 
-    def invalid_filter(self, x, y):
+    def invalid_filter(self, x, y, valid=None):
         '''
-        Description: 去除(-1, -1)的无效坐标，替换成前一个有效坐标值
+        Description: 去除末尾(-1, -1)或valid为0的无效坐标
+                     为了计算曲率，确保waypoints长度为3，不足时按确定的方式外推 (utils.waypoints)
         '''
-        x = x.tolist()
-        y = y.tolist()
-        for i in range(1, len(x)):
-            if(x[-1] == -1 and y[-1] == -1):
-                x.pop()
-                y.pop()
-        # 为了计算曲率，确保waypoints长度为3
-        while(len(x)<3):
-            x.append(x[-1]+random.random())
-            y.append(y[-1]+random.random())
+        x, y, length = waypoints.filter_invalid(x, y, valid)
 
-        return x, y
+        return x[:length].tolist(), y[:length].tolist()
 
     def get_linear_model_matrix(self, v, phi, delta):
         A = np.zeros((self.NX, self.NX))
@@ -211,6 +274,10 @@ class SINGLE_MPC:
 
 
     def predict_motion(self, x0, oa, od, xref):
+        if(self.KERNELS is not None):
+            return kernels.rollout(x0, oa, od, self.DT, self.WB, self.MAX_STEER, self.MAX_SPEED, self.MIN_SPEED,
+                                   backend=self.KERNELS)
+
         xbar = xref * 0.0
         for i, _ in enumerate(x0):
             xbar[i, 0] = x0[i]
@@ -230,24 +297,81 @@ class SINGLE_MPC:
         """
         MPC contorl with updating operational point iteraitvely
         """
+        return run_solve_steps(self.iterative_linear_mpc_steps(xref, x0, dref, oa, od), self.linear_mpc_control)
+
+
+    def iterative_linear_mpc_steps(self, xref, x0, dref, oa, od):
+        '''
+        Description: iterative_linear_mpc_control的分步版本 (生成器): 每次线性化后yield求解请求 (xref, xbar, x0, dref),
+                     由调用者求解后send回linear_mpc_control的结果, 以便多个控制器的问题合并求解 (见run_solve_steps_batch)
+        '''
+        library, start = None, None
+        if(self.SOLUTION_LIBRARY):
+            library = solution_library.shared(self.SOLUTION_LIBRARY)
+            feature = solution_library.features(x0, xref)
         if oa is None or od is None:
-            oa = [0.0] * self.T
-            od = [0.0] * self.T
+            start = 'cold'
+            if(library is not None):
+                guess = library.lookup(feature, self.T, self.DT)
+                if(guess is not None):
+                    start = 'library'
+                    oa, od = guess
+            if(start == 'cold'):
+                oa = [0.0] * self.T
+                od = [0.0] * self.T
+        elif len(oa) != self.T:
+            # 上一次的解来自不同长度的时域 (自适应时域), 截断或用最后一个值填补
+            oa = np.append(oa[:self.T], [oa[-1]] * (self.T - len(oa)))
+            od = np.append(od[:self.T], [od[-1]] * (self.T - len(od)))
+        converged = False
         for i in range(self.MAX_ITER):
             xbar = self.predict_motion(x0, oa, od, xref)
             poa, pod = oa[:], od[:]
-            oa, od, ox, oy, oyaw, ov = self.linear_mpc_control(xref, xbar, x0, dref)
+            oa, od, ox, oy, oyaw, ov = yield (xref, xbar, x0, dref)
+            if(library is not None and (oa is None or od is None)):
+                return self.library_fallback(library, feature, xref, x0)
             if oa is not None and od is not None:
                 du = sum(abs(oa - poa)) + sum(abs(od - pod))  # calc u change value
                 if du <= self.DU_TH:
+                    converged = True
                     break
         else:
             pass
             #print("Iterative is max iter")
 
+        if(library is not None):
+            if(start is not None):
+                library.record_iterations(start, i + 1, converged)
+            library.insert(feature, self.T, self.DT, oa, od)
         return oa, od, ox, oy, oyaw, ov
 
 
+    def library_fallback(self, library, feature, xref, x0):
+        '''
+        Description: 求解失败时的备用计划: 解库中最近邻问题的控制序列及其预测轨迹, 未命中时全为None
+        '''
+        # 不计入热启动的命中统计
+        guess = library.nearest(feature, self.T, self.DT)
+        if(guess is None):
+            return None, None, None, None, None, None
+        library.fallbacks += 1
+        oa, od = guess
+        xbar = self.predict_motion(x0, oa, od, xref)
+        return oa, od, xbar[0, :], xbar[1, :], xbar[3, :], xbar[2, :]
+
+
+    def linear_models(self, xbar, dref):
+        '''
+        Description: 时域内每一步的线性化模型
+        Output: (T, NX, NX), (T, NX, NU), (T, NX) 数组
+        '''
+        if(self.KERNELS is not None):
+            return kernels.linearize(xbar[2, :self.T], xbar[3, :self.T], dref[0, :self.T], self.DT, self.WB,
+                                     backend=self.KERNELS)
+        models = [self.get_linear_model_matrix(xbar[2, t], xbar[3, t], dref[0, t]) for t in range(self.T)]
+        return tuple(np.array(m) for m in zip(*models))
+
+
     def linear_mpc_control(self, xref, xbar, x0, dref):
         """
         linear mpc control
@@ -257,12 +381,19 @@ class SINGLE_MPC:
         x0: initial state
         dref: reference steer angle
         """
+        if(self.SOLVER == 'ADMM'):
+            (solution,) = linear_mpc_control_batch([self], [(xref, xbar, x0, dref)])
+            return solution
+        if(self.COMPILED_PROBLEM):
+            return self.linear_mpc_control_compiled(xref, xbar, x0, dref)
 
         x = cvxpy.Variable((self.NX, self.T + 1))
-        u = cvxpy.Variable((self.NU, self.T))
+        u, u_free, boundaries = mpc_problem.blocked_input(
+            self.NU, self.T, mpc_problem.move_blocks(self.T, self.MOVE_BLOCKING))
 
         cost = 0.0
         constraints = []
+        A, B, C = self.linear_models(xbar, dref)
 
         for t in range(self.T):
             cost += cvxpy.quad_form(u[:, t], self.R)
@@ -270,11 +401,9 @@ class SINGLE_MPC:
             if t != 0:
                 cost += cvxpy.quad_form(xref[:, t] - x[:, t], self.Q)
 
-            A, B, C = self.get_linear_model_matrix(
-                xbar[2, t], xbar[3, t], dref[0, t])
-            constraints += [x[:, t + 1] == A @ x[:, t] + B @ u[:, t] + C]
+            constraints += [x[:, t + 1] == A[t] @ x[:, t] + B[t] @ u[:, t] + C[t]]
 
-            if t < (self.T - 1):
+            if t in boundaries:
                 cost += cvxpy.quad_form(u[:, t + 1] - u[:, t], self.Rd)
                 constraints += [cvxpy.abs(u[1, t + 1] - u[1, t]) <=
                                 self.MAX_DSTEER * self.DT]
@@ -284,12 +413,52 @@ class SINGLE_MPC:
         constraints += [x[:, 0] == x0]
         constraints += [x[2, :] <= self.MAX_SPEED]
         constraints += [x[2, :] >= self.MIN_SPEED]
-        constraints += [cvxpy.abs(u[0, :]) <= self.MAX_ACCEL]
-        constraints += [cvxpy.abs(u[1, :]) <= self.MAX_STEER]
+        constraints += [cvxpy.abs(u_free[0, :]) <= self.MAX_ACCEL]
+        constraints += [cvxpy.abs(u_free[1, :]) <= self.MAX_STEER]
+
+        if(self.COLLISION_CONSTRAINTS and len(self.collision_obstacles)):
+            n, b = collision.halfplanes(xbar, self.collision_obstacles, self.DT, self.COLLISION_DISTANCE,
+                                        len(self.collision_obstacles))
+            slack = cvxpy.Variable(b.shape, nonneg=True)
+            for j in range(len(b)):
+                constraints += [cvxpy.multiply(n[j, :, 0], x[0, 1:]) + cvxpy.multiply(n[j, :, 1], x[1, 1:])
+                                >= b[j] - slack[j]]
+            cost += self.COLLISION_SLACK_WEIGHT * cvxpy.sum(slack)
 
         prob = cvxpy.Problem(cvxpy.Minimize(cost), constraints)
-        prob.solve(solver=cvxpy.ECOS, verbose=False)
+        solve_start = time.perf_counter()
+        prob.solve(solver=self.SOLVER, verbose=False)
+        self.emit_solve(prob, solve_start)
+
+        return self.unpack_solution(prob, x, u)
+
 
+    def linear_mpc_control_compiled(self, xref, xbar, x0, dref):
+        '''
+        Description: 同linear_mpc_control, 但复用按结构缓存的参数化问题 (utils.mpc_problem), 只更新模型/参考/初始状态
+        '''
+        problem = mpc_problem.PROBLEM_CACHE.get(self)
+        problem.set_models(*self.linear_models(xbar, dref))
+        if(problem.obstacle_slots):
+            problem.set_halfplanes(*collision.halfplanes(xbar, self.collision_obstacles, self.DT,
+                                                         self.COLLISION_DISTANCE, problem.obstacle_slots))
+
+        solve_start = time.perf_counter()
+        problem.solve(xref, x0, self.SOLVER)
+        self.emit_solve(problem.problem, solve_start)
+
+        return self.unpack_solution(problem.problem, problem.x, problem.u)
+
+
+    def emit_solve(self, prob, solve_start):
+        if self.HOOKS is not None and self.HOOKS.wants('solve'):
+            stats = prob.solver_stats
+            self.HOOKS.emit('solve', agent=self.agent_index, status=prob.status,
+                            horizon=self.T, dt=self.DT, iterations=getattr(stats, 'num_iters', None),
+                            solve_time=time.perf_counter() - solve_start, cost=prob.value)
+
+
+    def unpack_solution(self, prob, x, u):
         if prob.status == cvxpy.OPTIMAL:
             ox = self.get_nparray_from_matrix(x.value[0, :])
             oy = self.get_nparray_from_matrix(x.value[1, :])
@@ -346,6 +515,66 @@ class SINGLE_MPC:
         return xref, ind, dref
 
 
+    def calc_ref_trajectory_frenet(self, state, path, s_prev):
+        '''
+        Description: 将当前位置投影到弧长参数化的参考轨迹上, 在 s + v*k*DT 处插值得到参考点,
+                     不依赖waypoints间距均匀
+        Input: path: utils.frenet.ArcLengthPath; s_prev: 上一时刻的弧长
+        Output: xref, s, dref, 横向误差
+        '''
+        window = self.N_IND_SEARCH * max(self.DL, abs(state.v) * self.DT)
+        s, e, _ = path.project(state.x, state.y, s_hint=s_prev, window=window)
+        s = max(s, s_prev)
+
+        travel = s + abs(state.v) * self.DT * np.arange(self.T + 1)
+        rx, ry, ryaw, rv = path.interpolate(travel)
+        xref = np.array([rx, ry, rv, ryaw])
+        dref = np.zeros((1, self.T + 1))  # steer operational point should be 0
+
+        return xref, s, dref, e
+
+
+    def select_horizon(self):
+        '''
+        Description: 自适应时域策略: 低速直行或接近终点时用短时域, 高速或前方弯道用长且细的时域.
+                     弯道程度为最长时域内将要行驶的路径上曲率ck沿弧长的积分 (转角), 静止车辆的抖动点不计入
+        Output: HORIZON_VARIANTS中的 (T, DT)
+        '''
+        v = abs(self.state.v)
+        T_max, DT_max = max(self.HORIZON_VARIANTS, key=lambda variant: variant[0] * variant[1])
+        preview = v * T_max * DT_max
+        ind = self.target_ind
+        window = slice(ind, ind + self.N_IND_SEARCH * 5 + 1)
+        ds = np.hypot(np.diff(self.cx[window]), np.diff(self.cy[window]))
+        inside = np.cumsum(ds) <= preview
+        turn = float(np.sum(np.abs(np.asarray(self.ck[ind + 1:ind + 1 + len(ds)]))[inside] * ds[inside]))
+        goal_distance = math.hypot(self.state.x - self.goal[0], self.state.y - self.goal[1])
+
+        if(turn >= self.HARD_TURN or v >= self.HARD_SPEED):
+            level = 2
+        elif(turn <= self.EASY_TURN and v <= self.EASY_SPEED):
+            level = 0
+        else:
+            level = 1
+        T, DT = self.HORIZON_VARIANTS[min(1, len(self.HORIZON_VARIANTS) - 1)]
+        if(goal_distance <= v * T * DT):
+            level = 0  # 参考轨迹在时域内已到终点
+        return self.HORIZON_VARIANTS[min(level, len(self.HORIZON_VARIANTS) - 1)]
+
+
+    @contextlib.contextmanager
+    def planning_horizon(self, T, DT):
+        '''
+        Description: 规划时临时使用时域 (T, DT), 仿真步长仍为原来的DT
+        '''
+        simulation = self.T, self.DT
+        self.T, self.DT = T, DT
+        try:
+            yield
+        finally:
+            self.T, self.DT = simulation
+
+
     def check_goal(self, state, goal, tind, nind):
 
         # check goal
@@ -368,31 +597,17 @@ class SINGLE_MPC:
 
     def calc_speed_profile(self, cx, cy, cyaw, target_speed):
         '''
-        Description: 计算每一个坐标对应的速度方向
+        Description: 计算每一个坐标对应的速度方向 (整条轨迹一次计算, 角度用kernels.wrap_angle限制在[-pi, pi])
         '''
-        speed_profile = [target_speed] * len(cx)
-        direction = 1.0  # forward
-
-        # Set stop point
-        for i in range(len(cx) - 1):
-            dx = cx[i + 1] - cx[i]
-            dy = cy[i + 1] - cy[i]
-
-            move_direction = math.atan2(dy, dx)
-
-            if dx != 0.0 and dy != 0.0:
-                dangle = abs(self.pi_2_pi(move_direction - cyaw[i]))
-                if dangle >= math.pi / 4.0:
-                    direction = -1.0
-                else:
-                    direction = 1.0
-
-            if direction != 1.0:
-                speed_profile[i] = - target_speed
-            else:
-                speed_profile[i] = target_speed
+        cx, cy, cyaw = np.asarray(cx, dtype=float), np.asarray(cy, dtype=float), np.asarray(cyaw, dtype=float)
+        dx, dy = np.diff(cx), np.diff(cy)
+        dangle = np.abs(kernels.wrap_angle(np.arctan2(dy, dx) - cyaw[:-1], self.KERNELS or 'numpy'))
+        # 只有dx, dy都不为0时更新方向, 否则沿用上一个点的方向 (初始为前进)
+        defined = (dx != 0.0) & (dy != 0.0)
+        last = np.maximum.accumulate(np.where(defined, np.arange(len(dx)), -1))
+        backward = (last >= 0) & (dangle[np.maximum(last, 0)] >= math.pi / 4.0)
 
-        speed_profile[-1] = 0.0
+        speed_profile = np.where(backward, -target_speed, target_speed).tolist() + [0.0]  # 终点停车
 
         return speed_profile
 
@@ -420,13 +635,40 @@ class SINGLE_MPC:
         return cx, cy, cyaw, ck
 
 
-    def calc_v(self, distance, v):
+    def detection_range(self, v):
         ratio = 1.25
         if(v<=12.0):
             detect_range = 12.0*ratio
         else:
             detect_range = v*ratio
-        obstacle_distance_range = detect_range #meter
+        return detect_range
+
+
+    def interaction_reach(self, ticks):
+        '''
+        Description: 接下来ticks个tick内该车可能与其他车辆相互影响的距离 (分区仿真用): 最大探测距离加上期间的最大位移
+        '''
+        if(self.OBSTACLE_AVOIDANCE):
+            speed = max(self.MAX_SPEED, abs(self.MIN_SPEED), abs(self.state.v))
+            step = speed * self.DT
+        else:
+            # 主车按waypoints回放
+            step = float(np.max(np.hypot(np.diff(self.cx), np.diff(self.cy)))) if len(self.cx) > 1 else 0.0
+            speed = step / self.DT
+        return partition.reach_after(self.detection_range(speed), step, ticks)
+
+
+    def obstacle_info(self):
+        '''
+        Description: 该车作为其他车辆的障碍物: 下一个tick的位置与当前速度 [x, y, vx, vy]
+        '''
+        obs_x = self.state.x + self.state.v*math.cos(self.state.yaw)*self.DT
+        obs_y = self.state.y + self.state.v*math.sin(self.state.yaw)*self.DT
+        return [obs_x, obs_y, self.state.v*math.cos(self.state.yaw), self.state.v*math.sin(self.state.yaw)]
+
+
+    def calc_v(self, distance, v):
+        obstacle_distance_range = self.detection_range(v) #meter
         if(distance<=obstacle_distance_range):
             return (obstacle_distance_range - distance)
         else:
@@ -460,15 +702,64 @@ class SINGLE_MPC:
         return yaw, k
 
 
-    def setup(self, original_data, index):
-        self.data = copy.deepcopy(original_data)
-        self.x_data = self.data['state/future/x'][index]
-        self.y_data = self.data['state/future/y'][index]
+    def course_key(self, x, y, smoothing=False, valid=None):
+        '''
+        Description: 参考轨迹缓存的键, 由原始waypoints和预处理参数决定
+        '''
+        arrays = (x, y) if valid is None else (x, y, valid)
+        return course_cache.make_key(*arrays, DL=self.DL, TARGET_SPEED=self.TARGET_SPEED,
+                                     SPLINE_SMOOTHING=bool(smoothing))
+
+
+    def prepare_course(self, x, y, course=None, smoothing=False, valid=None):
+        '''
+        Description: 由原始waypoints计算参考轨迹 (cx, cy, cyaw, ck, sp)
+        Input: x, y: m2i输入的原始waypoints; course: 预先拟合好的三次样条轨迹; smoothing: 是否做样条平滑;
+               valid: state/future/valid
+        Output: x_data, y_data, cx, cy, cyaw, ck, sp
+        '''
+        x_data, y_data = self.invalid_filter(x, y, valid)
+
+        if course is not None and len(course[0]) >= 2:
+            # 预先批量拟合好的三次样条轨迹 (get_switch_back_courses)
+            cx, cy, cyaw, ck = [list(c) for c in course[:4]]
+        elif smoothing:
+            try:
+                # 通过三次样条曲线拟合轨迹，平滑处理
+                cx, cy, cyaw, ck = self.get_switch_back_course(self.DL, x_data, y_data)
+                if len(cx) < 2:
+                    raise ValueError("spline course too short")
+            except Exception:
+                # 直接拿m2i输入的轨迹来用
+                cx, cy = x_data, y_data
+                cyaw, ck = self.calc_yaw_and_k(cx, cy)
+        else:
+            # 直接拿m2i输入的轨迹来用
+            cx, cy = x_data, y_data
+            cyaw, ck = self.calc_yaw_and_k(cx, cy)
+        cyaw = self.smooth_yaw(cyaw)
+
+        sp = self.calc_speed_profile(cx, cy, cyaw, self.TARGET_SPEED)
+        return x_data, y_data, cx, cy, cyaw, ck, sp
+
+
+    def setup(self, original_data, index, course=None, smoothing=False):
+        self.data = original_data  # 只读, 不需要拷贝整个场景
+        self.agent_index = index
+        if(self.HISTORY_WINDOWS and (self.HISTORY_LIMIT is None or self.HISTORY_LIMIT == 'horizon')):
+            raise ValueError('HISTORY_WINDOWS needs an integer HISTORY_LIMIT, not ' + repr(self.HISTORY_LIMIT))
+        if(self.HISTORY_LIMIT == 'horizon'):
+            # mpc_forward只输出waypoints数-1步
+            self.history_capacity = max(self.data['state/future/x'].shape[1] - 1, 1)
+        else:
+            self.history_capacity = self.HISTORY_LIMIT
+        raw_x = self.data['state/future/x'][index]
+        raw_y = self.data['state/future/y'][index]
+        raw_valid = self.data['state/future/valid'][index] if 'state/future/valid' in self.data else None
 
-        #self.x_data = self.x_data[6:]
-        #self.y_data = self.y_data[6:]
+        #raw_x = raw_x[6:]
+        #raw_y = raw_y[6:]
 
-        self.x_data, self.y_data = self.invalid_filter(self.x_data, self.y_data)
         self.length_data = self.data['state/past/length'][index]
         self.width_data = self.data['state/past/width'][index]
 
@@ -495,22 +786,19 @@ class SINGLE_MPC:
             self.average_width = 2
         else:
             self.average_width = self.average_width/available_width_num
-        
-        # try:
-        #     # 通过三次样条曲线拟合轨迹，平滑处理
-        #     self.cx, self.cy, self.cyaw, self.ck = self.get_switch_back_course(self.DL, self.x_data, self.y_data)
-        # except:
-        # # 直接拿m2i输入的轨迹来用
-        #     self.cx, self.cy = self.x_data, self.y_data
-        #     self.cyaw, self.ck = self.calc_yaw_and_k(self.cx, self.cy)
-        #     self.cyaw = self.smooth_yaw(self.cyaw)
-
-        # 直接拿m2i输入的轨迹来用
-        self.cx, self.cy = self.x_data, self.y_data
-        self.cyaw, self.ck = self.calc_yaw_and_k(self.cx, self.cy)
-        self.cyaw = self.smooth_yaw(self.cyaw)
-
-        self.sp = self.calc_speed_profile(self.cx, self.cy, self.cyaw, self.TARGET_SPEED)
+
+        # 参考轨迹, 缓存命中时直接查表
+        key, prepared = None, None
+        if self.COURSE_CACHE is not None:
+            key = self.course_key(raw_x, raw_y, smoothing, raw_valid)
+            prepared = self.COURSE_CACHE.get(key)
+        if prepared is None:
+            prepared = self.prepare_course(raw_x, raw_y, course, smoothing, raw_valid)
+            if key is not None:
+                self.COURSE_CACHE.put(key, prepared)
+        (self.x_data, self.y_data, self.cx, self.cy,
+         self.cyaw, self.ck, self.sp) = [list(c) for c in prepared]
+
         # 计算初始速度
         if(len(self.cx) >= 2):
             self.initial_vx = (self.cx[1] - self.cx[0])/self.DT
@@ -529,33 +817,103 @@ class SINGLE_MPC:
             self.state.yaw += math.pi * 2.0
 
         self.time = 0.0
-        self.x = [self.state.x]
-        self.y = [self.state.y]
-        self.yaw = [self.state.yaw]
-        self.v = [self.state.v]
-        self.vel_x = [self.state.v * math.cos(self.state.yaw)]
-        self.vel_y = [self.state.v * math.sin(self.state.yaw)]
-        self.vel_yaw = [0]
-        self.t = [0.0]
-        self.d = [0.0]
-        self.a = [0.0]
+        self.x = self.new_history(self.state.x)
+        self.y = self.new_history(self.state.y)
+        self.yaw = self.new_history(self.state.yaw)
+        self.v = self.new_history(self.state.v)
+        self.vel_x = self.new_history(self.state.v * math.cos(self.state.yaw))
+        self.vel_y = self.new_history(self.state.v * math.sin(self.state.yaw))
+        self.vel_yaw = self.new_history(0)
+        self.t = self.new_history(0.0)
+        self.d = self.new_history(0.0)
+        self.a = self.new_history(0.0)
         
         self.target_ind, _ = self.calc_nearest_index(self.state, self.cx, self.cy, self.cyaw, 0)
+        if(self.FRENET_TRACKING):
+            self.path = frenet.ArcLengthPath(self.cx, self.cy, self.cyaw, self.sp)
+            self.target_s, self.lateral_error, self.target_ind = self.path.project(
+                self.state.x, self.state.y, s_hint=0.0, window=self.N_IND_SEARCH * self.DL)
         self.odelta, self.oa = None, None
         self.ai, self.di = 0, 0
+        self.plan_step, self.plan_dt = 0, self.DT
+        self.replans = {'scheduled': 0, 'expired': 0, 'error': 0, 'obstacle': 0}
 
         self.index = 0
         self.reached_goal = 0
 
-        self.state_future_vel_yaw = []
-        self.state_future_velocity_x = []
-        self.state_future_velocity_y = []
+        self.state_future_vel_yaw = self.new_history()
+        self.state_future_velocity_x = self.new_history()
+        self.state_future_velocity_y = self.new_history()
 
         self.main_car_path_index = 0
         self.vel_yaw_cache = 0
+
+
+    def new_history(self, *values):
+        '''
+        Description: 新建轨迹记录, 默认为list; 设置HISTORY_DTYPE时为该类型的array.array (float32每个值4字节);
+                     设置HISTORY_LIMIT时为固定大小的utils.history.RingBuffer
+        '''
+        if(self.history_capacity is not None):
+            if(self.HISTORY_LIMIT == 'horizon'):
+                keep = 'first'
+            else:
+                keep = 'windows' if self.HISTORY_WINDOWS else 'last'
+            record = history.RingBuffer(self.history_capacity, self.HISTORY_DTYPE or float, keep)
+            for value in values:
+                record.append(value)
+            return record
+        if(self.HISTORY_DTYPE is None):
+            return list(values)
+        return array.array(np.dtype(self.HISTORY_DTYPE).char, values)
+
+
+    def emit_history_windows(self, flush=False):
+        '''
+        Description: HISTORY_WINDOWS时将轨迹记录中已满的窗口 (flush时包括未满的) 作为'history'事件发出
+        '''
+        for field in HISTORY_FIELDS:
+            record = getattr(self, field)
+            for start, values in record.take_windows(flush):
+                if(self.HOOKS is not None):
+                    self.HOOKS.emit('history', agent=self.agent_index, field=field, start=start, values=values)
         
 
+    def replan_reason(self, obs_cache):
+        '''
+        Description: 多速率重规划: 是否需要重新求解MPC, 否则继续执行上次求解的控制序列
+        Output: 重规划原因 ('scheduled', 'expired', 'error', 'obstacle'), 不需要时为None
+        '''
+        if(self.REPLAN_EVERY <= 1 or self.replan_due):
+            return 'scheduled'
+        step = int(round((self.plan_step + 1) * self.DT / self.plan_dt))
+        if(self.odelta is None or self.ox is None or step >= len(self.odelta)):
+            return 'expired'
+        if(math.hypot(self.state.x - self.ox[step], self.state.y - self.oy[step]) > self.REPLAN_ERROR):
+            return 'error'
+        if(len(obs_cache)):
+            obstacles = np.asarray(obs_cache, dtype=float)
+            if(np.min(np.hypot(obstacles[:, 0] - self.state.x, obstacles[:, 1] - self.state.y)) < self.REPLAN_OBSTACLE_DISTANCE):
+                return 'obstacle'
+        return None
+
+
+    def mark_goal_reached(self):
+        if(self.reached_goal == 0 and self.HOOKS is not None):
+            self.HOOKS.emit('goal_reached', agent=self.agent_index, time=self.time,
+                            x=self.state.x, y=self.state.y)
+        self.reached_goal = 1
+
+
     def update(self, obs_cache):
+        return run_solve_steps(self.update_steps(obs_cache), self.linear_mpc_control)
+
+
+    def update_steps(self, obs_cache):
+        '''
+        Description: update的分步版本 (生成器), MPC求解请求由调用者求解 (见iterative_linear_mpc_steps)
+        Output: 同update, 作为生成器的返回值
+        '''
         if(self.time < self.MAX_TIME):
             if(math.sqrt((self.state.x - self.goal[0])**2+(self.state.y - self.goal[1])**2) < self.XY_GOAL_TOLERANCE):
                 return 1
@@ -568,18 +926,44 @@ class SINGLE_MPC:
             self.state_future_velocity_x.append(self.state.v*math.cos(self.state.yaw))
             self.state_future_velocity_y.append(self.state.v*math.sin(self.state.yaw))
             
+            # 选取碰撞约束的障碍物
+            if(self.OBSTACLE_AVOIDANCE and self.COLLISION_CONSTRAINTS):
+                self.collision_obstacles = collision.select_obstacles(
+                    self.state.x, self.state.y, self.state.v*math.cos(self.state.yaw), self.state.v*math.sin(self.state.yaw),
+                    obs_cache, self.MAX_OBSTACLE_CONSTRAINTS, self.COLLISION_DISTANCE, self.detection_range(self.state.v))
+
             # 更新MPC
             try:
-                self.xref, self.target_ind, self.dref = self.calc_ref_trajectory(
-                    self.state, self.cx, self.cy, self.cyaw, self.ck, self.sp, self.DL, self.target_ind)
+                replan = self.replan_reason(obs_cache)
+                horizon = self.select_horizon() if self.ADAPTIVE_HORIZON else (self.T, self.DT)
+                with self.planning_horizon(*horizon):
+                    if(self.FRENET_TRACKING):
+                        self.xref, self.target_s, self.dref, self.lateral_error = self.calc_ref_trajectory_frenet(
+                            self.state, self.path, self.target_s)
+                        self.target_ind = self.path.index(self.target_s)
+                    else:
+                        self.xref, self.target_ind, self.dref = self.calc_ref_trajectory(
+                            self.state, self.cx, self.cy, self.cyaw, self.ck, self.sp, self.DL, self.target_ind)
 
-                self.x0 = [self.state.x, self.state.y, self.state.v, self.state.yaw]  # current state
+                    self.x0 = [self.state.x, self.state.y, self.state.v, self.state.yaw]  # current state
 
-                self.oa, self.odelta, self.ox, self.oy, self.oyaw, self.ov = self.iterative_linear_mpc_control(
-                    self.xref, self.x0, self.dref, self.oa, self.odelta)
+                    if(replan is not None):
+                        self.oa, self.odelta, self.ox, self.oy, self.oyaw, self.ov = yield from self.iterative_linear_mpc_steps(
+                            self.xref, self.x0, self.dref, self.oa, self.odelta)
+                        self.plan_step, self.plan_dt = 0, self.DT
 
-                if self.odelta is not None:
-                    self.di, self.ai = self.odelta[0], self.oa[0]
+                if(replan is None):
+                    # 执行上次求解的开环控制序列
+                    self.plan_step += 1
+                    step = int(round(self.plan_step * self.DT / self.plan_dt))
+                    self.di, self.ai = self.odelta[step], self.oa[step]
+                else:
+                    if(self.REPLAN_EVERY > 1):
+                        self.replans[replan] += 1
+                        if(self.HOOKS is not None):
+                            self.HOOKS.emit('replan', agent=self.agent_index, reason=replan, time=self.time)
+                    if self.odelta is not None:
+                        self.di, self.ai = self.odelta[0], self.oa[0]
             except:
                 self.di, self.ai = 0, 0
             
@@ -587,7 +971,8 @@ class SINGLE_MPC:
                 # 计算障碍物距离以及方向单位向量
                 self.distances = []
                 self.orientations = []
-                for self.obstacle in obs_cache:
+                # 使用碰撞约束时已在MPC中避障, 不再计算势场
+                for self.obstacle in ([] if self.COLLISION_CONSTRAINTS else obs_cache):
                     self.obs_x = self.obstacle[0]
                     self.obs_y = self.obstacle[1]
                     self.distance = math.sqrt((self.state.x - self.obs_x)**2+(self.state.y - self.obs_y)**2)
@@ -596,6 +981,7 @@ class SINGLE_MPC:
                 
                 # 人工势场法被动避障矢量方向
                 self.force = [0, 0]
+                obstacles_in_cone = 0
                 for self.dd in range(len(self.distances)):
                     temp_psi = self.pi_2_pi(np.arctan2(self.orientations[self.dd][1], self.orientations[self.dd][0]))
                     temp_car_psi = self.pi_2_pi(self.state.yaw)
@@ -605,6 +991,7 @@ class SINGLE_MPC:
                     if(abs(temp_delta_psi)<=dangle or abs(temp_delta_psi)>=math.pi-dangle):
                         self.distance = self.distances[self.dd]
                         self.vv = self.calc_v(self.distance, self.state.v)
+                        obstacles_in_cone += 1
                         self.force[0] += self.vv*self.orientations[self.dd][0]
                         self.force[1] += self.vv*self.orientations[self.dd][1]
                 
@@ -612,6 +999,9 @@ class SINGLE_MPC:
                 if(self.reached_goal == 0):
                     # 通过人工势场法进行被动避障
                     if(self.force[0] != 0 or self.force[1] != 0):
+                        if self.HOOKS is not None:
+                            self.HOOKS.emit('avoidance', agent=self.agent_index, force=math.hypot(self.force[0], self.force[1]),
+                                            obstacles=obstacles_in_cone)
                         self.pf_vx = -self.force[0]
                         self.pf_vy = -self.force[1]
                         self.mpc_vx = (self.state.v+self.ai*self.DT)*math.cos(self.state.yaw)
@@ -625,10 +1015,10 @@ class SINGLE_MPC:
                         self.car_psi = self.pi_2_pi(self.state.yaw)
                         self.delta_psi = self.pi_2_pi(self.psi - self.car_psi)
                         self.u0 = self.vv*math.cos(self.delta_psi)
-                        self.di_part = 0.5
+                        self.di_part = self.DI_PART
                         self.u1 = (self.di*self.di_part + self.delta_psi*(1-self.di_part))*2
                         #ai = (u0-state.v)/DT
-                        self.ai_part = 0.9
+                        self.ai_part = self.AI_PART
                         self.ai = self.ai*self.ai_part + (self.u0-self.state.v)/self.DT*(1-self.ai_part)
                         if(self.ai<0):
                             self.u1 = -self.u1
@@ -662,11 +1052,11 @@ class SINGLE_MPC:
                 self.a.append(self.ai)
 
                 if self.check_goal(self.state, self.goal, self.target_ind, len(self.cx)):
-                    self.reached_goal = 1
+                    self.mark_goal_reached()
                     #print("Goal")
                 
                 if(math.sqrt((self.state.x - self.goal[0])**2+(self.state.y - self.goal[1])**2) < self.XY_GOAL_TOLERANCE):
-                    self.reached_goal = 1
+                    self.mark_goal_reached()
                     #print("Goal")
 
                 if self.SHOW_ANIMATION:  # pragma: no cover
@@ -707,7 +1097,7 @@ class SINGLE_MPC:
                     self.main_car_path_index += 1
                     self. vel_yaw_cache = self.state.yaw
                 else:
-                    self.reached_goal = 1
+                    self.mark_goal_reached()
 
                 if self.SHOW_ANIMATION:  # pragma: no cover
                     plt.plot(self.cx, self.cy, "-r", label="course")
@@ -721,6 +1111,99 @@ class SINGLE_MPC:
             return 1
 
 
+def run_solve_steps(steps, solve):
+    '''
+    Description: 执行分步的求解过程 (iterative_linear_mpc_steps/update_steps), 每个求解请求由solve(*request)求解,
+                 求解出错时将异常抛回分步过程中 (与直接调用时相同的位置)
+    Output: 分步过程的返回值
+    '''
+    try:
+        request = next(steps)
+        while True:
+            try:
+                solution = solve(*request)
+            except Exception as e:
+                request = steps.throw(e)
+            else:
+                request = steps.send(solution)
+    except StopIteration as stop:
+        return stop.value
+
+
+def run_solve_steps_batch(cars, steps):
+    '''
+    Description: 同时执行多个控制器的分步求解过程, 每轮把所有控制器的求解请求合并为一次批量求解 (linear_mpc_control_batch),
+                 问题结构不同 (时域/约束) 的控制器分组求解
+    Output: 各控制器分步过程的返回值
+    '''
+    results = [None] * len(steps)
+    pending = {}
+
+    def advance(i, solution=None, error=None):
+        try:
+            pending[i] = steps[i].throw(error) if error is not None else steps[i].send(solution)
+        except StopIteration as stop:
+            results[i] = stop.value
+
+    for i in range(len(steps)):
+        advance(i)
+    while(pending):
+        groups = {}
+        for i in sorted(pending):
+            groups.setdefault(mpc_problem.problem_key(cars[i]), []).append(i)
+        requests = dict(pending)
+        pending.clear()
+        for group in groups.values():
+            try:
+                solutions = linear_mpc_control_batch([cars[i] for i in group], [requests[i] for i in group])
+            except Exception as e:
+                for i in group:
+                    advance(i, error=e)
+            else:
+                for i, solution in zip(group, solutions):
+                    advance(i, solution)
+    return results
+
+
+def linear_mpc_control_batch(cars, requests):
+    '''
+    Description: 多个控制器的linear_mpc_control合并为一次批量ADMM求解 (utils.mpc_problem.CondensedMPC, utils.batch_qp),
+                 各控制器用上次的解热启动, 收敛后即停止迭代; 控制器需有相同的问题结构 (problem_key)
+    Input: requests: 每个控制器的 (xref, xbar, x0, dref)
+    Output: 每个控制器的 (oa, odelta, ox, oy, oyaw, ov), 未收敛时全为None
+    '''
+    car = cars[0]
+    problem = mpc_problem.CONDENSED_CACHE.get(car)
+    models = [c.linear_models(xbar, dref) for c, (xref, xbar, x0, dref) in zip(cars, requests)]
+    A, B, C = (np.array([m[k] for m in models]) for k in range(3))
+    xref = np.array([np.asarray(r[0], dtype=float) for r in requests])
+    x0 = np.array([np.asarray(r[2], dtype=float) for r in requests])
+    n = b = None
+    if(problem.obstacle_slots):
+        halfplanes = [collision.halfplanes(r[1], c.collision_obstacles, c.DT, c.COLLISION_DISTANCE, problem.obstacle_slots)
+                      for c, r in zip(cars, requests)]
+        n = np.array([h[0] for h in halfplanes])
+        b = np.array([h[1] for h in halfplanes])
+
+    solve_start = time.perf_counter()
+    result, x, u, cost = problem.solve(A, B, C, xref, x0, n, b, warm_start=[c.admm_warm_start for c in cars],
+                                       eps_abs=car.ADMM_EPS, eps_rel=car.ADMM_EPS, max_iter=car.ADMM_MAX_ITER)
+    solve_time = (time.perf_counter() - solve_start) / len(cars)
+
+    solutions = []
+    for k, c in enumerate(cars):
+        c.admm_warm_start = (result.z[k], result.y[k])
+        if c.HOOKS is not None and c.HOOKS.wants('solve'):
+            c.HOOKS.emit('solve', agent=c.agent_index, status=result.status[k], horizon=c.T, dt=c.DT,
+                         iterations=int(result.iterations[k]), solve_time=solve_time, cost=float(cost[k]))
+        if(result.status[k] == batch_qp.OPTIMAL):
+            solutions.append((u[k, 0].copy(), u[k, 1].copy(), x[k, 0].copy(), x[k, 1].copy(), x[k, 3].copy(), x[k, 2].copy()))
+        else:
+            # 未收敛的状态已通过'solve'事件报告
+            solutions.append((None, None, None, None, None, None))
+    return solutions
+
+
 def progressBar(i, max, text):
     """
     Print a progress bar during training.
@@ -741,19 +1224,8 @@ def save_pkl(pkl_data,file_name):
     with open(file_name, 'wb') as f:
         pickle.dump(pkl_data, f)
 
-def fuck(inp, fi):
-    i, f = int(fi // 1), fi % 1  # Split floating-point index into whole & fractional parts.
-    j = i+1 if f > 0 else i  # Avoid index error.
-    if(i>=len(inp)):
-        i = -1
-    if(j>=len(inp)):
-        j = -1
-    return (1-f) * inp[i] + f * inp[j]
-
 def interpolate(original_list, new_len):
-    delta = (len(original_list)-1) / (new_len-1)
-    output = [fuck(original_list, i*delta) for i in range(new_len)]
-    return output
+    return resample.resample_linear(original_list, new_len).tolist()
 
 def list2mat(data, target_length):
     # 填补数据
@@ -772,9 +1244,55 @@ def list2mat(data, target_length):
             mat_data = np.vstack((mat_data, data[i]))
     return mat_data
 
-def mpc_forward(original_data):
-    # 读取数据
-    data = copy.deepcopy(original_data)
+def resample_output(values, dt, output_dt, wrap=False):
+    '''
+    Description: 将每dt秒一个值的输出矩阵 (车辆 x 步数) 线性重采样为每output_dt秒一个值, 步数不变, 超出仿真时长的部分保持最后一个值;
+                 wrap: 角度, 先展开再插值, 结果限制在[-pi, pi]
+    '''
+    array = np.asarray(values, dtype=float)
+    if(wrap):
+        array = np.unwrap(array, axis=1)
+    out = resample.resample_time(array, dt, output_dt, array.shape[1])
+    if(wrap):
+        out = kernels.wrap_angle(out, 'numpy')
+    out = out.astype(np.asarray(values).dtype)
+    return np.asmatrix(out) if isinstance(values, np.matrix) else out
+
+def list2array(data, target_length, dtype):
+    '''
+    Description: list2mat的数组版本, 各行截断或用最后一个值填补到target_length, 输出dtype类型的ndarray
+    '''
+    mat_data = np.empty((len(data), target_length), dtype=dtype)
+    for i, row in enumerate(data):
+        row = np.asarray(row, dtype=dtype)[:target_length]
+        mat_data[i, :len(row)] = row
+        mat_data[i, len(row):] = row[-1]
+    return mat_data
+
+def get_switch_back_courses(data, dl, skip=()):
+    '''
+    Description: 一次性为场景中所有车辆拟合三次样条轨迹 (batched get_switch_back_course)
+    Output: list of (cx, cy, cyaw, ck, s), None for agents in skip
+    '''
+    car_num = len(data['state/id'])
+    ax, ay, lengths = waypoints.filter_invalid(
+        data['state/future/x'], data['state/future/y'], data.get('state/future/valid'))
+
+    courses = cubic_spline_planner.calc_spline_course_batch(ax, ay, lengths, ds=dl)
+    return [None if i in skip else courses[i] for i in range(car_num)]
+
+
+def mpc_forward(original_data, checkpoint_dir=None, checkpoint_every=0, hooks=None):
+    '''
+    Description: 对场景中所有车辆进行MPC仿真
+    Input: checkpoint_dir, checkpoint_every: 每checkpoint_every个tick将整个车队的状态保存到checkpoint_dir,
+           再次运行同一场景时从最近的检查点继续;
+           hooks: utils.hooks.Hooks, 默认使用模块的HOOKS
+    Output: m2i格式的仿真结果
+    '''
+    hooks = HOOKS if hooks is None else hooks
+    # 读取数据 (只读, 不拷贝; 场景库的输入为memmap视图)
+    data = original_data
     wp_length = data['state/future/x'].shape[1]
     print('mpc input waypoints length: '+str(wp_length))
     # 读取轨迹数量
@@ -786,79 +1304,555 @@ def mpc_forward(original_data):
         if(is_main_car[i] == 1):
             main_car_index = i
 
-    # 初始化对应数量的MPC控制器
-    for i in range(car_num):
-        locals()['car'+str(i)] = SINGLE_MPC()
-        locals()['car'+str(i)].setup(data, i)
-        if(i==main_car_index):
-            locals()['car'+str(i)].OBSTACLE_AVOIDANCE = False
-
-    # 初始化记录数据m2i_data = data
-    m2i_data = copy.deepcopy(data)
-    m2i_data['state/future/x'] = []
-    m2i_data['state/future/y'] = []
-    m2i_data['state/future/bbox_yaw'] = []
-    m2i_data['state/future/vel_yaw'] = []
-    m2i_data['state/future/velocity_x'] = []
-    m2i_data['state/future/velocity_y'] = []
+    # 从检查点恢复
+    ckpt_path, ckpt_key, fleet = None, None, None
+    if(checkpoint_dir is not None and checkpoint_every > 0):
+        ckpt_key = course_cache.make_key(data['state/id'], data['state/future/x'], data['state/future/y'],
+                                         **checkpoint_config())
+        ckpt_path = checkpoint.checkpoint_path(checkpoint_dir, dataset.scenario_id(data, ckpt_key))
+        fleet = checkpoint.load_checkpoint(ckpt_path, ckpt_key)
+
+    if(fleet is not None):
+        cars, obstacles, ticks = fleet['cars'], fleet['obstacles'], fleet['ticks']
+        for car in cars:
+            car.HOOKS, car.COURSE_CACHE = hooks, COURSE_CACHE
+        print('resumed from checkpoint at tick '+str(ticks))
+    else:
+        # 三次样条平滑 (主车按原始waypoints回放，不做平滑), 已缓存的轨迹不再拟合
+        courses = [None] * car_num
+        if(SPLINE_SMOOTHING):
+            skip = {main_car_index}
+            if(COURSE_CACHE is not None):
+                mpc = SINGLE_MPC()
+                valid = data.get('state/future/valid')
+                skip |= {i for i in range(car_num)
+                         if mpc.course_key(data['state/future/x'][i], data['state/future/y'][i], True,
+                                           None if valid is None else valid[i]) in COURSE_CACHE}
+            courses = get_switch_back_courses(data, SINGLE_MPC().DL, skip=skip)
+
+        # 初始化对应数量的MPC控制器
+        cars = []
+        for i in range(car_num):
+            car = SINGLE_MPC()
+            car.HOOKS = hooks
+            car.setup(data, i, course=courses[i], smoothing=SPLINE_SMOOTHING and i != main_car_index)
+            if(i==main_car_index):
+                car.OBSTACLE_AVOIDANCE = False
+            cars.append(car)
+        obstacles = []
+        ticks = 0
+
+    # 初始化记录数据: 输出字段重新生成, 其余字段引用输入 (不拷贝)
+    m2i_data = dict(data)
+    for field in OUTPUT_FIELDS:
+        m2i_data['state/future/'+field] = []
 
     # 开始仿真
-    obstacles = []
-    disappear_cars = []
-    ticks = 0
+    scenario = dataset.scenario_id(data, '')
     break_flag = 1
-    while(break_flag == 1):
-        # 更新MPC以及各车轨迹
-        if(SHOW_ANIMATION):
-            plt.clf()
-
-        reached_num = 0
-        for car_index in range(car_num):
-            obstacles_for_this_car = copy.deepcopy(obstacles)
-            if(len(obstacles_for_this_car)):
-                obstacles_for_this_car.pop(car_index)
+    partitioned = PARTITION_WORKERS > 0 and not SHOW_ANIMATION
+    # 分区仿真的进程池只在本次仿真内使用, 结束时关闭
+    with partition_pool(PARTITION_WORKERS if partitioned else 0) as pool:
+        while(break_flag == 1):
+            if(hooks is not None):
+                tick_start = time.perf_counter()
+                hooks.emit('tick_start', scenario=scenario, tick=ticks, time=ticks*cars[0].DT)
+
+            if(partitioned):
+                # 互不影响的车群分别仿真PARTITION_EVERY个tick
+                obstacles, reached_counts = simulate_partitioned(cars, obstacles, ticks, PARTITION_EVERY,
+                                                                 PARTITION_WORKERS, pool)
+                for reached_num in reached_counts:
+                    if(reached_num == car_num):
+                        break_flag = 0
+                ticks += len(reached_counts) - 1
+                reached_num = reached_counts[-1]
+                if(cars[0].HISTORY_WINDOWS):
+                    for car in cars:
+                        car.emit_history_windows()
+                if(hooks is not None):
+                    hooks.emit('tick_end', scenario=scenario, tick=ticks, time=ticks*cars[0].DT,
+                               reached=reached_num, seconds=time.perf_counter() - tick_start)
+                ticks += 1
+                if(ckpt_path is not None and break_flag == 1
+                   and ticks // checkpoint_every > (ticks - len(reached_counts)) // checkpoint_every):
+                    save_fleet_checkpoint(ckpt_path, ckpt_key, cars, obstacles, ticks, hooks)
+                continue
+
+            # 更新MPC以及各车轨迹
             if(SHOW_ANIMATION):
-                locals()['car'+str(car_index)].plot_car(locals()['car'+str(car_index)].state.x, locals()['car'+str(car_index)].state.y, locals()['car'+str(car_index)].state.yaw, steer=locals()['car'+str(car_index)].di)
-            reached = locals()['car'+str(car_index)].update(obstacles_for_this_car)
-            reached_num += reached
+                plt.clf()
+
+            reached_num = 0
+            # ADMM: 所有车辆的MPC问题合并为批量求解
+            batch = cars[0].SOLVER == 'ADMM'
+            steps = []
+            for car_index in range(car_num):
+                car = cars[car_index]
+                # update不修改障碍物信息, 浅拷贝即可
+                obstacles_for_this_car = obstacles[:car_index] + obstacles[car_index + 1:]
+                # 多速率重规划: 每REPLAN_EVERY个tick重新求解一次, 按车辆序号错开使每个tick的求解量均匀
+                car.replan_due = (ticks + car_index) % car.REPLAN_EVERY == 0
+                if(SHOW_ANIMATION):
+                    car.plot_car(car.state.x, car.state.y, car.state.yaw, steer=car.di)
+                if(batch):
+                    steps.append(car.update_steps(obstacles_for_this_car))
+                else:
+                    reached = car.update(obstacles_for_this_car)
+                    reached_num += reached
+            if(batch):
+                reached_num += sum(run_solve_steps_batch(cars, steps))
 
-        if(SHOW_ANIMATION):
-            plt.pause(0.001)
+            if(SHOW_ANIMATION):
+                plt.pause(0.001)
+
+            if(reached_num == car_num):
+                break_flag = 0
+
+            # 更新障碍物信息
+            obstacles = [car.obstacle_info() for car in cars]
+            #progressBar(ticks, wp_length,  ' | ' + "Running MPC, time: "+str(round(ticks*cars[0].DT, 2))+' seconds, reached num: '+str(reached_num)+'\n')
+            if(cars[0].HISTORY_WINDOWS):
+                for car in cars:
+                    car.emit_history_windows()
+            if(hooks is not None):
+                hooks.emit('tick_end', scenario=scenario, tick=ticks, time=ticks*cars[0].DT,
+                           reached=reached_num, seconds=time.perf_counter() - tick_start)
+            ticks += 1
+
+            # 保存检查点
+            if(ckpt_path is not None and break_flag == 1 and ticks % checkpoint_every == 0):
+                save_fleet_checkpoint(ckpt_path, ckpt_key, cars, obstacles, ticks, hooks)
 
-        if(reached_num == car_num):
-            break_flag = 0
-        
-        # 更新障碍物信息
-        obstacles = []
-        for car_index in range(car_num):
-            obs_x = locals()['car'+str(car_index)].state.x + locals()['car'+str(car_index)].state.v*math.cos(locals()['car'+str(car_index)].state.yaw)*locals()['car'+str(car_index)].DT
-            obs_y = locals()['car'+str(car_index)].state.y + locals()['car'+str(car_index)].state.v*math.sin(locals()['car'+str(car_index)].state.yaw)*locals()['car'+str(car_index)].DT
-            obstacles.append([obs_x, obs_y])
-        #progressBar(ticks, wp_length,  ' | ' + "Running MPC, time: "+str(round(ticks*locals()['car'+str(car_index)].DT, 2))+' seconds, reached num: '+str(reached_num)+'\n')
-        ticks += 1
-    
     # 整理数据
     print('MPC ENDED!')
-    for car_index in range(car_num):
-        m2i_data['state/future/x'].append(locals()['car'+str(car_index)].x)
-        m2i_data['state/future/y'].append(locals()['car'+str(car_index)].y)
-        m2i_data['state/future/bbox_yaw'].append(locals()['car'+str(car_index)].yaw)
-        m2i_data['state/future/velocity_x'].append(locals()['car'+str(car_index)].vel_x)
-        m2i_data['state/future/velocity_y'].append(locals()['car'+str(car_index)].vel_y)
-        m2i_data['state/future/vel_yaw'].append(locals()['car'+str(car_index)].vel_yaw)
-        
-    m2i_data['state/future/x'] = list2mat(m2i_data['state/future/x'], wp_length-1)
-    m2i_data['state/future/y'] = list2mat(m2i_data['state/future/y'], wp_length-1)
-    m2i_data['state/future/bbox_yaw'] = list2mat(m2i_data['state/future/bbox_yaw'], wp_length-1)
-    m2i_data['state/future/vel_yaw'] = list2mat(m2i_data['state/future/vel_yaw'], wp_length-1)
-    m2i_data['state/future/velocity_x'] = list2mat(m2i_data['state/future/velocity_x'], wp_length-1)
-    m2i_data['state/future/velocity_y'] = list2mat(m2i_data['state/future/velocity_y'], wp_length-1)
-
+    if(cars and cars[0].HISTORY_WINDOWS):
+        for car in cars:
+            car.emit_history_windows(flush=True)
+    for car in cars:
+        m2i_data['state/future/x'].append(car.x)
+        m2i_data['state/future/y'].append(car.y)
+        m2i_data['state/future/bbox_yaw'].append(car.yaw)
+        m2i_data['state/future/velocity_x'].append(car.vel_x)
+        m2i_data['state/future/velocity_y'].append(car.vel_y)
+        m2i_data['state/future/vel_yaw'].append(car.vel_yaw)
+
+    history_dtype = cars[0].HISTORY_DTYPE if cars else None
+    bounded = bool(cars) and cars[0].HISTORY_LIMIT is not None
+    for field in OUTPUT_FIELDS:
+        if(history_dtype is None and not bounded):
+            m2i_data['state/future/'+field] = list2mat(m2i_data['state/future/'+field], wp_length-1)
+        elif(history_dtype is None):
+            m2i_data['state/future/'+field] = np.asmatrix(list2array(m2i_data['state/future/'+field], wp_length-1, float))
+        else:
+            m2i_data['state/future/'+field] = list2array(m2i_data['state/future/'+field], wp_length-1, history_dtype)
+        if(OUTPUT_DT is not None and cars):
+            m2i_data['state/future/'+field] = resample_output(m2i_data['state/future/'+field], cars[0].DT, OUTPUT_DT,
+                                                              wrap=(field == 'bbox_yaw'))
+
+    checkpoint.remove_checkpoint(ckpt_path)
+    if(COURSE_CACHE is not None and hooks is not None and hooks.wants('course_cache')):
+        hooks.emit('course_cache', scenario=scenario, **COURSE_CACHE.stats())
     return m2i_data
 
 
+def checkpoint_config():
+    '''
+    Description: 影响仿真结果的设置 (MPC_PARAMS与模块开关), 计入检查点的key, 设置改变后不从旧设置的检查点恢复
+    '''
+    return {'params': repr(sorted(MPC_PARAMS.items())), 'spline_smoothing': SPLINE_SMOOTHING,
+            'partition_every': PARTITION_EVERY if PARTITION_WORKERS > 0 else None}
+
+
+def save_fleet_checkpoint(path, key, cars, obstacles, ticks, hooks):
+    caches = [car.COURSE_CACHE for car in cars]
+    for car in cars:
+        car.HOOKS, car.COURSE_CACHE = None, None  # 回调与轨迹缓存不保存到检查点
+    checkpoint.save_checkpoint(path, key, {'cars': cars, 'obstacles': obstacles, 'ticks': ticks})
+    for car, cache in zip(cars, caches):
+        car.HOOKS, car.COURSE_CACHE = hooks, cache
+
+
+def simulate_group(cars, indices, obstacles, ticks, window):
+    '''
+    Description: 仿真一组车辆window个tick (分区仿真的工作函数), 每辆车只看到组内其他车辆的障碍物; 组内车辆全部到达后提前结束
+    Input: indices: 各车在场景中的序号 (错开重规划用); obstacles: 组内各车的障碍物信息, 第一个tick前为空; ticks: 起始tick
+    Output: (cars, obstacles, 每个tick的到达数)
+    '''
+    reached_counts = []
+    for tick in range(ticks, ticks + window):
+        batch = cars[0].SOLVER == 'ADMM'
+        steps, reached_num = [], 0
+        for k, car in enumerate(cars):
+            car.replan_due = (tick + indices[k]) % car.REPLAN_EVERY == 0
+            if(batch):
+                steps.append(car.update_steps(obstacles[:k] + obstacles[k + 1:]))
+            else:
+                reached_num += car.update(obstacles[:k] + obstacles[k + 1:])
+        if(batch):
+            reached_num += sum(run_solve_steps_batch(cars, steps))
+        obstacles = [car.obstacle_info() for car in cars]
+        reached_counts.append(reached_num)
+        if(reached_num == len(cars)):
+            break
+    return cars, obstacles, reached_counts
+
+
+def partition_pool(workers):
+    '''
+    Description: 分区仿真的进程池 (workers>1时, 否则为空上下文), 用作with语句, 退出时关闭
+    '''
+    if(workers <= 1):
+        return contextlib.nullcontext()
+    import multiprocessing
+    return multiprocessing.Pool(workers)
+
+
+def simulate_partitioned(cars, obstacles, ticks, window, workers, pool=None):
+    '''
+    Description: 按交互图 (utils.partition) 把车辆分成window个tick内互不影响的车群, 分别仿真window个tick;
+                 结果与逐车串行仿真相同. workers>1时车群分到pool (见partition_pool, 未给出时临时创建) 的多个进程并行仿真,
+                 cars中的车辆替换为仿真后的对象
+    Output: (所有车辆的障碍物信息, 每个tick的到达总数, 到全部到达为止)
+    '''
+    positions = [(car.state.x, car.state.y) for car in cars]
+    reach = [car.interaction_reach(window) for car in cars]
+    groups = partition.clusters(positions, reach)
+    if(workers > 1):
+        # 每个进程一次仿真若干个车群, 合在一起仿真与分别仿真结果相同
+        groups = [sorted(i for group in bin_groups for i in group) for bin_groups in partition.balance(groups, workers)]
+
+    def group_obstacles(group):
+        return [obstacles[i] for i in group] if obstacles else []
+
+    if(workers > 1 and len(groups) > 1 and pool is None):
+        with partition_pool(workers) as pool:
+            return simulate_partitioned(cars, obstacles, ticks, window, workers, pool)
+    if(workers > 1 and len(groups) > 1):
+        detached = [(car.data, car.HOOKS, car.COURSE_CACHE) for car in cars]
+        for car in cars:
+            car.data, car.HOOKS, car.COURSE_CACHE = None, None, None  # 不随车辆发送到工作进程
+        try:
+            results = pool.starmap(simulate_group, [([cars[i] for i in group], group, group_obstacles(group), ticks, window)
+                                                    for group in groups])
+        finally:
+            for car, (data, hooks, cache) in zip(cars, detached):
+                car.data, car.HOOKS, car.COURSE_CACHE = data, hooks, cache
+        for group, (group_cars, _, _) in zip(groups, results):
+            for i, car in zip(group, group_cars):
+                car.data, car.HOOKS, car.COURSE_CACHE = detached[i]
+                cars[i] = car
+    else:
+        results = [simulate_group([cars[i] for i in group], group, group_obstacles(group), ticks, window)
+                   for group in groups]
+
+    new_obstacles = [None] * len(cars)
+    for group, (_, group_obstacles_after, _) in zip(groups, results):
+        for i, obstacle in zip(group, group_obstacles_after):
+            new_obstacles[i] = obstacle
+    # 提前结束的车群之后每个tick都全部到达
+    reached_counts = []
+    for tick in range(max(len(counts) for _, _, counts in results)):
+        reached_counts.append(sum(counts[tick] if tick < len(counts) else len(group)
+                                  for group, (_, _, counts) in zip(groups, results)))
+        if(reached_counts[-1] == len(cars)):
+            break
+    return new_obstacles, reached_counts
+
+
+def init_worker(show_animation=False, params=None, trace_path=None, trace_per_process=False, course_cache_spec=None):
+    '''
+    Description: 批量仿真的进程初始化, 默认关闭动画
+    Input: params: 覆盖SINGLE_MPC默认参数 (MPC_PARAMS);
+           trace_path: 将所有事件写入JSON-lines文件, trace_per_process时每个进程写入trace_path.<pid>;
+           course_cache_spec: 启用参考轨迹缓存, 内存条目数N或磁盘缓存目录DIR[:N] (utils.course_cache.from_spec)
+    '''
+    global SHOW_ANIMATION, HOOKS, COURSE_CACHE
+    SHOW_ANIMATION = show_animation
+    if course_cache_spec is not None:
+        COURSE_CACHE = course_cache.from_spec(course_cache_spec)
+    if params is not None:
+        MPC_PARAMS.update(params)
+    if trace_path is not None:
+        if trace_per_process:
+            trace_path = trace_path + '.' + str(os.getpid())
+        HOOKS = hooks_module.Hooks()
+        hooks_module.JsonlTraceSink(trace_path).attach(HOOKS)
+
+
+def warm_up():
+    '''
+    Description: 用当前参数求解一次空问题, 提前完成cvxpy导入与参数化问题的编译 (自适应时域时编译所有时域),
+                 以及数组内核的JIT编译
+    '''
+    mpc = SINGLE_MPC()
+    mpc.HOOKS = None
+    horizons = mpc.HORIZON_VARIANTS if mpc.ADAPTIVE_HORIZON else ((mpc.T, mpc.DT),)
+    for T, DT in horizons:
+        with mpc.planning_horizon(T, DT):
+            xref = np.zeros((mpc.NX, mpc.T + 1))
+            dref = np.zeros((1, mpc.T + 1))
+            mpc.predict_motion(np.zeros(mpc.NX), [0.0] * mpc.T, [0.0] * mpc.T, xref)
+            mpc.linear_mpc_control(xref, xref, np.zeros(mpc.NX), dref)
+
+
+def init_service_worker(params=None, course_cache_size=4096):
+    '''
+    Description: 常驻服务的进程初始化: 关闭动画, 启用轨迹缓存并预热求解器
+    '''
+    global COURSE_CACHE
+    init_worker(False, params)
+    if(course_cache_size):
+        COURSE_CACHE = course_cache.CourseCache(max_entries=course_cache_size)
+    warm_up()
+
+
+def serve(address, workers=1, params=None, max_pending=None, report_every=None):
+    '''
+    Description: 常驻的本地仿真服务 (utils.rollout_service), 在Unix socket address ('unix:/path', 只有本用户可连接) 上接收
+                 state/...格式的场景并返回mpc_forward的结果; 工作进程常驻, 编译好的问题和轨迹缓存在请求间复用
+    Input: params: 覆盖SINGLE_MPC默认参数, 默认启用COMPILED_PROBLEM; report_every: 每隔若干秒输出队列深度与延迟
+    '''
+    # asyncio与进程池仅在服务模式下导入
+    import asyncio
+    import utils.rollout_service as rollout_service
+    service_params = {'COMPILED_PROBLEM': True}
+    service_params.update(params or {})
+    service = rollout_service.RolloutService(
+        mpc_forward, workers=workers, initializer=init_service_worker, initargs=(service_params,),
+        max_pending=max_pending)
+    print('serving on ' + address + ' with ' + str(workers) + ' workers')
+    try:
+        asyncio.run(service.serve(address, report_every=report_every))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+def open_writer(output_path, output_format='pickle', size=None):
+    '''
+    Description: 结果写出器, pickle: 追加写入的分片文件; columnar: 可memmap的列式存储目录 (utils.rollout_store);
+                 output_path为None时不写出结果
+    Input: size: 续跑时将pickle分片截断到该字节数, 丢弃未记录在manifest中的结果
+    '''
+    if(output_path is None):
+        return contextlib.nullcontext()
+    if(output_format == 'pickle'):
+        return dataset.ShardWriter(output_path, size=size)
+    elif(output_format == 'columnar'):
+        return rollout_store.RolloutWriter(output_path)
+    raise ValueError('unknown output format: ' + str(output_format))
+
+
+def run_dataset(input_paths, output_path, workers=1, max_pending=None, max_memory_mb=None,
+                output_format='pickle', manifest_path=None, checkpoint_dir=None, checkpoint_every=0,
+                show_animation=False, params=None, trace_path=None, course_cache_spec=None):
+    '''
+    Description: 流式读取场景 (目录/分片文件/glob), 逐个进行MPC仿真并增量写出结果,
+                 内存占用与数据集大小无关
+    Input: manifest_path: 记录已完成场景的manifest, 重启后跳过已完成的场景;
+           checkpoint_dir, checkpoint_every: 长场景每checkpoint_every个tick保存一次检查点;
+           show_animation: 仅单进程时有效; params: 覆盖SINGLE_MPC默认参数;
+           trace_path: JSON-lines事件记录 (多进程时每个进程一个文件);
+           course_cache_spec: 参考轨迹缓存, 内存条目数N或磁盘缓存目录DIR[:N] (多进程共享, 重复运行时setup只需查表)
+    Output: 本次完成的场景及其耗时 {scenario id: seconds}
+    '''
+    manifest = checkpoint.RunManifest(manifest_path) if manifest_path else None
+    size = None
+    if(manifest is not None and manifest.resumed and output_format == 'pickle'):
+        size = manifest.max_value('end')
+    forward = mpc_forward
+    if(checkpoint_dir is not None and checkpoint_every > 0):
+        forward = functools.partial(mpc_forward, checkpoint_dir=checkpoint_dir, checkpoint_every=checkpoint_every)
+    initargs = (show_animation and workers <= 1, params, trace_path, workers > 1, course_cache_spec)
+
+    timings = {}
+    with open_writer(output_path, output_format, size) as writer:
+        skip = set()
+        if(manifest is not None):
+            skip = set(manifest.records)
+            if(output_format == 'columnar' and writer is not None):
+                skip |= {s['id'] for s in writer.index['scenarios']}
+        scenarios = ((sid, data) for sid, data in dataset.iter_scenarios(input_paths) if sid not in skip)
+
+        for sid, seconds, written in dataset.run_stream(scenarios, forward, writer, workers=workers,
+                                                        max_pending=max_pending, max_memory_mb=max_memory_mb,
+                                                        initializer=init_worker, initargs=initargs):
+            if(manifest is not None):
+                manifest.done(sid, seconds=round(seconds, 3), **written)
+            print('scenario ' + sid + ' finished in ' + str(round(seconds, 2)) + ' seconds')
+            timings[sid] = seconds
+
+    if(manifest is not None):
+        manifest.close()
+    return timings
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Roll out M2I scenarios with one MPC controller per agent.')
+    parser.add_argument('inputs', nargs='*', default=['sample.pickle'],
+                        help='scenario pickles, shards, directories, scenario stores or globs (default: sample.pickle)')
+    parser.add_argument('-o', '--output', default=None,
+                        help='output shard file (pickle) or store directory (columnar), results are not saved if omitted')
+    parser.add_argument('-f', '--format', choices=['pickle', 'columnar'], default='pickle',
+                        help='output format (default: pickle)')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='number of worker processes, >1 implies --headless (default: 1)')
+    parser.add_argument('--solver', default=None,
+                        help='cvxpy solver used by linear_mpc_control, e.g. ECOS, OSQP, CLARABEL (default: ECOS), '
+                             'or ADMM to solve the problems of all vehicles of a tick as one batch')
+    parser.add_argument('--output-dt', type=float, default=None,
+                        help='resample the output from one value per tick (DT) to one value every OUTPUT_DT seconds, '
+                             'e.g. 0.1 for the M2I horizon (default: one value per tick)')
+    parser.add_argument('--headless', action='store_true',
+                        help='do not show the animation')
+    parser.add_argument('--horizon', type=int, default=None,
+                        help='MPC horizon length T')
+    parser.add_argument('--dt', type=float, default=None,
+                        help='MPC time tick DT [s]')
+    parser.add_argument('--compiled', action='store_true',
+                        help='reuse compiled parametric problems instead of rebuilding one per solve')
+    parser.add_argument('--frenet-tracking', action='store_true',
+                        help='track the reference by projecting onto its continuous arc length instead of the nearest waypoint')
+    parser.add_argument('--collision-constraints', type=int, metavar='K', default=None,
+                        help='avoid the K most urgent obstacles with MPC halfplane constraints instead of the potential field')
+    parser.add_argument('--move-blocking', type=int, nargs='+', metavar='LEN', default=None,
+                        help='hold the input constant over blocks of LEN steps, one length or one per block (e.g. 1 1 2 4 8)')
+    parser.add_argument('--replan-every', type=int, metavar='K', default=None,
+                        help='replan every K ticks (staggered across agents) and follow the last plan in between, '
+                             'replanning early on tracking error or close obstacles')
+    parser.add_argument('--kernels', choices=kernels.BACKENDS, default=None,
+                        help='array kernels for prediction and linearization (numba if installed with auto)')
+    parser.add_argument('--solution-library', type=int, metavar='N', default=None,
+                        help='warm start cold solves from the nearest of up to N past solutions per horizon')
+    parser.add_argument('--adaptive-horizon', action='store_true',
+                        help='pick the MPC horizon and step per agent and tick from speed, curvature and goal distance')
+    parser.add_argument('--float32', action='store_true',
+                        help='keep trajectory histories and outputs as float32 arrays (half the memory)')
+    parser.add_argument('--history-limit', metavar='N|horizon', default=None,
+                        help="bounded trajectory records: 'horizon' keeps the output steps only (same output), "
+                             "N keeps the last N values")
+    parser.add_argument('--history-windows', action='store_true',
+                        help='with --history-limit N, stream every N values as history events to the --trace')
+    parser.add_argument('--partition-workers', type=int, metavar='N', default=0,
+                        help='simulate independent clusters of interacting agents separately (same output), '
+                             'in N processes if N > 1 (default: 0, whole scene at once)')
+    parser.add_argument('--partition-every', type=int, metavar='K', default=None,
+                        help='with --partition-workers, re-partition the scene every K ticks (default: 5)')
+    parser.add_argument('--course-cache', metavar='DIR[:N]|N', default=None,
+                        help='cache preprocessed reference courses: N entries in memory per process, '
+                             'or on disk in DIR (at most N files, default 100000), shared by workers and reused by later runs')
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help='maximum number of scenarios in flight (default: 2 * workers)')
+    parser.add_argument('--max-memory-mb', type=float, default=None,
+                        help='stop reading new scenarios while the main process and its workers are above this '
+                             'resident memory (needs --workers > 1)')
+    parser.add_argument('--manifest', default=None,
+                        help='run manifest, finished scenarios are skipped on restart')
+    parser.add_argument('--checkpoint-dir', default=None,
+                        help='directory of mid-scenario fleet checkpoints')
+    parser.add_argument('--checkpoint-every', type=int, default=0,
+                        help='checkpoint every K ticks (default: 0, disabled)')
+    parser.add_argument('--trace', metavar='FILE', default=None,
+                        help='write tick/solve/avoidance/goal events as JSON lines (FILE.<pid> per worker)')
+    parser.add_argument('--profile', metavar='FILE', default=None,
+                        help='profile the run with cProfile and dump the stats to FILE (main process only)')
+    parser.add_argument('--timing', action='store_true',
+                        help='print a timing summary at the end')
+    parser.add_argument('--serve', metavar='ADDRESS', default=None,
+                        help="run as a persistent rollout service on the Unix socket 'unix:/path' (owner only) "
+                             "with --workers warm workers (inputs and output are ignored)")
+    parser.add_argument('--report-every', type=float, default=None,
+                        help='with --serve, print queue depth and latency every N seconds')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    global PARTITION_WORKERS, PARTITION_EVERY, OUTPUT_DT
+    args = parse_args(argv)
+    if(args.partition_workers > 1 and args.workers > 1):
+        # 工作进程不能再创建进程池
+        raise SystemExit('--partition-workers > 1 cannot be combined with --workers > 1')
+    if(args.max_memory_mb is not None and args.workers <= 1):
+        raise SystemExit('--max-memory-mb needs --workers > 1')
+    PARTITION_WORKERS = args.partition_workers
+    if(args.partition_every is not None):
+        PARTITION_EVERY = args.partition_every
+    OUTPUT_DT = args.output_dt
+
+    params = {}
+    if(args.solver is not None):
+        params['SOLVER'] = args.solver.upper()
+    if(args.horizon is not None):
+        params['T'] = args.horizon
+    if(args.dt is not None):
+        params['DT'] = args.dt
+    if(args.float32):
+        params['HISTORY_DTYPE'] = 'float32'
+    if(args.history_limit is not None):
+        params['HISTORY_LIMIT'] = args.history_limit if args.history_limit == 'horizon' else int(args.history_limit)
+    if(args.history_windows):
+        if(args.history_limit is None or args.history_limit == 'horizon'):
+            raise SystemExit('--history-windows needs --history-limit N')
+        params['HISTORY_WINDOWS'] = True
+    if(args.compiled):
+        params['COMPILED_PROBLEM'] = True
+    if(args.move_blocking is not None):
+        params['MOVE_BLOCKING'] = args.move_blocking[0] if len(args.move_blocking) == 1 else tuple(args.move_blocking)
+    if(args.replan_every is not None):
+        params['REPLAN_EVERY'] = args.replan_every
+    if(args.kernels is not None):
+        params['KERNELS'] = args.kernels
+    if(args.solution_library is not None):
+        params['SOLUTION_LIBRARY'] = args.solution_library
+    if(args.adaptive_horizon):
+        params['ADAPTIVE_HORIZON'] = True
+    if(args.frenet_tracking):
+        params['FRENET_TRACKING'] = True
+    if(args.collision_constraints is not None):
+        params['COLLISION_CONSTRAINTS'] = args.collision_constraints > 0
+        params['MAX_OBSTACLE_CONSTRAINTS'] = args.collision_constraints
+
+    if(args.serve is not None):
+        serve(args.serve, workers=args.workers, params=params, max_pending=args.max_pending,
+              report_every=args.report_every)
+        return {}
+
+    run = functools.partial(
+        run_dataset, args.inputs, args.output, workers=args.workers, max_pending=args.max_pending,
+        max_memory_mb=args.max_memory_mb, output_format=args.format, manifest_path=args.manifest,
+        checkpoint_dir=args.checkpoint_dir, checkpoint_every=args.checkpoint_every,
+        show_animation=not args.headless, params=params, trace_path=args.trace,
+        course_cache_spec=args.course_cache)
+
+    start = time.time()
+    if(args.profile is not None):
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        timings = profiler.runcall(run)
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+    else:
+        timings = run()
+    wall = time.time() - start
+
+    if(args.timing):
+        seconds = sorted(timings.values())
+        print('scenarios: ' + str(len(seconds)) + ', wall time: ' + str(round(wall, 2)) + ' s')
+        if(seconds):
+            print('per scenario: mean ' + str(round(sum(seconds) / len(seconds), 2))
+                  + ' s, median ' + str(round(seconds[len(seconds) // 2], 2))
+                  + ' s, max ' + str(round(seconds[-1], 2)) + ' s')
+            print('throughput: ' + str(round(len(seconds) / wall * 3600.0, 1)) + ' scenarios/hour')
+        if(args.solution_library and args.workers <= 1):
+            print('solution library: ' + json.dumps(solution_library.shared(args.solution_library).stats()))
+        if(COURSE_CACHE is not None and args.workers <= 1):
+            print('course cache: ' + json.dumps(COURSE_CACHE.stats()))
+        elif(args.course_cache is not None):
+            print('course cache: counters of every worker are in the course_cache events of the --trace')
+    return timings
+
+
 if __name__=='__main__':
-    data = pickle.load(open(r'sample.pickle','rb'))
-    print(data['state/future/x'])
-    # data = pickle.load(open(r'list_for_filtered_mpc_inputs.pickle','rb'))[0]
-    m2i_data = mpc_forward(data)
\ No newline at end of file
+    main()
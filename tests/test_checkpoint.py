@@ -0,0 +1,24 @@
+import json
+
+from utils.checkpoint import RunManifest
+
+
+def test_manifest_recovers_from_torn_line(tmp_path):
+    path = str(tmp_path / 'manifest.jsonl')
+    with RunManifest(path) as manifest:
+        manifest.done('a', end=10)
+        manifest.done('b', end=20)
+    with open(path, 'a') as f:
+        f.write('{"id": "c", "se')  # crash while writing c
+
+    with RunManifest(path) as manifest:
+        assert sorted(manifest.records) == ['a', 'b']
+        manifest.done('d', end=30)
+        manifest.done('e', end=40)
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert [json.loads(line)['id'] for line in lines] == ['a', 'b', 'd', 'e']
+    with RunManifest(path) as manifest:
+        assert sorted(manifest.records) == ['a', 'b', 'd', 'e']
+        assert manifest.max_value('end') == 40
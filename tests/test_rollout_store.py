@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+
+from utils import rollout_store
+
+
+def make_rollout(value, agents=2, steps=5):
+    result = {'state/id': np.arange(agents, dtype=float)}
+    for field in rollout_store.TRAJECTORY_FIELDS:
+        result['state/future/' + field] = np.full((agents, steps), value)
+    return result
+
+
+def test_index_survives_a_crash(tmp_path):
+    path = str(tmp_path / 'rollouts')
+    writer = rollout_store.RolloutWriter(path)
+    writer.write('a', make_rollout(1.0))
+    writer.write('b', make_rollout(2.0))
+    # crash without close: index.json is stale, torn entry of a third scenario
+    writer.index.file.close()
+    with open(os.path.join(path, rollout_store.ENTRIES_NAME), 'a') as f:
+        f.write('{"id": "c", "st')
+    with open(rollout_store._field_path(path, 'x'), 'ab') as f:
+        np.full((2, 5), 9.0, dtype='float32').tofile(f)
+
+    store = rollout_store.RolloutReader(path)
+    assert store.ids == ['a', 'b']
+
+    with rollout_store.RolloutWriter(path) as writer:
+        writer.write('d', make_rollout(4.0))
+    store = rollout_store.RolloutReader(path)
+    assert store.ids == ['a', 'b', 'd']
+    assert np.all(store.scenario('d')['x'] == 4.0)
+    assert os.path.getsize(os.path.join(path, rollout_store.ENTRIES_NAME)) == 0
@@ -0,0 +1,35 @@
+import json
+import os
+
+import numpy as np
+
+from utils import scenario_store
+
+
+def make_scenario(value, agents=3, steps=4):
+    return {'state/id': np.arange(agents, dtype=float),
+            'state/future/x': np.full((agents, steps), value),
+            'scenario/id': 'scene%d' % value}
+
+
+def test_reopen_drops_rows_of_a_crashed_write(tmp_path):
+    path = str(tmp_path / 'store')
+    with scenario_store.ScenarioStoreWriter(path) as writer:
+        writer.write('a', make_scenario(1.0))
+    # crash after the data files were appended, before the index update
+    index_path = os.path.join(path, scenario_store.INDEX_NAME)
+    with open(index_path) as f:
+        index = f.read()
+    with scenario_store.ScenarioStoreWriter(path) as writer:
+        writer.write('crashed', make_scenario(9.0))
+    with open(index_path, 'w') as f:
+        f.write(index)
+
+    with scenario_store.ScenarioStoreWriter(path) as writer:
+        writer.write('b', make_scenario(2.0))
+
+    store = scenario_store.ScenarioStore(path)
+    assert store.ids == ['a', 'b']
+    assert np.all(store.field('state/future/x', 'b') == 2.0)
+    assert store.extras('b')['scenario/id'] == 'scene2'
+    assert json.load(open(index_path))['rows'] == 6
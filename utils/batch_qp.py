@@ -0,0 +1,211 @@
+"""
+Batched ADMM solver for many small QPs of the same size
+
+Solves N independent problems
+
+    minimize    0.5 z' P z + q' z
+    subject to  l <= A z <= u
+
+at once with the ADMM iteration of OSQP (Stellato et al., 2020), written as
+NumPy tensor operations over the batch. The problems are small and dense
+(the condensed MPC problems of `utils.mpc_problem`), so every problem gets
+a dense inverse of its reduced KKT matrix P + sigma I + A' diag(rho) A,
+computed for the whole batch in one call and reused until rho changes.
+Each problem can be warm started and stops iterating as soon as it has
+converged, or as soon as the differences of its iterates certify that it is
+primal or dual infeasible (the certificates of OSQP).
+
+"""
+import numpy as np
+
+OPTIMAL = 'optimal'  # same strings as the cvxpy statuses
+PRIMAL_INFEASIBLE = 'infeasible'
+DUAL_INFEASIBLE = 'unbounded'
+MAX_ITER_REACHED = 'user_limit'
+
+
+class BatchResult:
+    """
+    Solutions of a batch: `z` (N, n), duals `y` (N, m), per problem
+    `status`, `iterations` and residuals.
+    """
+
+    def __init__(self, z, y, status, iterations, prim_res, dual_res):
+        self.z = z
+        self.y = y
+        self.status = status
+        self.iterations = iterations
+        self.prim_res = prim_res
+        self.dual_res = dual_res
+
+
+def _norm_inf(a):
+    return np.abs(a).max(axis=-1) if a.shape[-1] else np.zeros(a.shape[:-1])
+
+
+def _infeasible(P, q, A, l, u, D, E, cost_scale, dz, dy, eps_pinf, eps_dinf):
+    # OSQP's certificates on the iterate differences of the scaled problems,
+    # evaluated for the unscaled ones (the cost scale does not change signs)
+    with np.errstate(invalid='ignore'):
+        dy_u = D * dy
+        norm_y = _norm_inf(dy_u)
+        bound = (np.where(dy > 0, u, 0.0) * dy + np.where(dy < 0, l, 0.0) * dy).sum(axis=1)
+        Aty = _norm_inf(np.einsum('nmi,nm->ni', A, dy) / E)
+        primal = (norm_y > 1e-10) & (bound < 0) & (Aty <= eps_pinf * norm_y)
+
+        dz_u = E * dz
+        norm_z = _norm_inf(dz_u)
+        limit = eps_dinf * norm_z
+        qdz = np.einsum('ni,ni->n', q, dz) / cost_scale
+        Pdz = _norm_inf(np.einsum('nij,nj->ni', P, dz) / (E * cost_scale[:, None]))
+        Adz = np.einsum('nmi,ni->nm', A, dz) / D
+        bounded = ((np.isfinite(u) & (Adz > limit[:, None])) | (np.isfinite(l) & (Adz < -limit[:, None]))).any(axis=1)
+        dual = (norm_z > 1e-10) & (qdz < limit) & (Pdz < limit) & ~bounded
+    return primal, dual
+
+
+def solve(P, q, A, l, u, z0=None, y0=None, rho=0.1, sigma=1e-6, alpha=1.6, eps_abs=1e-4,
+          eps_rel=1e-4, max_iter=4000, check_every=10, adaptive_rho=True, eps_pinf=1e-4, eps_dinf=1e-4):
+    """
+    Solve a batch of QPs.
+
+    Parameters
+    ----------
+    P : (N, n, n) ndarray
+        positive semidefinite cost matrices.
+    q : (N, n) ndarray
+    A : (N, m, n) ndarray
+    l, u : (N, m) ndarray
+        constraint bounds, +-inf for one-sided rows.
+    z0, y0 : (N, n), (N, m) ndarray, optional
+        warm start of the primal and dual solutions.
+    rho, sigma, alpha :
+        ADMM step size, primal regularization and relaxation.
+    eps_abs, eps_rel : float
+        absolute and relative tolerance of the primal and dual residuals.
+    max_iter : int
+        problems not converged after this many iterations stop with
+        status `MAX_ITER_REACHED`.
+    check_every : int
+        iterations between convergence checks (and rho updates).
+    eps_pinf, eps_dinf : float
+        tolerances of the primal and dual infeasibility certificates,
+        problems they detect stop with status `PRIMAL_INFEASIBLE` or
+        `DUAL_INFEASIBLE`.
+
+    Returns
+    -------
+    BatchResult
+    """
+    P, q, A = (np.asarray(a, dtype=float) for a in (P, q, A))
+    N, m, n = A.shape
+    P, q, A, D, E, cost_scale = equilibrate(P, q, A)
+    l = np.asarray(l, dtype=float) * D
+    u = np.asarray(u, dtype=float) * D
+
+    # the iteration runs on the scaled problem: z = E z_s, y = D y_s / cost_scale
+    z = np.zeros((N, n)) if z0 is None else np.asarray(z0, dtype=float) / E
+    y = np.zeros((N, m)) if y0 is None else np.asarray(y0, dtype=float) * cost_scale[:, None] / D
+    # c: constraint values A z projected onto [l, u] (z of the OSQP paper)
+    c = np.clip(np.einsum('nmi,ni->nm', A, z), l, u)
+    rho = np.full(N, float(rho))
+    # loose rows (no bounds) need almost no penalty
+    rho_rows = np.where(np.isinf(l) & np.isinf(u), 1e-6, 1.0)
+    identity = np.eye(n)
+
+    def factor(index):
+        R = rho[index, None] * rho_rows[index]
+        K = P[index] + sigma * identity + np.einsum('nmi,nm,nmj->nij', A[index], R, A[index])
+        return np.linalg.inv(K)
+
+    K_inv = factor(np.arange(N))
+    status = np.full(N, MAX_ITER_REACHED, dtype=object)
+    iterations = np.full(N, max_iter)
+    prim_res = np.full(N, np.inf)
+    dual_res = np.full(N, np.inf)
+    active = np.arange(N)
+
+    for k in range(1, max_iter + 1):
+        i = active
+        check = k % check_every == 0 or k == max_iter
+        if check:
+            z_prev, y_prev = z[i], y[i]
+        R = rho[i, None] * rho_rows[i]
+        rhs = sigma * z[i] - q[i] + np.einsum('nmi,nm->ni', A[i], R * c[i] - y[i])
+        z_tilde = np.einsum('nij,nj->ni', K_inv[i], rhs)
+        c_tilde = np.einsum('nmi,ni->nm', A[i], z_tilde)
+        z[i] = alpha * z_tilde + (1.0 - alpha) * z[i]
+        c_relaxed = alpha * c_tilde + (1.0 - alpha) * c[i]
+        c_new = np.clip(c_relaxed + y[i] / R, l[i], u[i])
+        y[i] = y[i] + R * (c_relaxed - c_new)
+        c[i] = c_new
+
+        if not check:
+            continue
+        # residuals of the unscaled problem
+        Az = np.einsum('nmi,ni->nm', A[i], z[i])
+        Pz = np.einsum('nij,nj->ni', P[i], z[i])
+        Aty = np.einsum('nmi,nm->ni', A[i], y[i])
+        D_i, E_i, c_i = D[i], E[i], cost_scale[i, None]
+        prim = _norm_inf((Az - c[i]) / D_i)
+        dual = _norm_inf((Pz + q[i] + Aty) / E_i) / c_i[:, 0]
+        prim_scale = np.maximum(_norm_inf(Az / D_i), _norm_inf(c[i] / D_i))
+        dual_scale = np.maximum(np.maximum(_norm_inf(Pz / E_i), _norm_inf(Aty / E_i)),
+                                _norm_inf(q[i] / E_i)) / c_i[:, 0]
+        prim_res[i], dual_res[i] = prim, dual
+        done = (prim <= eps_abs + eps_rel * prim_scale) & (dual <= eps_abs + eps_rel * dual_scale)
+        status[i[done]] = OPTIMAL
+        primal_inf, dual_inf = _infeasible(P[i], q[i], A[i], l[i], u[i], D_i, E_i, cost_scale[i],
+                                           z[i] - z_prev, y[i] - y_prev, eps_pinf, eps_dinf)
+        primal_inf &= ~done
+        dual_inf &= ~done & ~primal_inf
+        status[i[primal_inf]] = PRIMAL_INFEASIBLE
+        status[i[dual_inf]] = DUAL_INFEASIBLE
+        done |= primal_inf | dual_inf
+        iterations[i[done]] = k
+        active = i[~done]
+        if active.size == 0:
+            break
+
+        if adaptive_rho:
+            # balance the relative primal and dual residuals
+            keep = ~done
+            ratio = np.sqrt((prim[keep] / np.maximum(prim_scale[keep], 1e-10))
+                            / np.maximum(dual[keep] / np.maximum(dual_scale[keep], 1e-10), 1e-10))
+            new_rho = np.clip(rho[active] * ratio, 1e-6, 1e6)
+            change = (new_rho > 5.0 * rho[active]) | (new_rho < 0.2 * rho[active])
+            if change.any():
+                refactor = active[change]
+                rho[refactor] = new_rho[change]
+                K_inv[refactor] = factor(refactor)
+
+    return BatchResult(z * E, y * D / cost_scale[:, None], status, iterations, prim_res, dual_res)
+
+
+def equilibrate(P, q, A, iterations=10):
+    """
+    Ruiz equilibration of every problem of the batch, as in OSQP: scales
+    the variables (E), the constraint rows (D) and the cost so that the
+    columns of [P A'; A 0] have similar norms.
+
+    Returns
+    -------
+    P, q, A : scaled problems
+    D : (N, m) ndarray
+    E : (N, n) ndarray
+    cost_scale : (N,) ndarray
+    """
+    N, m, n = A.shape
+    D, E = np.ones((N, m)), np.ones((N, n))
+    for _ in range(iterations):
+        column = np.maximum(np.abs(P).max(axis=1), np.abs(A).max(axis=1) if m else 0.0)
+        row = np.abs(A).max(axis=2) if n else np.zeros((N, m))
+        delta_e = 1.0 / np.sqrt(np.clip(column, 1e-4, 1e4))
+        delta_d = 1.0 / np.sqrt(np.clip(row, 1e-4, 1e4))
+        P = P * delta_e[:, :, None] * delta_e[:, None, :]
+        A = A * delta_d[:, :, None] * delta_e[:, None, :]
+        q = q * delta_e
+        D, E = D * delta_d, E * delta_e
+    mean_column = np.abs(P).max(axis=1).mean(axis=1)
+    cost_scale = 1.0 / np.clip(np.maximum(mean_column, np.abs(q).max(axis=1)), 1e-4, 1e4)
+    return P * cost_scale[:, None, None], q * cost_scale[:, None], A, D, E, cost_scale
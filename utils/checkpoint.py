@@ -0,0 +1,119 @@
+"""
+Run manifest and checkpoints for resumable batch processing
+
+The manifest is an append-only JSON-lines file with one record per finished
+scenario (id and output offsets), so a restarted run skips what is already
+done. Fleet checkpoints pickle the state of a scenario in progress (the
+controllers, obstacles and tick count) so a long scenario resumes from its
+last checkpoint instead of from the start.
+
+"""
+import os
+import json
+import pickle
+import tempfile
+
+
+class RunManifest:
+    """
+    Append-only record of finished scenarios
+
+    Parameters
+    ----------
+    path : str
+        JSON-lines file, created if needed and reloaded on restart.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        self.resumed = os.path.exists(path)
+        if self.resumed:
+            end = 0  # byte offset after the last complete record
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # torn last line of a crashed run
+                    self.records[record['id']] = record
+                    end += len(line)
+            if end < os.path.getsize(path):
+                # drop the torn line, or the next record is appended onto it
+                with open(path, 'r+b') as f:
+                    f.truncate(end)
+        self.file = open(path, 'a')
+
+    def __contains__(self, sid):
+        return sid in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def done(self, sid, **info):
+        """
+        Record a finished scenario, durable once this returns.
+        """
+        record = dict(id=sid, **info)
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.records[sid] = record
+
+    def max_value(self, field, default=0):
+        """
+        Largest value of `field` over all records, e.g. the output end offset.
+        """
+        return max((r[field] for r in self.records.values() if field in r), default=default)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def checkpoint_path(checkpoint_dir, sid):
+    """
+    File name of a scenario's fleet checkpoint.
+    """
+    safe = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in str(sid))
+    return os.path.join(checkpoint_dir, safe + '.ckpt')
+
+
+def save_checkpoint(path, key, state):
+    """
+    Atomically pickle `state` to `path`, tagged with the scenario `key`.
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump({'key': key, 'state': state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path, key):
+    """
+    State saved by `save_checkpoint`, None if there is none for this `key`.
+    """
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            checkpoint = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    if checkpoint.get('key') != key:
+        return None
+    return checkpoint['state']
+
+
+def remove_checkpoint(path):
+    if path is not None and os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,95 @@
+"""
+Linearized collision constraints for the MPC
+
+Every obstacle is kept out of a disc of radius `radius` around it by one
+halfplane per horizon step, linearized at the predicted (operational) ego
+trajectory: with `n` the unit vector from the obstacle to the predicted ego
+position at step t, the constraint is ``n . p_t >= n . o_t + radius``.
+Only the `k` most relevant obstacles (smallest time to contact) get
+constraints, so the problem size does not grow with the traffic density.
+
+Obstacles are rows [x, y, vx, vy] of their position one step ahead (as
+built by `mpc_forward`) and velocity, rows [x, y] are taken as standing.
+
+"""
+import numpy as np
+
+# halfplane of an unused constraint slot: 0 >= -1, always satisfied
+INACTIVE_B = -1.0
+
+
+def as_obstacle_array(obstacles):
+    """
+    (N, 4) array [x, y, vx, vy] of a list of obstacles.
+    """
+    obstacles = np.asarray(obstacles, dtype=float)
+    if obstacles.size == 0:
+        return np.zeros((0, 4))
+    if obstacles.shape[1] < 4:
+        obstacles = np.hstack([obstacles[:, :2], np.zeros((len(obstacles), 2))])
+    return obstacles[:, :4]
+
+
+def time_to_contact(x, y, vx, vy, obstacles, radius):
+    """
+    Time [s] until each obstacle comes within `radius` at the current
+    closing speed, 0 if it already is and inf if it is not closing in.
+    """
+    dx = obstacles[:, 0] - x
+    dy = obstacles[:, 1] - y
+    distance = np.hypot(dx, dy)
+    closing = -((obstacles[:, 2] - vx) * dx + (obstacles[:, 3] - vy) * dy) / np.maximum(distance, 1e-9)
+    with np.errstate(divide='ignore'):
+        ttc = np.where(closing > 0, (distance - radius) / closing, np.inf)
+    return np.where(distance <= radius, 0.0, np.maximum(ttc, 0.0)), distance
+
+
+def select_obstacles(x, y, vx, vy, obstacles, k, radius, detect_range):
+    """
+    Up to `k` obstacles within `detect_range` that are closing in, by
+    increasing time to contact (ties by distance).
+    """
+    obstacles = as_obstacle_array(obstacles)
+    if k <= 0 or len(obstacles) == 0:
+        return obstacles[:0]
+    ttc, distance = time_to_contact(x, y, vx, vy, obstacles, radius)
+    relevant = np.flatnonzero((distance <= detect_range) & np.isfinite(ttc))
+    order = relevant[np.lexsort((distance[relevant], ttc[relevant]))]
+    return obstacles[order[:k]]
+
+
+def halfplanes(xbar, obstacles, dt, radius, slots):
+    """
+    Halfplanes ``n[j, t] . p_{t+1} >= b[j, t]`` keeping the ego positions
+    p_1..p_T of the horizon away from each obstacle, linearized at the
+    predicted positions `xbar[:2, 1:]`.
+
+    Returns
+    -------
+    n : (slots, T, 2) ndarray
+    b : (slots, T) ndarray
+        unused slots are n = 0, b = -1.
+    """
+    T = xbar.shape[1] - 1
+    n = np.zeros((slots, T, 2))
+    b = np.full((slots, T), INACTIVE_B)
+    if len(obstacles) == 0:
+        return n, b
+    obstacles = obstacles[:slots]
+    steps = np.arange(T) * dt
+    # (obstacles, T, 2) obstacle positions at the horizon steps
+    centers = obstacles[:, None, :2] + obstacles[:, None, 2:4] * steps[None, :, None]
+    ego = np.asarray(xbar[:2, 1:], dtype=float).T[None, :, :]
+    offset = ego - centers
+    norm = np.linalg.norm(offset, axis=2, keepdims=True)
+    # ego on top of the obstacle: push away along the current offset
+    current = (ego[:, :1, :] - centers[:, :1, :]).repeat(T, axis=1)
+    offset = np.where(norm > 1e-6, offset, current)
+    norm = np.linalg.norm(offset, axis=2, keepdims=True)
+    valid = norm[..., 0] > 1e-6
+    normal = np.where(norm > 1e-6, offset / np.maximum(norm, 1e-6), 0.0)
+
+    count = len(obstacles)
+    n[:count] = normal
+    b[:count] = np.where(valid, (normal * centers).sum(axis=2) + radius, INACTIVE_B)
+    return n, b
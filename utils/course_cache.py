@@ -0,0 +1,194 @@
+"""
+Content-addressed cache of preprocessed reference courses
+
+A course (cx, cy, cyaw, ck, sp) only depends on the input waypoints and on a
+few preprocessing parameters, so it is stored under a hash of exactly those.
+Entries live in an in-memory LRU tier and, optionally, in an on-disk tier
+shared between runs and worker processes.
+
+"""
+import os
+import pickle
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+CACHE_VERSION = 2  # bump when the preprocessing in SINGLE_MPC.setup changes
+DEFAULT_MAX_DISK_ENTRIES = 100000  # on-disk tier bound of `from_spec`
+
+
+def make_key(*arrays, **params):
+    """
+    Hash waypoints and preprocessing parameters into a cache key.
+
+    Parameters
+    ----------
+    arrays : array_like
+        raw inputs of the course, e.g. the x and y coordinates of the
+        waypoints and their valid mask (before invalid filtering).
+    params :
+        preprocessing parameters, e.g. DL, TARGET_SPEED.
+
+    Returns
+    -------
+    key : str
+        hex digest identifying the course.
+    """
+    h = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(str((a.dtype.str, a.shape)).encode())
+        h.update(a.tobytes())
+    h.update(repr((CACHE_VERSION, sorted(params.items()))).encode())
+    return h.hexdigest()
+
+
+class CourseCache:
+    """
+    Two tier LRU cache of preprocessed courses
+
+    Parameters
+    ----------
+    max_entries : int
+        size bound of the in-memory tier, least recently used entries are
+        evicted first.
+    cache_dir : str, optional
+        directory of the on-disk tier, disabled when None.
+    max_disk_entries : int, optional
+        size bound of the on-disk tier, oldest files are evicted first. It
+        is enforced in batches, every max_disk_entries // 10 writes, so the
+        tier may briefly hold up to 10% more entries per writing process.
+    """
+
+    def __init__(self, max_entries=4096, cache_dir=None, max_disk_entries=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self.disk_writes = 0  # since the last eviction pass
+
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries or (
+            self.cache_dir is not None and os.path.exists(self.__path(key)))
+
+    def __path(self, key):
+        return os.path.join(self.cache_dir, key + ".pkl")
+
+    def get(self, key):
+        """
+        Look up a course, returns None on a miss.
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.cache_dir is not None:
+            try:
+                with open(self.__path(key), "rb") as f:
+                    value = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                value = None
+            if value is not None:
+                self.disk_hits += 1
+                self.__put_memory(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """
+        Store a course in both tiers.
+        """
+        self.__put_memory(key, value)
+        if self.cache_dir is not None:
+            self.__put_disk(key, value)
+
+    def __put_memory(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def __put_disk(self, key, value):
+        # write to a temporary file first so concurrent readers never see
+        # a partially written entry
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.__path(key))
+
+        if self.max_disk_entries is not None:
+            # listing the directory is O(entries), so evict in batches
+            self.disk_writes += 1
+            if self.disk_writes >= max(1, self.max_disk_entries // 10):
+                self.disk_writes = 0
+                self.__evict_disk()
+
+    def __evict_disk(self):
+        # the directory may be shared with other processes, so it is listed
+        # rather than tracked in memory
+        files = [os.path.join(self.cache_dir, name)
+                 for name in os.listdir(self.cache_dir)
+                 if name.endswith(".pkl")]
+        if len(files) > self.max_disk_entries:
+            files.sort(key=os.path.getmtime)
+            for path in files[:len(files) - self.max_disk_entries]:
+                try:
+                    os.remove(path)
+                    self.disk_evictions += 1
+                except OSError:
+                    pass
+
+    def clear(self):
+        """
+        Drop the in-memory tier, the on-disk tier is kept.
+        """
+        self.entries.clear()
+
+    def stats(self):
+        """
+        Hit/miss counters of both tiers.
+        """
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "disk_evictions": self.disk_evictions,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+
+def from_spec(spec, max_entries=4096):
+    """
+    Cache from a command line spec: a number N of in-memory entries, or
+    the directory of an on-disk tier 'DIR' or 'DIR:N' bounded to N files
+    (DEFAULT_MAX_DISK_ENTRIES by default), with `max_entries` in memory.
+    """
+    spec = str(spec)
+    if spec.isdigit():
+        return CourseCache(max_entries=int(spec))
+    cache_dir, max_disk_entries = spec, DEFAULT_MAX_DISK_ENTRIES
+    head, _, tail = spec.rpartition(':')
+    if head and tail.isdigit():
+        cache_dir, max_disk_entries = head, int(tail)
+    return CourseCache(max_entries=max_entries, cache_dir=cache_dir, max_disk_entries=max_disk_entries)
@@ -338,6 +338,229 @@ def calc_spline_course_by_num_points(x, y, num_points = 100):
     return rx, ry, ryaw, rk, s
 
 
+class CubicSpline1DBatch:
+    """
+    1D Cubic Spline class for many curves at once
+
+    The tridiagonal systems of every curve are solved in one vectorized
+    Thomas sweep instead of one ``np.linalg.solve`` per curve.
+
+    Parameters
+    ----------
+    x : array_like, shape (N, L)
+        x coordinates for data points, strictly ascending within the first
+        ``n`` points of each row. Values after that are ignored.
+    y : array_like, shape (N, L)
+        y coordinates for data points.
+    n : array_like, shape (N,)
+        number of valid points of each curve, at least 2.
+    """
+
+    def __init__(self, x, y, n):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.n = np.asarray(n, dtype=int)
+        self.x_end = self.x[np.arange(len(self.n)), np.maximum(self.n - 1, 0)]
+
+        h = np.diff(self.x, axis=1)
+        inside = np.arange(h.shape[1])[None, :] < self.n[:, None] - 1
+        h[~inside | (h <= 0.0)] = 1.0  # padded segments, never evaluated
+        self.h = h
+        self.a, self.b, self.c, self.d = self.__calc_coef(self.y)
+
+    def __calc_coef(self, a):
+        """
+        calc spline coefficients (a, b, c, d) of every curve
+        """
+        num, max_len = a.shape
+        h = self.h
+        rows = np.arange(max_len)[None, :]
+        inner = (rows >= 1) & (rows < self.n[:, None] - 1)
+
+        # tridiagonal system, identity rows outside the inner points
+        lower = np.zeros((num, max_len))
+        diag = np.ones((num, max_len))
+        upper = np.zeros((num, max_len))
+        rhs = np.zeros((num, max_len))
+        if max_len > 2:
+            lower[:, 1:-1] = np.where(inner[:, 1:-1], h[:, :-1], 0.0)
+            diag[:, 1:-1] = np.where(inner[:, 1:-1],
+                                     2.0 * (h[:, :-1] + h[:, 1:]), 1.0)
+            upper[:, 1:-1] = np.where(inner[:, 1:-1], h[:, 1:], 0.0)
+            rhs[:, 1:-1] = np.where(
+                inner[:, 1:-1],
+                3.0 * (a[:, 2:] - a[:, 1:-1]) / h[:, 1:]
+                - 3.0 * (a[:, 1:-1] - a[:, :-2]) / h[:, :-1], 0.0)
+
+        # Thomas algorithm, vectorized over curves
+        for i in range(1, max_len):
+            w = lower[:, i] / diag[:, i - 1]
+            diag[:, i] -= w * upper[:, i - 1]
+            rhs[:, i] -= w * rhs[:, i - 1]
+        c = np.zeros((num, max_len))
+        c[:, -1] = rhs[:, -1] / diag[:, -1]
+        for i in range(max_len - 2, -1, -1):
+            c[:, i] = (rhs[:, i] - upper[:, i] * c[:, i + 1]) / diag[:, i]
+
+        d = (c[:, 1:] - c[:, :-1]) / (3.0 * h)
+        b = (a[:, 1:] - a[:, :-1]) / h - h / 3.0 * (2.0 * c[:, :-1] + c[:, 1:])
+        return a[:, :-1], b, c[:, :-1], d
+
+    def search_index(self, x):
+        """
+        search data segment index of every sample, x has shape (N, M)
+        """
+        num, max_len = self.x.shape
+        # pad every row with its last knot and offset the rows so one
+        # searchsorted covers all of them
+        knots = np.where(np.arange(max_len)[None, :] < self.n[:, None],
+                         self.x, self.x_end[:, None])
+        start = np.minimum(self.x[:, 0], np.min(x, axis=1, initial=np.inf))
+        knots = knots - start[:, None]
+        span = max(float(np.max(knots, initial=0.0)),
+                   float(np.max(x - start[:, None], initial=0.0))) + 1.0
+        offset = span * np.arange(num)[:, None]
+        i = np.searchsorted((knots + offset).ravel(),
+                            (x - start[:, None] + offset).ravel(), side="right")
+        i = i.reshape(x.shape) - 1 - max_len * np.arange(num)[:, None]
+        return np.clip(i, 0, np.maximum(self.n - 2, 0)[:, None])
+
+    def __eval(self, x, order, i=None):
+        if i is None:
+            i = self.search_index(x)
+        a, b, c, d = [np.take_along_axis(k, i, axis=1)
+                      for k in (self.a, self.b, self.c, self.d)]
+        dx = x - np.take_along_axis(self.x, i, axis=1)
+        if order == 0:
+            return a + b * dx + c * dx ** 2.0 + d * dx ** 3.0
+        elif order == 1:
+            return b + 2.0 * c * dx + 3.0 * d * dx ** 2.0
+        return 2.0 * c + 6.0 * d * dx
+
+    def calc_position(self, x, i=None):
+        """
+        Calc `y` of every curve at x, an array of shape (N, M).
+        Samples outside a curve's range are extrapolated from its end segments.
+        """
+        return self.__eval(x, 0, i)
+
+    def calc_first_derivative(self, x, i=None):
+        """
+        Calc first derivative of every curve at x, an array of shape (N, M).
+        """
+        return self.__eval(x, 1, i)
+
+    def calc_second_derivative(self, x, i=None):
+        """
+        Calc second derivative of every curve at x, an array of shape (N, M).
+        """
+        return self.__eval(x, 2, i)
+
+
+class CubicSpline2DBatch:
+    """
+    Cubic spline 2D class for many paths at once
+
+    Parameters
+    ----------
+    x : array_like, shape (N, L)
+        x coordinates for data points, padded after each path's valid length.
+    y : array_like, shape (N, L)
+        y coordinates for data points, padded after each path's valid length.
+    lengths : array_like, shape (N,), optional
+        number of valid points of each path. Defaults to L for every path.
+
+    Consecutive duplicate points are dropped before fitting (they would give
+    zero length segments), so ``self.n`` may be smaller than ``lengths``.
+    Paths with less than 2 distinct points are marked invalid in
+    ``self.valid`` and produce no samples.
+    """
+
+    def __init__(self, x, y, lengths=None):
+        x = np.atleast_2d(np.asarray(x, dtype=float))
+        y = np.atleast_2d(np.asarray(y, dtype=float))
+        num, max_len = x.shape
+        if lengths is None:
+            lengths = np.full(num, max_len)
+        lengths = np.minimum(np.asarray(lengths, dtype=int), max_len)
+
+        # drop padding and zero length segments, then compact the points
+        cols = np.arange(max_len)
+        ds = np.hypot(np.diff(x, axis=1), np.diff(y, axis=1))
+        keep = cols[None, :] < lengths[:, None]
+        keep[:, 1:] &= ds > 1e-9
+        order = np.argsort(~keep, axis=1, kind="stable")
+        self.x = np.take_along_axis(x, order, axis=1)
+        self.y = np.take_along_axis(y, order, axis=1)
+        self.n = keep.sum(axis=1)
+        self.valid = self.n >= 2
+        self.mask = cols[None, :] < self.n[:, None]
+
+        # cumulative arc length
+        seg = np.hypot(np.diff(self.x, axis=1), np.diff(self.y, axis=1))
+        seg[~self.mask[:, 1:]] = 0.0
+        self.s = np.zeros_like(self.x)
+        self.s[:, 1:] = np.cumsum(seg, axis=1)
+        self.s_end = self.s[np.arange(num), np.maximum(self.n - 1, 0)]
+
+        self.sx = CubicSpline1DBatch(self.s, self.x, self.n)
+        self.sy = CubicSpline1DBatch(self.s, self.y, self.n)
+
+    def calc_position(self, s):
+        """
+        calc position of every path at s, an array of shape (N, M)
+        """
+        i = self.sx.search_index(s)
+        return self.sx.calc_position(s, i), self.sy.calc_position(s, i)
+
+    def calc_yaw(self, s):
+        """
+        calc yaw of every path at s, an array of shape (N, M)
+        """
+        i = self.sx.search_index(s)
+        dx = self.sx.calc_first_derivative(s, i)
+        dy = self.sy.calc_first_derivative(s, i)
+        return np.arctan2(dy, dx)
+
+    def calc_curvature(self, s):
+        """
+        calc curvature of every path at s, an array of shape (N, M)
+        """
+        i = self.sx.search_index(s)
+        dx = self.sx.calc_first_derivative(s, i)
+        ddx = self.sx.calc_second_derivative(s, i)
+        dy = self.sy.calc_first_derivative(s, i)
+        ddy = self.sy.calc_second_derivative(s, i)
+        return (ddy * dx - ddx * dy) / ((dx ** 2 + dy ** 2)**(3 / 2))
+
+
+def calc_spline_course_batch(x, y, lengths=None, ds=0.1, padded=False):
+    """
+    Batched version of `calc_spline_course` for padded (N, L) waypoints.
+
+    Returns a list with one ``(rx, ry, ryaw, rk, s)`` tuple of arrays per
+    path (empty arrays for invalid paths), or with ``padded=True`` the
+    tuple ``(rx, ry, ryaw, rk, s, counts)`` of (N, M) arrays padded with
+    NaN after ``counts`` samples.
+    """
+    sp = CubicSpline2DBatch(x, y, lengths)
+    counts = np.where(sp.valid, np.ceil(sp.s_end / ds), 0).astype(int)
+    num_samples = max(int(counts.max(initial=0)), 1)
+    s = np.arange(num_samples) * ds
+    s = np.broadcast_to(s, (len(counts), num_samples)).copy()
+    inside = np.arange(num_samples)[None, :] < counts[:, None]
+    s[~inside] = 0.0
+
+    rx, ry = sp.calc_position(s)
+    course = [rx, ry, sp.calc_yaw(s), sp.calc_curvature(s), s]
+    for k in course:
+        k[~inside] = np.nan
+
+    if padded:
+        return tuple(course) + (counts,)
+    return [tuple(k[i, :counts[i]] for k in course) for i in range(len(counts))]
+
+
 def main_1d():
     print("CubicSpline1D test")
     import matplotlib.pyplot as plt
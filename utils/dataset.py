@@ -0,0 +1,268 @@
+"""
+Streaming dataset runner
+
+Scenarios are read lazily (one pickle per file, or many pickle records
+appended to one shard file), pushed through a forward function such as
+`mpc_module.mpc_forward`, and handed to a writer as soon as they finish.
+At most `max_pending` scenarios are in flight and no new one is submitted
+while the process is above `max_memory_mb`, so memory stays bounded whatever
+the dataset size.
+
+"""
+import os
+import glob
+import time
+import pickle
+from collections import deque
+
+from utils import scenario_store
+
+PICKLE_EXTENSIONS = (".pickle", ".pkl")
+
+
+def expand_paths(paths):
+    """
+    Expand files, directories and glob patterns into a sorted list of files.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    files = []
+    for path in paths:
+        if scenario_store.is_store(path):
+            files.append(path)
+        elif os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.endswith(PICKLE_EXTENSIONS))
+        elif glob.has_magic(path):
+            files += sorted(glob.glob(path))
+        else:
+            files.append(path)
+    return files
+
+
+def scenario_id(data, default):
+    """
+    `scenario/id` of a scenario, or `default` if it has none.
+    """
+    sid = data.get('scenario/id', default) if isinstance(data, dict) else default
+    if isinstance(sid, bytes):
+        sid = sid.decode()
+    return str(sid)
+
+
+def iter_pickle_records(path):
+    """
+    Yield every pickle record of a file, one at a time.
+    """
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def iter_scenarios(paths, fields=scenario_store.SETUP_FIELDS):
+    """
+    Lazily yield (scenario id, scenario dict) from files, directories or globs.
+
+    A file may hold a single scenario dict, a shard of appended scenario
+    records (see `ShardWriter`), or a legacy list of scenarios. A legacy list
+    has to be unpickled at once; convert it to a shard to stream it.
+    A directory may also be a scenario store (see `utils.scenario_store`),
+    its scenarios are yielded as memmap views of `fields` (by default the
+    fields `mpc_forward` reads) plus `scenario/id`, or as whole scenarios
+    with their scenario-level extras when `fields` is None.
+    """
+    for path in expand_paths(paths):
+        if scenario_store.is_store(path):
+            store = scenario_store.ScenarioStore(path)
+            if fields is None:
+                yield from store
+                continue
+            for i, sid in enumerate(store.ids):
+                data = store.view(i, fields)
+                data['scenario/id'] = sid
+                yield sid, data
+            continue
+        name = os.path.splitext(os.path.basename(path))[0]
+        for record_index, record in enumerate(iter_pickle_records(path)):
+            if isinstance(record, (list, tuple)):
+                for i, data in enumerate(record):
+                    yield scenario_id(data, '%s:%d' % (name, i)), data
+                del record
+            else:
+                yield scenario_id(record, '%s:%d' % (name, record_index)), record
+
+
+class ShardWriter:
+    """
+    Append (scenario id, data) records to a single pickle shard file.
+
+    The shard is readable with `iter_scenarios` (records are yielded as
+    scenario dicts) or `iter_pickle_records` (records are dicts with the
+    id under 'scenario/id'). When `size` is given, an existing shard is
+    first truncated to that many bytes (e.g. to drop records written after
+    the last manifest entry of a crashed run).
+    """
+
+    def __init__(self, path, mode='ab', size=None):
+        self.path = path
+        if size is not None and os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+        self.file = open(path, mode)
+        self.count = 0
+
+    def write(self, sid, data):
+        """
+        Append one record, returns its byte range {'offset', 'end'}.
+        """
+        if isinstance(data, dict) and 'scenario/id' not in data:
+            data = dict(data)
+            data['scenario/id'] = sid
+        self.file.seek(0, os.SEEK_END)
+        offset = self.file.tell()
+        pickle.dump(data, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.file.flush()
+        self.count += 1
+        return {'offset': offset, 'end': self.file.tell()}
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def convert_to_shard(paths, shard_path):
+    """
+    Rewrite scenarios (e.g. a legacy list pickle) into a streamable shard.
+    """
+    with ShardWriter(shard_path, 'wb') as writer:
+        for sid, data in iter_scenarios(paths, fields=None):
+            writer.write(sid, data)
+    return writer.count
+
+
+def current_rss_mb(pid=None):
+    """
+    Resident memory of this process, or of process `pid` (only where /proc
+    exists) [MB], None if it cannot be measured.
+    """
+    try:
+        with open('/proc/%s/statm' % ('self' if pid is None else pid)) as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2.0**20
+    except (OSError, ValueError, AttributeError):
+        pass
+    if pid is not None:
+        return None
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / 2.0**20 if os.uname().sysname == 'Darwin' else rss / 2.0**10
+    except (ImportError, AttributeError):
+        return None
+
+
+def pool_rss_mb(pool):
+    """
+    Resident memory of this process plus the workers of a
+    `multiprocessing.Pool` [MB] (pages shared after fork count once per
+    process), None if it cannot be measured. Workers count only where
+    /proc exists.
+    """
+    total = current_rss_mb()
+    if total is None:
+        return None
+    for process in list(getattr(pool, '_pool', ())):
+        rss = current_rss_mb(process.pid)
+        if rss is not None:
+            total += rss
+    return total
+
+
+def _run_one(forward, sid, data):
+    start = time.time()
+    result = forward(data)
+    return sid, result, time.time() - start
+
+
+def run_stream(scenarios, forward, writer=None, workers=1, max_pending=None,
+               max_memory_mb=None, initializer=None, initargs=(),
+               maxtasksperchild=None):
+    """
+    Run `forward` on every scenario and write results incrementally.
+
+    Parameters
+    ----------
+    scenarios : iterable
+        (scenario id, scenario dict) pairs, e.g. from `iter_scenarios`.
+    forward : callable
+        picklable function mapping a scenario dict to a result,
+        e.g. `mpc_module.mpc_forward`.
+    writer : object, optional
+        anything with a `write(sid, result)` method, called in input order.
+        It may return a dict describing where the result was written.
+    workers : int
+        number of worker processes, 1 runs everything in this process.
+    max_pending : int, optional
+        maximum number of scenarios in flight, defaults to 2 * workers.
+    max_memory_mb : float, optional
+        do not read or submit new scenarios while the resident memory of
+        this process and its workers is above this ceiling. Needs
+        workers > 1: a single process has no scenarios in flight to wait
+        for.
+    initializer, initargs, maxtasksperchild :
+        passed to `multiprocessing.Pool`.
+
+    Yields
+    ------
+    sid, seconds, written : str, float, dict
+        scenario id, run time and the writer's return value (empty if none)
+        of every finished scenario, in input order.
+    """
+    if workers <= 1 and max_memory_mb is not None:
+        raise ValueError('max_memory_mb needs workers > 1')
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for sid, data in scenarios:
+            sid, result, seconds = _run_one(forward, sid, data)
+            del data
+            written = writer.write(sid, result) if writer is not None else None
+            del result
+            yield sid, seconds, written or {}
+        return
+
+    import multiprocessing
+
+    max_pending = max_pending or 2 * workers
+    pending = deque()
+    with multiprocessing.Pool(workers, initializer, initargs, maxtasksperchild) as pool:
+
+        def drain(block):
+            while pending and (block or pending[0].ready()):
+                sid, result, seconds = pending.popleft().get()
+                written = writer.write(sid, result) if writer is not None else None
+                del result
+                yield sid, seconds, written or {}
+                block = False
+
+        for sid, data in scenarios:
+            # backpressure: bounded queue, and wait for results while above
+            # the memory ceiling
+            while len(pending) >= max_pending or (
+                    pending and max_memory_mb is not None
+                    and (pool_rss_mb(pool) or 0.0) > max_memory_mb):
+                yield from drain(block=True)
+            pending.append(pool.apply_async(_run_one, (forward, sid, data)))
+            del data
+            yield from drain(block=False)
+
+        while pending:
+            yield from drain(block=True)
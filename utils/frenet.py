@@ -0,0 +1,111 @@
+"""
+Arc-length (Frenet) projection onto a polyline reference course
+
+The course is kept as a polyline with its cumulative arc length, so a vehicle
+position is projected to a continuous arc length s and a lateral error
+instead of being snapped to the nearest waypoint index. References can then
+be sampled at any s, whatever the spacing of the waypoints.
+
+"""
+import numpy as np
+
+
+class ArcLengthPath:
+    """
+    Polyline with precomputed cumulative arc length
+
+    Parameters
+    ----------
+    cx : list
+        x coordinates of the course.
+    cy : list
+        y coordinates of the course.
+    cyaw : list, optional
+        yaw of the course, should be continuous (see SINGLE_MPC.smooth_yaw).
+    sp : list, optional
+        speed profile of the course.
+    """
+
+    def __init__(self, cx, cy, cyaw=None, sp=None):
+        self.x = np.asarray(cx, dtype=float)
+        self.y = np.asarray(cy, dtype=float)
+        self.yaw = np.zeros_like(self.x) if cyaw is None else np.asarray(cyaw, dtype=float)
+        self.sp = np.zeros_like(self.x) if sp is None else np.asarray(sp, dtype=float)
+
+        self.dx = np.diff(self.x)
+        self.dy = np.diff(self.y)
+        self.ds = np.hypot(self.dx, self.dy)
+        self.s = np.zeros_like(self.x)
+        self.s[1:] = np.cumsum(self.ds)
+        self.length = self.s[-1]
+
+    def project(self, x, y, s_hint=None, window=None):
+        """
+        Project a point onto the course.
+
+        Parameters
+        ----------
+        x, y : float
+            point to project.
+        s_hint : float, optional
+            previous arc length, segments ending before it are ignored so the
+            projection does not jump back on self intersecting courses.
+        window : float, optional
+            only search segments starting less than `window` meters after
+            s_hint.
+
+        Returns
+        -------
+        s : float
+            arc length of the projection.
+        e : float
+            signed lateral error, positive when the point is left of the course.
+        ind : int
+            index of the segment (waypoint before the projection).
+        """
+        if len(self.ds) == 0:
+            return 0.0, float(np.hypot(x - self.x[0], y - self.y[0])), 0
+
+        seg = np.arange(len(self.ds))
+        if s_hint is not None:
+            keep = self.s[1:] >= s_hint
+            if window is not None:
+                keep &= self.s[:-1] <= s_hint + window
+            if np.any(keep):
+                seg = seg[keep]
+
+        px = x - self.x[seg]
+        py = y - self.y[seg]
+        l2 = np.maximum(self.ds[seg] ** 2, 1e-12)
+        t = np.clip((px * self.dx[seg] + py * self.dy[seg]) / l2, 0.0, 1.0)
+        ex = px - t * self.dx[seg]
+        ey = py - t * self.dy[seg]
+        k = int(np.argmin(ex ** 2 + ey ** 2))
+
+        i = seg[k]
+        s = self.s[i] + t[k] * self.ds[i]
+        cross = self.dx[i] * py[k] - self.dy[i] * px[k]
+        e = float(np.hypot(ex[k], ey[k]))
+        if cross < 0:
+            e = -e
+        return float(s), e, int(i)
+
+    def index(self, s):
+        """
+        Index of the waypoint at or before arc length s.
+        """
+        return int(np.clip(np.searchsorted(self.s, s, side="right") - 1,
+                           0, len(self.s) - 1))
+
+    def interpolate(self, s):
+        """
+        Interpolate the course at arc length(s) s, clamped to the course ends.
+
+        Returns
+        -------
+        x, y, yaw, v : ndarray
+            position, yaw and speed profile at s.
+        """
+        s = np.clip(s, 0.0, self.length)
+        return (np.interp(s, self.s, self.x), np.interp(s, self.s, self.y),
+                np.interp(s, self.s, self.yaw), np.interp(s, self.s, self.sp))
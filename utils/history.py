@@ -0,0 +1,106 @@
+"""
+Fixed-size trajectory records
+
+`SINGLE_MPC` records its trajectory (x, y, yaw, v, ...) one value per tick.
+`RingBuffer` bounds the memory of such a record for long or open-ended
+simulations:
+
+    'first'    keep the first `capacity` values and drop the rest, enough
+               for `mpc_forward`, which outputs a known number of steps
+    'last'     keep the last `capacity` values
+    'windows'  as 'last', and every `capacity` values close a window, to be
+               taken with `take_windows` (e.g. streamed to a trace), so the
+               whole record can be written out with constant memory
+
+"""
+import numpy as np
+
+KEEP = ('first', 'last', 'windows')
+
+
+class RingBuffer:
+    """
+    Bounded record of values
+
+    Parameters
+    ----------
+    capacity : int
+        number of values kept.
+    dtype : numpy dtype
+        type of the stored values.
+    keep : str
+        'first', 'last' or 'windows', see the module docstring.
+    """
+
+    def __init__(self, capacity, dtype=float, keep='last'):
+        if keep not in KEEP:
+            raise ValueError('unknown keep mode: %r' % (keep,))
+        if capacity < 1:
+            raise ValueError('capacity must be positive: %r' % (capacity,))
+        self.data = np.empty(capacity, dtype=dtype)
+        self.capacity = capacity
+        self.keep = keep
+        self.total = 0  # values appended so far
+        self.size = 0  # values stored
+        self.emitted = 0  # values already in windows
+        self.closed = []  # windows (start, values) not taken yet
+
+    @property
+    def start(self):
+        """
+        Index of the first stored value among all appended values.
+        """
+        return 0 if self.keep == 'first' else self.total - self.size
+
+    def append(self, value):
+        if self.keep == 'first':
+            if self.size < self.capacity:
+                self.data[self.size] = value
+                self.size += 1
+        else:
+            self.data[self.total % self.capacity] = value
+            self.size = min(self.size + 1, self.capacity)
+        self.total += 1
+        if self.keep == 'windows' and self.total - self.emitted == self.capacity:
+            self.close_window()
+
+    def close_window(self):
+        count = self.total - self.emitted
+        if count:
+            self.closed.append((self.emitted, self.values()[-count:]))
+            self.emitted = self.total
+
+    def take_windows(self, flush=False):
+        """
+        Closed windows [(start, values), ...] since the last call, with
+        `flush` also the values after the last closed window.
+        """
+        if flush and self.keep == 'windows':
+            self.close_window()
+        windows, self.closed = self.closed, []
+        return windows
+
+    def values(self):
+        """
+        Stored values in the order they were appended.
+        """
+        if self.keep != 'first' and self.size == self.capacity:
+            split = self.total % self.capacity
+            return np.concatenate((self.data[split:], self.data[:split]))
+        return self.data[:self.size].copy()
+
+    def __len__(self):
+        return self.size
+
+    def __array__(self, dtype=None):
+        values = self.values()
+        return values if dtype is None else values.astype(dtype)
+
+    def __iter__(self):
+        return iter(self.values().tolist())
+
+    def __getitem__(self, index):
+        return self.values()[index]
+
+    def __repr__(self):
+        return 'RingBuffer(capacity=%d, keep=%r, total=%d)' % (self.capacity, self.keep, self.total)
@@ -0,0 +1,111 @@
+"""
+Event hooks and JSON-lines tracing for the MPC rollout
+
+Callbacks are registered per event and called as ``callback(event, info)``
+with a dict of plain values. Events fired by `mpc_module`:
+
+    tick_start    scenario, tick, time
+    tick_end      scenario, tick, time, reached, seconds
+    solve         agent, status, horizon, dt, iterations, solve_time, cost
+    avoidance     agent, force, obstacles
+    goal_reached  agent, time, x, y
+    replan        agent, reason, time   (only with REPLAN_EVERY > 1)
+    history       agent, field, start, values   (only with HISTORY_WINDOWS)
+    course_cache  scenario, entries, hits, disk_hits, misses, evictions, disk_evictions, hit_rate
+                  (end of every scenario with a COURSE_CACHE, counters of the process)
+
+`JsonlTraceSink` writes every event it receives as one compact JSON line.
+
+"""
+import os
+import json
+import time
+
+EVENTS = ('tick_start', 'tick_end', 'solve', 'avoidance', 'goal_reached', 'replan', 'history', 'course_cache')
+
+
+class Hooks:
+    """
+    Registry of event callbacks
+
+    Examples
+    --------
+    >>> hooks = Hooks()
+    >>> hooks.on('solve', lambda event, info: print(info['solve_time']))
+    >>> JsonlTraceSink('trace.jsonl').attach(hooks)
+    >>> mpc_forward(data, hooks=hooks)
+    """
+
+    def __init__(self):
+        self.callbacks = {event: [] for event in EVENTS}
+
+    def on(self, event, callback):
+        """
+        Register `callback(event, info)` for `event`, or for every event if
+        `event` is None.
+        """
+        events = EVENTS if event is None else (event,)
+        for name in events:
+            if name not in self.callbacks:
+                raise ValueError('unknown event: ' + str(name))
+            self.callbacks[name].append(callback)
+        return callback
+
+    def wants(self, event):
+        """
+        True if anything listens to `event`, to skip building its info.
+        """
+        return bool(self.callbacks[event])
+
+    def emit(self, event, **info):
+        for callback in self.callbacks[event]:
+            callback(event, info)
+
+
+class JsonlTraceSink:
+    """
+    Write events as JSON lines, one object per event
+
+    Parameters
+    ----------
+    path : str
+        trace file, opened for appending.
+    flush_every : int
+        flush the file every `flush_every` events, and at the end of every
+        tick so traces of killed workers are complete up to their last tick.
+    """
+
+    def __init__(self, path, flush_every=100):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'a')
+        self.flush_every = flush_every
+        self.count = 0
+
+    def attach(self, hooks, events=None):
+        """
+        Listen to `events` (all by default) of `hooks`.
+        """
+        for event in events or EVENTS:
+            hooks.on(event, self)
+        return self
+
+    def __call__(self, event, info):
+        record = {'event': event, 'wall': round(time.time(), 6)}
+        record.update(info)
+        self.file.write(json.dumps(record, separators=(',', ':'), default=_to_json) + '\n')
+        self.count += 1
+        if event in ('tick_end', 'course_cache') or self.count % self.flush_every == 0:
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def _to_json(value):
+    # numpy scalars and arrays
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
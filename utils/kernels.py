@@ -0,0 +1,206 @@
+"""
+Array kernels of the bicycle model
+
+Rollout (`SINGLE_MPC.predict_motion` / `update_state`), linearization
+(`get_linear_model_matrix`) and angle wrapping (`pi_2_pi`) for one agent or
+many agents at once. The kernels are compiled with numba when it is
+installed (an optional dependency) and fall back to NumPy otherwise; both
+give the same results up to floating point rounding.
+
+States are [x, y, v, yaw] like the rows of the MPC's `xbar`.
+
+"""
+import math
+
+import numpy as np
+
+from utils.lazy_import import LazyModule
+
+numba = LazyModule('numba')
+
+BACKENDS = ('auto', 'numba', 'numpy')
+_compiled = {}
+_have_numba = None
+
+
+def have_numba():
+    global _have_numba
+    if _have_numba is None:
+        try:
+            numba.load()
+            _have_numba = True
+        except ImportError:
+            _have_numba = False
+    return _have_numba
+
+
+def _backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError('unknown kernel backend: %r' % (backend,))
+    if backend == 'auto':
+        return 'numba' if have_numba() else 'numpy'
+    return backend
+
+
+def _jit(function):
+    # compile on first use, so importing this module never imports numba
+    compiled = _compiled.get(function.__name__)
+    if compiled is None:
+        compiled = numba.njit(cache=True, fastmath=False)(function)
+        _compiled[function.__name__] = compiled
+    return compiled
+
+
+# -- angle wrapping ---------------------------------------------------------
+
+def _wrap_angle_loop(angle, out):
+    for i in range(angle.shape[0]):
+        a = angle[i]
+        while a > math.pi:
+            a = a - 2.0 * math.pi
+        while a < -math.pi:
+            a = a + 2.0 * math.pi
+        out[i] = a
+
+
+def wrap_angle(angle, backend='auto'):
+    """
+    Angles wrapped into [-pi, pi], element-wise `pi_2_pi`.
+    """
+    angle = np.asarray(angle, dtype=float)
+    if _backend(backend) == 'numba':
+        out = np.empty(angle.size)
+        _jit(_wrap_angle_loop)(np.ascontiguousarray(angle).reshape(-1), out)
+        return out.reshape(angle.shape)
+    wrapped = angle - 2.0 * math.pi * np.floor((angle + math.pi) / (2.0 * math.pi))
+    # pi_2_pi keeps +pi for positive input
+    return np.where((wrapped == -math.pi) & (angle > 0), math.pi, wrapped)
+
+
+# -- rollout ----------------------------------------------------------------
+
+def _rollout_loop(x0, oa, od, dt, wb, max_steer, max_speed, min_speed, out):
+    for n in range(x0.shape[0]):
+        x, y, v, yaw = x0[n, 0], x0[n, 1], x0[n, 2], x0[n, 3]
+        out[n, 0, 0], out[n, 1, 0], out[n, 2, 0], out[n, 3, 0] = x, y, v, yaw
+        for t in range(oa.shape[1]):
+            delta = od[n, t]
+            if delta >= max_steer:
+                delta = max_steer
+            elif delta <= -max_steer:
+                delta = -max_steer
+            nx = x + v * math.cos(yaw) * dt
+            ny = y + v * math.sin(yaw) * dt
+            yaw = yaw + v / wb * math.tan(delta) * dt
+            v = v + oa[n, t] * dt
+            if v > max_speed:
+                v = max_speed
+            elif v < min_speed:
+                v = min_speed
+            x, y = nx, ny
+            out[n, 0, t + 1], out[n, 1, t + 1], out[n, 2, t + 1], out[n, 3, t + 1] = x, y, v, yaw
+
+
+def _rollout_numpy(x0, oa, od, dt, wb, max_steer, max_speed, min_speed, out):
+    x, y, v, yaw = x0[:, 0].copy(), x0[:, 1].copy(), x0[:, 2].copy(), x0[:, 3].copy()
+    out[:, :, 0] = x0
+    for t in range(oa.shape[1]):
+        delta = np.clip(od[:, t], -max_steer, max_steer)
+        nx = x + v * np.cos(yaw) * dt
+        ny = y + v * np.sin(yaw) * dt
+        yaw = yaw + v / wb * np.tan(delta) * dt
+        v = np.clip(v + oa[:, t] * dt, min_speed, max_speed)
+        x, y = nx, ny
+        out[:, 0, t + 1], out[:, 1, t + 1], out[:, 2, t + 1], out[:, 3, t + 1] = x, y, v, yaw
+
+
+def rollout(x0, oa, od, dt, wb, max_steer, max_speed, min_speed, backend='auto'):
+    """
+    Roll the bicycle model out from `x0` under the inputs `oa`, `od`.
+
+    Parameters
+    ----------
+    x0 : (4,) or (N, 4) array_like
+        initial states [x, y, v, yaw].
+    oa, od : (T,) or (N, T) array_like
+        acceleration and steering inputs.
+
+    Returns
+    -------
+    (4, T + 1) or (N, 4, T + 1) ndarray
+        states of every step, the initial state first.
+    """
+    single = np.ndim(x0) == 1
+    x0 = np.atleast_2d(np.asarray(x0, dtype=float))
+    oa = np.atleast_2d(np.asarray(oa, dtype=float))
+    od = np.atleast_2d(np.asarray(od, dtype=float))
+    out = np.empty((x0.shape[0], 4, oa.shape[1] + 1))
+    if _backend(backend) == 'numba':
+        _jit(_rollout_loop)(x0, oa, od, float(dt), float(wb), float(max_steer), float(max_speed),
+                            float(min_speed), out)
+    else:
+        _rollout_numpy(x0, oa, od, dt, wb, max_steer, max_speed, min_speed, out)
+    return out[0] if single else out
+
+
+# -- linearization ----------------------------------------------------------
+
+def _linearize_loop(v, phi, delta, dt, wb, A, B, C):
+    for i in range(v.shape[0]):
+        cos_phi, sin_phi = math.cos(phi[i]), math.sin(phi[i])
+        cos_delta = math.cos(delta[i])
+        A[i, 0, 0] = 1.0
+        A[i, 1, 1] = 1.0
+        A[i, 2, 2] = 1.0
+        A[i, 3, 3] = 1.0
+        A[i, 0, 2] = dt * cos_phi
+        A[i, 0, 3] = - dt * v[i] * sin_phi
+        A[i, 1, 2] = dt * sin_phi
+        A[i, 1, 3] = dt * v[i] * cos_phi
+        A[i, 3, 2] = dt * math.tan(delta[i]) / wb
+        B[i, 2, 0] = dt
+        B[i, 3, 1] = dt * v[i] / (wb * cos_delta ** 2)
+        C[i, 0] = dt * v[i] * sin_phi * phi[i]
+        C[i, 1] = - dt * v[i] * cos_phi * phi[i]
+        C[i, 3] = - dt * v[i] * delta[i] / (wb * cos_delta ** 2)
+
+
+def _linearize_numpy(v, phi, delta, dt, wb, A, B, C):
+    cos_phi, sin_phi = np.cos(phi), np.sin(phi)
+    cos_delta = np.cos(delta)
+    A[:, 0, 0] = A[:, 1, 1] = A[:, 2, 2] = A[:, 3, 3] = 1.0
+    A[:, 0, 2] = dt * cos_phi
+    A[:, 0, 3] = - dt * v * sin_phi
+    A[:, 1, 2] = dt * sin_phi
+    A[:, 1, 3] = dt * v * cos_phi
+    A[:, 3, 2] = dt * np.tan(delta) / wb
+    B[:, 2, 0] = dt
+    B[:, 3, 1] = dt * v / (wb * cos_delta ** 2)
+    C[:, 0] = dt * v * sin_phi * phi
+    C[:, 1] = - dt * v * cos_phi * phi
+    C[:, 3] = - dt * v * delta / (wb * cos_delta ** 2)
+
+
+def linearize(v, phi, delta, dt, wb, backend='auto'):
+    """
+    Linearized model x' = A x + B u + C at operational points (v, phi,
+    delta), as `get_linear_model_matrix` but for arrays of points.
+
+    Returns
+    -------
+    A : (..., 4, 4) ndarray
+    B : (..., 4, 2) ndarray
+    C : (..., 4) ndarray
+        with the leading shape of the inputs.
+    """
+    v, phi, delta = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (v, phi, delta)))
+    shape = v.shape
+    v, phi, delta = (np.ascontiguousarray(a).reshape(-1) for a in (v, phi, delta))
+    A = np.zeros((v.size, 4, 4))
+    B = np.zeros((v.size, 4, 2))
+    C = np.zeros((v.size, 4))
+    if _backend(backend) == 'numba':
+        _jit(_linearize_loop)(v, phi, delta, float(dt), float(wb), A, B, C)
+    else:
+        _linearize_numpy(v, phi, delta, dt, wb, A, B, C)
+    return A.reshape(shape + (4, 4)), B.reshape(shape + (4, 2)), C.reshape(shape + (4,))
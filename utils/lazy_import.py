@@ -0,0 +1,46 @@
+"""
+Lazy module imports
+
+Heavy optional dependencies (matplotlib.pyplot, cvxpy, ...) are only
+imported the first time one of their attributes is used, so headless
+workers and the fast solver paths never pay for them.
+
+"""
+import importlib
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access
+
+    Examples
+    --------
+    >>> plt = LazyModule('matplotlib.pyplot')   # nothing imported yet
+    >>> plt.plot([0, 1], [0, 1])                # imports matplotlib.pyplot
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def load(self):
+        """
+        Import the module now and return it.
+        """
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.load(), attr, value)
+
+    def __repr__(self):
+        state = 'loaded' if self.loaded else 'not loaded'
+        return '<lazy module %r (%s)>' % (self._name, state)
@@ -0,0 +1,402 @@
+"""
+Compiled, parametric linear MPC problems
+
+`SINGLE_MPC.linear_mpc_control` builds a new cvxpy problem for every solve,
+and cvxpy spends most of the solve time canonicalizing it. The problem only
+changes through its data (the linearized model, the reference and the
+initial state), so it can be built once with cvxpy Parameters and then
+re-solved with new parameter values, which skips canonicalization (DPP).
+
+Problems are cached per process by their structure (horizon, cost matrices,
+limits), so every controller with the same settings shares one problem.
+
+`CondensedMPC` is the same problem with the states eliminated, built for a
+batch of controllers at once and solved by the batched ADMM solver of
+`utils.batch_qp`.
+
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+from utils import batch_qp
+from utils.lazy_import import LazyModule
+
+cvxpy = LazyModule('cvxpy')
+
+
+class LinearMPCProblem:
+    """
+    Linear MPC problem over `T` steps with the model as parameters
+
+    Same cost and constraints as `SINGLE_MPC.linear_mpc_control`.
+
+    Parameters
+    ----------
+    T : int
+        horizon length.
+    Q, R, Rd, Qf : ndarray
+        state, input, input difference and final state cost matrices.
+    max_speed, min_speed, max_accel, max_steer : float
+        state and input bounds.
+    max_dsteer_step : float
+        maximum steering change per step (MAX_DSTEER * DT).
+    obstacle_slots : int
+        number of obstacles that can get collision halfplanes (see
+        `utils.collision`), 0 for none.
+    slack_weight : float
+        cost per meter of violating a collision halfplane, the halfplanes
+        are soft so the problem stays feasible.
+    blocks : tuple, optional
+        move blocking, lengths of the blocks of steps with a constant input
+        (see `move_blocks`), None for one input per step.
+    """
+
+    def __init__(self, T, Q, R, Rd, Qf, max_speed, min_speed, max_accel, max_steer,
+                 max_dsteer_step, obstacle_slots=0, slack_weight=1e3, blocks=None):
+        NX, NU = Q.shape[0], R.shape[0]
+        self.T, self.NX, self.NU = T, NX, NU
+        self.x = cvxpy.Variable((NX, T + 1))
+        self.u, u_free, boundaries = blocked_input(NU, T, blocks)
+        # models of all steps side by side, [A_0 A_1 ...], one parameter each
+        self.A = cvxpy.Parameter((NX, NX * T))
+        self.B = cvxpy.Parameter((NX, NU * T))
+        self.C = cvxpy.Parameter((NX, T))
+        self.xref = cvxpy.Parameter((NX, T + 1))
+        self.x0 = cvxpy.Parameter(NX)
+
+        x, u, xref = self.x, self.u, self.xref
+        cost = 0.0
+        constraints = []
+        for t in range(T):
+            cost += cvxpy.quad_form(u[:, t], R)
+            if t != 0:
+                cost += cvxpy.quad_form(xref[:, t] - x[:, t], Q)
+            A = self.A[:, NX * t:NX * (t + 1)]
+            B = self.B[:, NU * t:NU * (t + 1)]
+            constraints += [x[:, t + 1] == A @ x[:, t] + B @ u[:, t] + self.C[:, t]]
+            if t in boundaries:
+                cost += cvxpy.quad_form(u[:, t + 1] - u[:, t], Rd)
+                constraints += [cvxpy.abs(u[1, t + 1] - u[1, t]) <= max_dsteer_step]
+        cost += cvxpy.quad_form(xref[:, T] - x[:, T], Qf)
+
+        constraints += [x[:, 0] == self.x0]
+        constraints += [x[2, :] <= max_speed]
+        constraints += [x[2, :] >= min_speed]
+        constraints += [cvxpy.abs(u_free[0, :]) <= max_accel]
+        constraints += [cvxpy.abs(u_free[1, :]) <= max_steer]
+
+        self.obstacle_slots = obstacle_slots
+        if obstacle_slots:
+            self.n_x = cvxpy.Parameter((obstacle_slots, T))
+            self.n_y = cvxpy.Parameter((obstacle_slots, T))
+            self.b = cvxpy.Parameter((obstacle_slots, T))
+            slack = cvxpy.Variable((obstacle_slots, T), nonneg=True)
+            for j in range(obstacle_slots):
+                constraints += [cvxpy.multiply(self.n_x[j], x[0, 1:]) + cvxpy.multiply(self.n_y[j], x[1, 1:])
+                                >= self.b[j] - slack[j]]
+            cost += slack_weight * cvxpy.sum(slack)
+            self.set_halfplanes(np.zeros((obstacle_slots, T, 2)), np.full((obstacle_slots, T), -1.0))
+
+        self.problem = cvxpy.Problem(cvxpy.Minimize(cost), constraints)
+        self.solves = 0
+
+    def set_models(self, A, B, C):
+        """
+        Linearized models of all steps, (T, NX, NX), (T, NX, NU) and (T, NX)
+        arrays (see `utils.kernels.linearize`).
+        """
+        self.A.value = np.concatenate(A, axis=1)
+        self.B.value = np.concatenate(B, axis=1)
+        self.C.value = np.asarray(C).T
+
+    def set_halfplanes(self, n, b):
+        """
+        Collision halfplanes ``n[j, t] . p_{t+1} >= b[j, t]``, see
+        `utils.collision.halfplanes`.
+        """
+        self.n_x.value = n[:, :, 0]
+        self.n_y.value = n[:, :, 1]
+        self.b.value = b
+
+    def solve(self, xref, x0, solver, **kwargs):
+        """
+        Solve with the current model for reference `xref` from state `x0`,
+        returns the cvxpy status. The solution is in `x.value`, `u.value`.
+        """
+        self.xref.value = np.asarray(xref, dtype=float)
+        self.x0.value = np.asarray(x0, dtype=float)
+        self.problem.solve(solver=solver, verbose=False, **kwargs)
+        self.solves += 1
+        return self.problem.status
+
+
+class CondensedMPC:
+    """
+    Condensed linear MPC problems of a batch of controllers
+
+    Same cost and constraints as `LinearMPCProblem`, with the states
+    written as x_t = s_t + G_t w of the free inputs w (the initial state
+    and the model offsets in s_t), so the QP of every controller only has
+    the NU * blocks inputs and the collision slacks as variables. The
+    matrices that do not depend on the model are built once.
+
+    Parameters
+    ----------
+    Same as `LinearMPCProblem`.
+    """
+
+    def __init__(self, T, Q, R, Rd, Qf, max_speed, min_speed, max_accel, max_steer,
+                 max_dsteer_step, obstacle_slots=0, slack_weight=1e3, blocks=None):
+        NX, NU = Q.shape[0], R.shape[0]
+        self.T, self.NX, self.NU = T, NX, NU
+        self.max_speed, self.min_speed = max_speed, min_speed
+        self.max_accel, self.max_steer, self.max_dsteer_step = max_accel, max_steer, max_dsteer_step
+        self.obstacle_slots, self.slack_weight = obstacle_slots, slack_weight
+
+        # u = E w, u ordered [a_0, d_0, a_1, d_1, ...]
+        if blocks is None:
+            blocks = (1,) * T
+        starts = np.cumsum((0,) + tuple(blocks))
+        self.E = np.zeros((NU * T, NU * len(blocks)))
+        for k in range(len(blocks)):
+            for t in range(starts[k], starts[k + 1]):
+                self.E[NU * t:NU * (t + 1), NU * k:NU * (k + 1)] = np.eye(NU)
+        self.n_inputs = NU * len(blocks)
+        boundaries = sorted(int(end) - 1 for end in starts[1:-1])
+
+        # input and input difference costs
+        difference = np.zeros((NU * len(boundaries), NU * T))
+        for row, t in enumerate(boundaries):
+            difference[NU * row:NU * (row + 1), NU * (t + 1):NU * (t + 2)] = np.eye(NU)
+            difference[NU * row:NU * (row + 1), NU * t:NU * (t + 1)] = -np.eye(NU)
+        input_cost = (np.kron(np.eye(T), R)
+                      + difference.T @ np.kron(np.eye(len(boundaries)), Rd) @ difference)
+        self.H_inputs = self.E.T @ input_cost @ self.E
+        self.rate_rows = np.array([self.E[NU * (t + 1) + 1] - self.E[NU * t + 1] for t in boundaries]
+                                  ).reshape(len(boundaries), self.n_inputs)
+        # state cost of every step, none on the initial state
+        self.W = np.array([np.zeros((NX, NX))] + [Q] * (T - 1) + [Qf])
+        self.solves = 0
+
+    def condense(self, A, B, C, x0):
+        """
+        States of the horizon as x_t = s_t + G_t w.
+
+        Returns
+        -------
+        s : (N, T + 1, NX) ndarray
+        G : (N, T + 1, NX, n_inputs) ndarray
+        """
+        N, T, NX, NU = len(x0), self.T, self.NX, self.NU
+        s = np.zeros((N, T + 1, NX))
+        G = np.zeros((N, T + 1, NX, NU * T))
+        s[:, 0] = x0
+        for t in range(T):
+            s[:, t + 1] = np.einsum('nij,nj->ni', A[:, t], s[:, t]) + C[:, t]
+            G[:, t + 1] = np.einsum('nij,njk->nik', A[:, t], G[:, t])
+            G[:, t + 1, :, NU * t:NU * (t + 1)] += B[:, t]
+        return s, G @ self.E
+
+    def qp(self, s, G, xref, n=None, b=None):
+        """
+        Batch QP (see `utils.batch_qp.solve`) over z = [w, slacks], and
+        the constant part of the cost.
+        """
+        N, T, K = len(s), self.T, self.obstacle_slots
+        nw, ns = self.n_inputs, K * T
+        residual = s - np.transpose(xref, (0, 2, 1))
+        WG = np.einsum('tij,ntjk->ntik', self.W, G)
+        P = np.zeros((N, nw + ns, nw + ns))
+        P[:, :nw, :nw] = 2.0 * (self.H_inputs + np.einsum('ntia,ntib->nab', G, WG))
+        q = np.zeros((N, nw + ns))
+        q[:, :nw] = 2.0 * np.einsum('ntia,nti->na', WG, residual)
+        q[:, nw:] = self.slack_weight
+        constant = np.einsum('nti,tij,ntj->n', residual, self.W, residual)
+
+        rows, lower, upper = [], [], []
+
+        def add(row, lo, up):
+            rows.append(np.broadcast_to(row, (N,) + row.shape[-2:]))
+            lower.append(np.broadcast_to(lo, (N, row.shape[-2])))
+            upper.append(np.broadcast_to(up, (N, row.shape[-2])))
+
+        speed = np.zeros((N, T, nw + ns))
+        speed[:, :, :nw] = G[:, 1:, 2]
+        add(speed, self.min_speed - s[:, 1:, 2], self.max_speed - s[:, 1:, 2])
+        inputs = np.hstack([np.eye(nw), np.zeros((nw, ns))])
+        add(inputs, -np.tile([self.max_accel, self.max_steer], nw // 2),
+            np.tile([self.max_accel, self.max_steer], nw // 2))
+        rate = np.hstack([self.rate_rows, np.zeros((len(self.rate_rows), ns))])
+        add(rate, -self.max_dsteer_step, self.max_dsteer_step)
+        if K:
+            # n[j, t] . p_{t+1} + slack[j, t] >= b[j, t], slack >= 0
+            halfplane = np.zeros((N, K, T, nw + ns))
+            halfplane[..., :nw] = (n[..., 0, None] * G[:, None, 1:, 0] + n[..., 1, None] * G[:, None, 1:, 1])
+            halfplane[..., nw:] = np.eye(ns).reshape(K, T, ns)
+            offset = n[..., 0] * s[:, None, 1:, 0] + n[..., 1] * s[:, None, 1:, 1]
+            add(halfplane.reshape(N, ns, nw + ns), (b - offset).reshape(N, ns), np.inf)
+            add(np.hstack([np.zeros((ns, nw)), np.eye(ns)]), 0.0, np.inf)
+        return (P, q, np.concatenate(rows, axis=1), np.concatenate(lower, axis=1),
+                np.concatenate(upper, axis=1), constant)
+
+    def solve(self, A, B, C, xref, x0, n=None, b=None, warm_start=None, **settings):
+        """
+        Solve the problems of a batch of controllers.
+
+        Parameters
+        ----------
+        A, B, C : (N, T, NX, NX), (N, T, NX, NU), (N, T, NX) ndarray
+            linearized models.
+        xref : (N, NX, T + 1) ndarray
+        x0 : (N, NX) ndarray
+        n, b : (N, slots, T, 2), (N, slots, T) ndarray
+            collision halfplanes, with obstacle slots.
+        warm_start : list, optional
+            per controller None or the (z, y) of an earlier solve.
+        settings :
+            passed to `utils.batch_qp.solve`.
+
+        Returns
+        -------
+        result : utils.batch_qp.BatchResult
+        x : (N, NX, T + 1) ndarray
+            states.
+        u : (N, NU, T) ndarray
+            inputs.
+        cost : (N,) ndarray
+        """
+        x0 = np.asarray(x0, dtype=float)
+        s, G = self.condense(A, B, C, x0)
+        P, q, rows, lower, upper, constant = self.qp(s, G, np.asarray(xref, dtype=float), n, b)
+        z0 = y0 = None
+        if warm_start is not None and any(w is not None for w in warm_start):
+            z0, y0 = np.zeros(q.shape), np.zeros(lower.shape)
+            for i, w in enumerate(warm_start):
+                if w is not None and w[0].shape == z0[i].shape and w[1].shape == y0[i].shape:
+                    z0[i], y0[i] = w
+        result = batch_qp.solve(P, q, rows, lower, upper, z0, y0, **settings)
+        self.solves += len(x0)
+
+        w = result.z[:, :self.n_inputs]
+        x = s + np.einsum('ntia,na->nti', G, w)
+        u = (w @ self.E.T).reshape(len(x0), self.T, self.NU)
+        cost = (np.einsum('ni,nij,nj->n', result.z, P, result.z) / 2.0
+                + np.einsum('ni,ni->n', q, result.z) + constant)
+        return result, np.transpose(x, (0, 2, 1)), np.transpose(u, (0, 2, 1)), cost
+
+
+def move_blocks(T, blocking):
+    """
+    Block lengths of a move blocking over `T` steps.
+
+    `blocking` is None (no blocking), a block length (e.g. 4: 4, 4, ...,
+    the last block shorter), or a tuple of block lengths (e.g. (1, 1, 2, 4)),
+    cut at `T` and with the last block stretched to reach it.
+    """
+    if blocking is None:
+        return None
+    if isinstance(blocking, int):
+        blocking = (blocking,) * -(-T // blocking)
+    blocks, total = [], 0
+    for length in blocking:
+        length = min(int(length), T - total)
+        if length <= 0:
+            break
+        blocks.append(length)
+        total += length
+    if not blocks:
+        raise ValueError('empty move blocking: %r' % (blocking,))
+    blocks[-1] += T - total
+    return tuple(blocks)
+
+
+def blocked_input(NU, T, blocks):
+    """
+    Input of the horizon with move blocking.
+
+    Returns
+    -------
+    u : cvxpy expression
+        (NU, T) input of every step.
+    u_free : cvxpy Variable
+        (NU, blocks) decision variables, `u` itself without blocking.
+    boundaries : set
+        steps t at which the input may change to step t + 1.
+    """
+    if blocks is None:
+        u = cvxpy.Variable((NU, T))
+        return u, u, set(range(T - 1))
+    expand = np.zeros((len(blocks), T))
+    starts = np.cumsum((0,) + blocks)
+    for k in range(len(blocks)):
+        expand[k, starts[k]:starts[k + 1]] = 1.0
+    u_free = cvxpy.Variable((NU, len(blocks)))
+    return u_free @ expand, u_free, {int(end) - 1 for end in starts[1:-1]}
+
+
+def problem_key(mpc):
+    """
+    Structure of the problem of a `SINGLE_MPC` controller, equal keys share
+    a compiled problem.
+    """
+    return (mpc.T, mpc.DT, mpc.Q.tobytes(), mpc.R.tobytes(), mpc.Rd.tobytes(), mpc.Qf.tobytes(),
+            mpc.MAX_SPEED, mpc.MIN_SPEED, mpc.MAX_ACCEL, mpc.MAX_STEER, mpc.MAX_DSTEER,
+            obstacle_slots(mpc), mpc.COLLISION_SLACK_WEIGHT, move_blocks(mpc.T, mpc.MOVE_BLOCKING))
+
+
+def obstacle_slots(mpc):
+    return mpc.MAX_OBSTACLE_CONSTRAINTS if mpc.COLLISION_CONSTRAINTS else 0
+
+
+class ProblemCache:
+    """
+    LRU cache of compiled problems of one process
+
+    Parameters
+    ----------
+    max_entries : int
+    problem_class : type
+        `LinearMPCProblem` or `CondensedMPC`.
+    """
+
+    def __init__(self, max_entries=32, problem_class=LinearMPCProblem):
+        self.max_entries = max_entries
+        self.problem_class = problem_class
+        self.problems = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, mpc):
+        """
+        Compiled problem for the settings of controller `mpc`, built on a miss.
+        """
+        key = problem_key(mpc)
+        problem = self.problems.get(key)
+        if problem is not None:
+            self.problems.move_to_end(key)
+            self.hits += 1
+            return problem
+        self.misses += 1
+        problem = self.problem_class(mpc.T, mpc.Q, mpc.R, mpc.Rd, mpc.Qf, mpc.MAX_SPEED, mpc.MIN_SPEED,
+                                   mpc.MAX_ACCEL, mpc.MAX_STEER, mpc.MAX_DSTEER * mpc.DT,
+                                   obstacle_slots(mpc), mpc.COLLISION_SLACK_WEIGHT,
+                                   move_blocks(mpc.T, mpc.MOVE_BLOCKING))
+        self.problems[key] = problem
+        if len(self.problems) > self.max_entries:
+            self.problems.popitem(last=False)
+        return problem
+
+    def __len__(self):
+        return len(self.problems)
+
+    def clear(self):
+        self.problems.clear()
+
+    def stats(self):
+        return {'problems': len(self.problems), 'hits': self.hits, 'misses': self.misses,
+                'solves': sum(p.solves for p in self.problems.values())}
+
+
+PROBLEM_CACHE = ProblemCache()
+CONDENSED_CACHE = ProblemCache(problem_class=CondensedMPC)
@@ -0,0 +1,96 @@
+"""
+Interaction graph partitioning of a scene
+
+Agents only react to obstacles within their detection range, so two agents
+that stay farther apart than that for a number of ticks do not influence
+each other during those ticks. Linking every pair of agents that might come
+within range gives a proximity graph; its connected components (clusters)
+can be simulated independently for those ticks, e.g. in parallel, and
+give the same result as simulating the whole scene.
+
+"""
+import math
+from collections import defaultdict
+
+import numpy as np
+
+
+def clusters(positions, reach):
+    """
+    Connected components of the proximity graph.
+
+    Parameters
+    ----------
+    positions : (N, 2) array_like
+        agent positions.
+    reach : (N,) array_like
+        agents i and j are linked when their distance is at most
+        reach[i] + reach[j].
+
+    Returns
+    -------
+    list of lists
+        agent indices of every cluster, ascending, clusters ordered by
+        their first index.
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    reach = np.asarray(reach, dtype=float)
+    count = len(positions)
+    parent = list(range(count))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    if count:
+        # grid of cells no smaller than the longest link, links only within
+        # neighbouring cells
+        cell = max(2.0 * float(reach.max()), 1e-9)
+        grid = defaultdict(list)
+        keys = np.floor(positions / cell).astype(np.int64)
+        for i, (cx, cy) in enumerate(keys.tolist()):
+            grid[(cx, cy)].append(i)
+        for (cx, cy), members in grid.items():
+            neighbours = [j for dx in (-1, 0, 1) for dy in (-1, 0, 1) for j in grid.get((cx + dx, cy + dy), ())]
+            neighbours = np.array(neighbours)
+            for i in members:
+                others = neighbours[neighbours > i]
+                if not len(others):
+                    continue
+                distance = np.hypot(*(positions[others] - positions[i]).T)
+                for j in others[distance <= reach[i] + reach[others]].tolist():
+                    root_i, root_j = find(i), find(j)
+                    if root_i != root_j:
+                        parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups = defaultdict(list)
+    for i in range(count):
+        groups[find(i)].append(i)
+    return sorted(groups.values(), key=lambda group: group[0])
+
+
+def balance(groups, workers):
+    """
+    Assign clusters to at most `workers` bins of similar total size
+    (largest first), returns lists of clusters.
+    """
+    bins = [[] for _ in range(max(1, min(workers, len(groups))))]
+    sizes = [0] * len(bins)
+    for group in sorted(groups, key=len, reverse=True):
+        k = sizes.index(min(sizes))
+        bins[k].append(group)
+        sizes[k] += len(group)
+    return [b for b in bins if b]
+
+
+def reach_after(detect_range, step, ticks):
+    """
+    Distance within which an agent with detection range `detect_range`
+    and at most `step` meters of motion per tick can interact during the
+    next `ticks` ticks (obstacles are one step ahead of their agent).
+    """
+    if math.isinf(step):
+        return math.inf
+    return detect_range + (ticks + 3) * step
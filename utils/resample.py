@@ -0,0 +1,115 @@
+"""
+Vectorized resampling of trajectories
+
+Stretches sequences to a new number of samples along their index axis, the
+same way `mpc_module.interpolate` does for a single list, but for a single
+sequence or a whole (agents x time) array with per-agent valid lengths at
+once. Used for time-base conversion between the MPC output (DT) and the
+M2I horizon (80 steps of 0.1s).
+
+"""
+import numpy as np
+
+from utils.cubic_spline_planner import CubicSpline1DBatch
+
+
+def _prepare(values, new_len, lengths):
+    values = np.asarray(values, dtype=float)
+    single = values.ndim == 1
+    values = np.atleast_2d(values)
+    if lengths is None:
+        lengths = np.full(values.shape[0], values.shape[1])
+    lengths = np.clip(np.asarray(lengths, dtype=int), 1, values.shape[1])
+
+    # fractional source index of every output sample
+    if new_len > 1:
+        delta = (lengths - 1) / (new_len - 1)
+    else:
+        delta = np.zeros(len(lengths))
+    fi = np.arange(new_len)[None, :] * delta[:, None]
+    return values, single, lengths, fi
+
+
+def _sample_linear(values, fi, lengths):
+    i = np.floor(fi).astype(int)
+    f = fi - i
+    last = (lengths - 1)[:, None]
+    j = np.minimum(np.where(f > 0, i + 1, i), last)
+    i = np.minimum(i, last)
+    return (1 - f) * np.take_along_axis(values, i, axis=1) \
+        + f * np.take_along_axis(values, j, axis=1)
+
+
+def _sample_spline(values, fi, lengths):
+    knots = np.broadcast_to(np.arange(values.shape[1], dtype=float), values.shape)
+    sp = CubicSpline1DBatch(knots, values, lengths)
+    out = sp.calc_position(np.minimum(fi, (lengths - 1)[:, None]))
+
+    # rows with less than 3 valid samples fall back to linear
+    short = lengths < 3
+    if np.any(short):
+        out[short] = _sample_linear(values[short], fi[short], lengths[short])
+    return out
+
+
+def resample_linear(values, new_len, lengths=None):
+    """
+    Linearly resample sequences to `new_len` samples.
+
+    Parameters
+    ----------
+    values : array_like, shape (L,) or (N, L)
+        sequence(s) to resample.
+    new_len : int
+        number of output samples.
+    lengths : array_like, shape (N,), optional
+        valid length of each row, samples after it are ignored.
+
+    Returns
+    -------
+    out : ndarray, shape (new_len,) or (N, new_len)
+        the first and last valid samples of each row are kept exactly.
+    """
+    values, single, lengths, fi = _prepare(values, new_len, lengths)
+    out = _sample_linear(values, fi, lengths)
+    return out[0] if single else out
+
+
+def resample_time(values, dt, new_dt, new_len, lengths=None, kind="linear"):
+    """
+    Convert sequences sampled every `dt` seconds to `new_len` samples every
+    `new_dt` seconds, both starting at t=0, e.g. MPC output at DT=0.2 to
+    the 80 step M2I horizon at 0.1s. The last valid sample is held once a
+    row runs out.
+
+    Parameters
+    ----------
+    values : array_like, shape (L,) or (N, L)
+        sequence(s) to convert.
+    dt : float
+        source time step [s].
+    new_dt : float
+        target time step [s].
+    new_len : int
+        number of output samples.
+    lengths : array_like, shape (N,), optional
+        valid length of each row.
+    kind : str
+        "linear", or "spline" through a natural cubic spline over the sample
+        index (rows with less than 3 valid samples fall back to linear).
+
+    Returns
+    -------
+    out : ndarray, shape (new_len,) or (N, new_len)
+    """
+    values, single, lengths, _ = _prepare(values, new_len, lengths)
+    fi = np.arange(new_len)[None, :] * (new_dt / dt)
+    fi = np.minimum(fi, (lengths - 1)[:, None].astype(float))
+
+    if kind == "spline":
+        out = _sample_spline(values, fi, lengths)
+    elif kind == "linear":
+        out = _sample_linear(values, fi, lengths)
+    else:
+        raise ValueError("unknown resampling kind: " + str(kind))
+    return out[0] if single else out
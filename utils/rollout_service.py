@@ -0,0 +1,316 @@
+"""
+Persistent local rollout service
+
+A long-running asyncio server that keeps a pool of warm worker processes
+(imports done, compiled problems and course caches kept between requests)
+and rolls out scenarios sent by local clients, so callers do not pay the
+import, setup and problem compilation costs for every scenario.
+
+Protocol: every message is an 8 byte big-endian length followed by a pickle.
+Requests are dicts::
+
+    {'op': 'rollout', 'scenario': {...state/... dict...}}
+    {'op': 'stats'}
+    {'op': 'ping'}
+
+and every request gets one response ``{'ok': True, ...}`` or
+``{'ok': False, 'error': message}``. A connection handles its requests one
+at a time, concurrent requests use several connections. Unpickling a request
+runs code chosen by the client, so the service only listens on a Unix socket
+that only its owner may connect to (mode 0600), and closes connections that
+announce messages larger than `MAX_MESSAGE_BYTES`. A worker that dies (out of
+memory, segfault) fails the requests it was running and the pool is
+restarted for the next ones.
+
+"""
+import os
+import sys
+import time
+import pickle
+import signal
+import socket
+import struct
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+HEADER = struct.Struct('!Q')
+SOCKET_MODE = 0o600  # only the owner of the service may connect
+MAX_MESSAGE_BYTES = 1 << 30  # largest request accepted by the service
+
+
+class MessageTooLarge(ValueError):
+    pass
+
+
+def socket_path(address):
+    """
+    'unix:/path/to.sock' -> '/path/to.sock'. TCP addresses are rejected: any
+    local user could connect to them and have the service unpickle a request.
+    """
+    if not address.startswith('unix:') or not address[len('unix:'):]:
+        raise ValueError("the rollout service only listens on Unix sockets 'unix:/path', not %r" % address)
+    return address[len('unix:'):]
+
+
+async def read_message(reader, max_size=MAX_MESSAGE_BYTES):
+    header = await reader.readexactly(HEADER.size)
+    (size,) = HEADER.unpack(header)
+    if size > max_size:
+        raise MessageTooLarge('message of %d bytes exceeds the limit of %d bytes' % (size, max_size))
+    return pickle.loads(await reader.readexactly(size))
+
+
+async def write_message(writer, message):
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    writer.write(HEADER.pack(len(payload)) + payload)
+    await writer.drain()
+
+
+def _timed(forward, data):
+    start = time.perf_counter()
+    result = forward(data)
+    return result, time.perf_counter() - start
+
+
+def _summary(values):
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+    return {'count': len(values), 'mean': sum(values) / len(values),
+            'p50': values[len(values) // 2], 'p95': values[int(len(values) * 0.95)],
+            'max': values[-1]}
+
+
+class RolloutService:
+    """
+    Roll out scenarios on a warm process pool for concurrent clients
+
+    Parameters
+    ----------
+    forward : callable
+        picklable function mapping a scenario dict to a result,
+        e.g. `mpc_module.mpc_forward`.
+    workers : int
+        number of worker processes.
+    initializer, initargs :
+        run once in every worker, e.g. to load settings and warm up solvers.
+    max_pending : int, optional
+        requests waiting for a worker beyond this are rejected as busy.
+    window : int
+        number of recent requests the latency statistics are computed over.
+    max_message_bytes : int
+        connections announcing a larger request are closed.
+    """
+
+    def __init__(self, forward, workers=1, initializer=None, initargs=(), max_pending=None,
+                 window=1000, max_message_bytes=MAX_MESSAGE_BYTES):
+        self.forward = forward
+        self.max_message_bytes = max_message_bytes
+        self.workers = workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self.max_pending = max_pending
+        self.pool = None
+        self.slots = None
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.restarts = 0
+        self.latencies = deque(maxlen=window)
+        self.service_times = deque(maxlen=window)
+        self.started = time.time()
+
+    def start(self):
+        """
+        Start the worker pool, and run the initializer in every worker now
+        rather than on the first request.
+        """
+        self.pool = self.__new_pool()
+        warm = [self.pool.submit(os.getpid) for _ in range(self.workers)]
+        for future in warm:
+            future.result()
+        self.slots = asyncio.Semaphore(self.workers)
+
+    def __new_pool(self):
+        return ProcessPoolExecutor(self.workers, initializer=self.initializer, initargs=self.initargs)
+
+    def __restart(self, broken):
+        # a worker died, the executor refuses every later task: replace it once
+        if self.pool is broken:
+            broken.shutdown(wait=False)
+            self.pool = self.__new_pool()
+            self.restarts += 1
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    async def rollout(self, data):
+        """
+        Roll out one scenario on the pool, returns (result, seconds in the worker).
+        """
+        if self.max_pending is not None and self.waiting >= self.max_pending:
+            self.rejected += 1
+            raise RuntimeError('busy: %d requests queued' % self.waiting)
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        pool = self.pool
+        try:
+            loop = asyncio.get_running_loop()
+            result, seconds = await loop.run_in_executor(pool, _timed, self.forward, data)
+        except BrokenProcessPool:
+            self.failed += 1
+            self.__restart(pool)
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            self.slots.release()
+        self.completed += 1
+        self.latencies.append(time.perf_counter() - start)
+        self.service_times.append(seconds)
+        return result, seconds
+
+    def stats(self):
+        """
+        Queue depth, request counts and latencies [s] of the recent requests.
+        """
+        return {'workers': self.workers, 'queue_depth': self.waiting, 'running': self.running,
+                'completed': self.completed, 'failed': self.failed, 'rejected': self.rejected,
+                'restarts': self.restarts, 'uptime': time.time() - self.started,
+                'latency': _summary(self.latencies), 'service_time': _summary(self.service_times)}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_message(reader, self.max_message_bytes)
+                except (asyncio.IncompleteReadError, MessageTooLarge):
+                    break
+                op = request.get('op') if isinstance(request, dict) else None
+                try:
+                    if op == 'rollout':
+                        result, seconds = await self.rollout(request['scenario'])
+                        response = {'ok': True, 'result': result, 'seconds': seconds}
+                    elif op == 'stats':
+                        response = {'ok': True, 'stats': self.stats()}
+                    elif op == 'ping':
+                        response = {'ok': True}
+                    else:
+                        response = {'ok': False, 'error': 'unknown op: %r' % (op,)}
+                except Exception as e:
+                    response = {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+                await write_message(writer, response)
+        finally:
+            writer.close()
+
+    async def report(self, every, stream):
+        while True:
+            await asyncio.sleep(every)
+            stats = self.stats()
+            latency = stats['latency']
+            stream.write('queue %d, running %d, completed %d, failed %d, latency p50 %s p95 %s\n' % (
+                stats['queue_depth'], stats['running'], stats['completed'], stats['failed'],
+                '%.3fs' % latency['p50'] if latency['count'] else '-',
+                '%.3fs' % latency['p95'] if latency['count'] else '-'))
+            stream.flush()
+
+    async def serve(self, address, report_every=None, ready=None):
+        """
+        Listen on `address` ('unix:/path') until cancelled or terminated (SIGTERM).
+        """
+        where = socket_path(address)
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except (NotImplementedError, RuntimeError):
+            pass  # not on the main thread, or no signal support
+        self.start()
+        try:
+            if os.path.exists(where):
+                os.remove(where)
+            umask = os.umask(0o777 & ~SOCKET_MODE)  # no window with a socket open to others
+            try:
+                server = await asyncio.start_unix_server(self.handle, path=where)
+            finally:
+                os.umask(umask)
+            os.chmod(where, SOCKET_MODE)
+            reporter = None
+            if report_every:
+                reporter = asyncio.ensure_future(self.report(report_every, sys.stderr))
+            if ready is not None:
+                ready()
+            try:
+                async with server:
+                    await server.serve_forever()
+            finally:
+                if reporter is not None:
+                    reporter.cancel()
+                if os.path.exists(where):
+                    os.remove(where)
+        finally:
+            self.close()
+
+
+class RolloutClient:
+    """
+    Blocking client of a `RolloutService`
+
+    Examples
+    --------
+    >>> with RolloutClient('unix:/tmp/mpc.sock') as client:
+    ...     result = client.rollout(scenario)
+    ...     print(client.stats()['latency'])
+    """
+
+    def __init__(self, address, timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path(address))
+        self.file = self.sock.makefile('rwb')
+
+    def request(self, message):
+        payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+        self.file.write(HEADER.pack(len(payload)) + payload)
+        self.file.flush()
+        header = self.file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ConnectionError('service closed the connection')
+        (size,) = HEADER.unpack(header)
+        response = pickle.loads(self.file.read(size))
+        if not response.get('ok'):
+            raise RuntimeError(response.get('error'))
+        return response
+
+    def rollout(self, data):
+        """
+        Rolled out scenario, as returned by the service's forward function.
+        """
+        return self.request({'op': 'rollout', 'scenario': data})['result']
+
+    def stats(self):
+        return self.request({'op': 'stats'})['stats']
+
+    def ping(self):
+        return self.request({'op': 'ping'})['ok']
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
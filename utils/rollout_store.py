@@ -0,0 +1,265 @@
+"""
+Columnar, memory-mappable store of rollout results
+
+Every field of `mpc_forward`'s output is appended to its own raw file as a
+(agents x steps) block of a fixed dtype, so a store of many scenarios is one
+(total agents x steps) matrix per field. A small JSON index maps scenario ids
+to row ranges. Readers memory-map the field files and return views, nothing
+is unpickled or copied.
+
+Layout of a store directory::
+
+    index.json         steps, dtype, fields, scenarios [{id, start, count}]
+    scenarios.jsonl    scenarios appended since index.json was last written
+    x.bin, y.bin, ...  (rows, steps) trajectories, one file per field
+    id.bin, is_sdc.bin (rows,) per agent columns
+
+"""
+import os
+import json
+
+import numpy as np
+
+TRAJECTORY_FIELDS = ('x', 'y', 'bbox_yaw', 'vel_yaw', 'velocity_x', 'velocity_y')
+AGENT_FIELDS = ('id', 'is_sdc')
+INDEX_NAME = 'index.json'
+ENTRIES_NAME = 'scenarios.jsonl'
+
+
+def _field_path(path, field):
+    return os.path.join(path, field + '.bin')
+
+
+def _read_entries(path, rows):
+    # scenario entries of scenarios.jsonl past `rows` (older ones are already
+    # in index.json), and the byte offset after the last complete line
+    entries, end = [], 0
+    entries_path = os.path.join(path, ENTRIES_NAME)
+    if os.path.exists(entries_path):
+        with open(entries_path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # torn last line of a crashed run
+                if entry['start'] >= rows:
+                    entries.append(entry)
+                end += len(line)
+    return entries, end
+
+
+def load_index(path):
+    """
+    Index of a store directory (rollout or scenario store): index.json plus
+    the scenario entries appended to scenarios.jsonl since it was written,
+    'rows' is the number of indexed rows.
+    """
+    with open(os.path.join(path, INDEX_NAME)) as f:
+        index = json.load(f)
+    index.setdefault('scenarios', [])
+    index.setdefault('rows', 0)
+    entries, _ = _read_entries(path, index['rows'])
+    index['scenarios'] += entries
+    if entries:
+        index['rows'] = entries[-1]['start'] + entries[-1]['count']
+    return index
+
+
+class StoreIndex:
+    """
+    Index of a store directory being written
+
+    Every scenario appends one line to scenarios.jsonl, index.json (the
+    header and all scenarios) is only rewritten by `flush`, so writing a
+    dataset does not rewrite a growing index per scenario.
+
+    Parameters
+    ----------
+    path : str
+        store directory.
+    header : dict
+        index of a new store, e.g. {'fields': {}}. An existing index is loaded.
+    """
+
+    def __init__(self, path, header):
+        self.path = path
+        self.entries_path = os.path.join(path, ENTRIES_NAME)
+        if os.path.exists(os.path.join(path, INDEX_NAME)):
+            self.data = load_index(path)
+            _, end = _read_entries(path, 0)
+            if os.path.exists(self.entries_path) and os.path.getsize(self.entries_path) > end:
+                with open(self.entries_path, 'r+b') as f:
+                    f.truncate(end)  # drop a torn last line
+        else:
+            self.data = dict(header, rows=0, scenarios=[])
+            self.flush()
+        self.file = open(self.entries_path, 'a')
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def append(self, entry):
+        """
+        Index a scenario whose rows are written.
+        """
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+        self.data['scenarios'].append(entry)
+        self.data['rows'] = entry['start'] + entry['count']
+
+    def flush(self):
+        """
+        Write index.json with every scenario and empty scenarios.jsonl.
+        """
+        tmp = os.path.join(self.path, INDEX_NAME + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp, os.path.join(self.path, INDEX_NAME))
+        # entries left by a crash right here are skipped on load, start < rows
+        with open(self.entries_path, 'w'):
+            pass
+
+    def close(self):
+        self.file.close()
+        self.flush()
+
+
+class RolloutWriter:
+    """
+    Append rollouts of many scenarios to a columnar store
+
+    Parameters
+    ----------
+    path : str
+        store directory, created if needed. An existing store is appended to.
+    steps : int, optional
+        number of steps per trajectory, taken from the first rollout if None.
+    dtype : str
+        dtype of the trajectory fields.
+    fields : tuple
+        `state/future/*` fields to store.
+    """
+
+    def __init__(self, path, steps=None, dtype='float32', fields=TRAJECTORY_FIELDS):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.index = StoreIndex(path, {'steps': steps, 'dtype': np.dtype(dtype).str,
+                                       'fields': list(fields), 'agent_fields': list(AGENT_FIELDS)})
+        if steps is not None and self.index['steps'] is not None and steps != self.index['steps']:
+            raise ValueError('store has %d steps, got %d' % (self.index['steps'], steps))
+        self.__truncate()
+        self.count = 0
+
+    def __truncate(self):
+        # drop rows written after the last index update, e.g. by a crash
+        rows = self.index['rows']
+        itemsize = np.dtype(self.index['dtype']).itemsize
+        for field in self.index['fields']:
+            self.__truncate_file(field, rows * (self.index['steps'] or 0) * itemsize)
+        for field in self.index['agent_fields']:
+            self.__truncate_file(field, rows * np.dtype('float64').itemsize)
+
+    def __truncate_file(self, field, size):
+        file_path = _field_path(self.path, field)
+        if os.path.exists(file_path) and os.path.getsize(file_path) > size:
+            with open(file_path, 'r+b') as f:
+                f.truncate(size)
+
+    def write(self, sid, result):
+        """
+        Append one rollout (an `mpc_forward` output dict), returns its rows
+        {'start', 'count'}.
+        """
+        dtype = np.dtype(self.index['dtype'])
+        columns = {}
+        for field in self.index['fields']:
+            columns[field] = np.ascontiguousarray(result['state/future/' + field], dtype=dtype)
+        count, steps = columns[self.index['fields'][0]].shape
+        if self.index['steps'] is None:
+            self.index['steps'] = steps
+            self.index.flush()
+        for field, value in columns.items():
+            if value.shape != (count, self.index['steps']):
+                raise ValueError('field %s has shape %s, expected %s'
+                                 % (field, value.shape, (count, self.index['steps'])))
+
+        # bulk appends, one per file
+        for field, value in columns.items():
+            with open(_field_path(self.path, field), 'ab') as f:
+                value.tofile(f)
+        for field in self.index['agent_fields']:
+            value = np.asarray(result.get('state/' + field, np.zeros(count)), dtype='float64')
+            with open(_field_path(self.path, field), 'ab') as f:
+                value.reshape(count).tofile(f)
+
+        start = self.index['rows']
+        self.index.append({'id': sid, 'start': start, 'count': count})
+        self.count += 1
+        return {'start': start, 'count': count}
+
+    def close(self):
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RolloutReader:
+    """
+    Zero-copy reader of a columnar rollout store
+
+    Examples
+    --------
+    >>> store = RolloutReader('rollouts')
+    >>> store['x'].shape            # (total agents, steps) memmap
+    >>> store.scenario(0)['x']     # view of the first scenario's agents
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = load_index(path)
+        self.rows = self.index['rows']
+        self.steps = self.index['steps']
+        self.ids = [s['id'] for s in self.index['scenarios']]
+        self.positions = {sid: i for i, sid in enumerate(self.ids)}
+        self.columns = {}
+
+        for field in self.index['fields']:
+            self.columns[field] = self.__map(field, self.index['dtype'], (self.rows, self.steps))
+        for field in self.index['agent_fields']:
+            self.columns[field] = self.__map(field, 'float64', (self.rows,))
+
+    def __map(self, field, dtype, shape):
+        if self.rows == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(_field_path(self.path, field), dtype=dtype, mode='r', shape=shape)
+
+    def __len__(self):
+        return len(self.index['scenarios'])
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def rows_of(self, key):
+        """
+        Row slice of a scenario, given by position or id.
+        """
+        if isinstance(key, str):
+            key = self.positions[key]
+        entry = self.index['scenarios'][key]
+        return slice(entry['start'], entry['start'] + entry['count'])
+
+    def scenario(self, key):
+        """
+        All fields of one scenario as memmap views.
+        """
+        rows = self.rows_of(key)
+        return {field: column[rows] for field, column in self.columns.items()}
@@ -0,0 +1,234 @@
+"""
+Indexed, memory-mapped store of input scenarios
+
+Per-agent `state/*` arrays of every scenario are appended to one raw file per
+field (struct of arrays), so agent i of a scenario is row `start + i` of
+every field. A JSON index holds each scenario's first row and agent count,
+plus the byte offset of its remaining scenario-level fields (roadgraph,
+traffic lights, ...) in a side pickle file. Readers memory-map the fields and
+only touch the rows they need, instead of unpickling whole scenarios.
+
+Layout of a store directory::
+
+    index.json                     fields (dtype, shape), scenarios
+    scenarios.jsonl                scenarios appended since index.json was last written
+    state__future__x.bin, ...      (rows, *shape) per agent fields
+    extras.pkl                     scenario-level fields, one record each
+
+"""
+import os
+import pickle
+
+import numpy as np
+
+from utils.rollout_store import StoreIndex, load_index
+
+INDEX_NAME = 'index.json'
+EXTRAS_NAME = 'extras.pkl'
+
+# fields read by SINGLE_MPC.setup and mpc_forward
+SETUP_FIELDS = ('state/id', 'state/is_sdc', 'state/future/x', 'state/future/y',
+                'state/future/valid', 'state/past/length', 'state/past/width')
+
+
+def _field_path(path, field):
+    return os.path.join(path, field.replace('/', '__') + '.bin')
+
+
+def is_store(path):
+    """
+    True if `path` is a scenario store directory.
+    """
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, INDEX_NAME)) \
+        and os.path.exists(os.path.join(path, EXTRAS_NAME))
+
+
+class ScenarioStoreWriter:
+    """
+    Append scenarios to a scenario store
+
+    Parameters
+    ----------
+    path : str
+        store directory, created if needed. An existing store is appended to.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.index = StoreIndex(path, {'fields': {}})
+        self.__truncate()
+        self.count = 0
+
+    def __truncate(self):
+        # drop rows and extras written after the last index update, e.g. by a crash
+        rows = self.index['rows']
+        for field, spec in self.index['fields'].items():
+            size = rows * np.dtype(spec['dtype']).itemsize * int(np.prod(spec['shape']))
+            self.__truncate_file(_field_path(self.path, field), size)
+        self.__truncate_file(os.path.join(self.path, EXTRAS_NAME), self.__extras_end())
+
+    def __extras_end(self):
+        if not self.index['scenarios']:
+            return 0
+        last = self.index['scenarios'][-1]
+        if 'extras_end' in last:
+            return last['extras_end']
+        # stores written before 'extras_end' was indexed: end of the last record
+        with open(os.path.join(self.path, EXTRAS_NAME), 'rb') as f:
+            f.seek(last['extras'])
+            pickle.load(f)
+            return f.tell()
+
+    @staticmethod
+    def __truncate_file(file_path, size):
+        if os.path.exists(file_path) and os.path.getsize(file_path) > size:
+            with open(file_path, 'r+b') as f:
+                f.truncate(size)
+
+    def write(self, sid, data):
+        """
+        Append one scenario dict in the `state/...` schema.
+        """
+        count = len(data['state/id'])
+        columns, extras = {}, {}
+        for key, value in data.items():
+            if key.startswith('state/') and isinstance(value, np.ndarray) \
+                    and value.ndim >= 1 and value.shape[0] == count:
+                columns[key] = value
+            else:
+                extras[key] = value
+
+        fields = self.index['fields']
+        if not fields:
+            for key, value in columns.items():
+                fields[key] = {'dtype': value.dtype.str, 'shape': list(value.shape[1:])}
+            self.index.flush()
+        if set(columns) != set(fields):
+            raise ValueError('scenario %s has fields %s, store has %s'
+                             % (sid, sorted(columns), sorted(fields)))
+        for key, value in columns.items():
+            if list(value.shape[1:]) != fields[key]['shape']:
+                raise ValueError('field %s of scenario %s has shape %s, store has %s'
+                                 % (key, sid, value.shape[1:], fields[key]['shape']))
+
+        for key, value in columns.items():
+            with open(_field_path(self.path, key), 'ab') as f:
+                np.ascontiguousarray(value, dtype=fields[key]['dtype']).tofile(f)
+        with open(os.path.join(self.path, EXTRAS_NAME), 'ab') as f:
+            offset = f.tell()
+            pickle.dump(extras, f, protocol=pickle.HIGHEST_PROTOCOL)
+            extras_end = f.tell()
+
+        self.index.append({'id': sid, 'start': self.index['rows'], 'count': count,
+                           'extras': offset, 'extras_end': extras_end})
+        self.count += 1
+
+    def close(self):
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def convert(paths, store_path):
+    """
+    Convert pickled scenarios (files, directories, globs or shards) into a
+    scenario store, returns the number of scenarios written.
+    """
+    from utils.dataset import iter_scenarios
+
+    with ScenarioStoreWriter(store_path) as writer:
+        for sid, data in iter_scenarios(paths, fields=None):
+            writer.write(sid, data)
+    return writer.count
+
+
+class ScenarioStore:
+    """
+    Random access reader of a scenario store
+
+    Examples
+    --------
+    >>> store = ScenarioStore('scenarios')
+    >>> data = store.view(0)            # only SETUP_FIELDS, memmap views
+    >>> m2i_data = mpc_forward(data)
+    >>> store.field('state/future/x', 'some_id', agents=[0, 3])
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = load_index(path)
+        self.rows = self.index['rows']
+        self.fields = self.index['fields']
+        self.ids = [s['id'] for s in self.index['scenarios']]
+        self.positions = {sid: i for i, sid in enumerate(self.ids)}
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for i, sid in enumerate(self.ids):
+            yield sid, self.scenario(i)
+
+    def column(self, field):
+        """
+        Whole (rows, *shape) memmap of a field, mapped on first use.
+        """
+        if field not in self.columns:
+            spec = self.fields[field]
+            shape = (self.rows,) + tuple(spec['shape'])
+            if self.rows == 0:
+                self.columns[field] = np.zeros(shape, dtype=spec['dtype'])
+            else:
+                self.columns[field] = np.memmap(_field_path(self.path, field),
+                                                dtype=spec['dtype'], mode='r', shape=shape)
+        return self.columns[field]
+
+    def entry(self, key):
+        """
+        Index entry of a scenario, given by position or id.
+        """
+        if isinstance(key, str):
+            key = self.positions[key]
+        return self.index['scenarios'][key]
+
+    def agent_rows(self, key):
+        """
+        Row slice of a scenario's agents.
+        """
+        entry = self.entry(key)
+        return slice(entry['start'], entry['start'] + entry['count'])
+
+    def field(self, field, key, agents=None):
+        """
+        One field of a scenario, a memmap view unless `agents` selects rows.
+        """
+        value = self.column(field)[self.agent_rows(key)]
+        return value if agents is None else value[agents]
+
+    def view(self, key, fields=SETUP_FIELDS, agents=None):
+        """
+        Dict of the given per-agent fields of a scenario.
+        """
+        return {field: self.field(field, key, agents) for field in fields if field in self.fields}
+
+    def extras(self, key):
+        """
+        Scenario-level fields (roadgraph, traffic lights, scenario id, ...).
+        """
+        with open(os.path.join(self.path, EXTRAS_NAME), 'rb') as f:
+            f.seek(self.entry(key)['extras'])
+            return pickle.load(f)
+
+    def scenario(self, key):
+        """
+        Full scenario dict, per-agent fields are memmap views.
+        """
+        data = self.extras(key)
+        data.update(self.view(key, fields=self.fields))
+        return data
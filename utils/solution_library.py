@@ -0,0 +1,195 @@
+"""
+Nearest-neighbour library of MPC solutions for warm starts
+
+Agents of different scenarios often face nearly the same tracking problem:
+similar speed, offset from the reference and curvature ahead. Solutions are
+stored under a compact feature vector of their problem (the reference in
+the frame of the initial state), and the input sequence of the nearest
+stored problem is used as the first operating point of a cold solve (a new
+agent, or after a failed solve) and as a fallback plan when a solve fails.
+
+The inputs (acceleration, steering) do not depend on the position and
+heading of the agent, so a solution carries over between problems with the
+same relative reference.
+
+"""
+import math
+
+import numpy as np
+
+YAW_SCALE = 5.0  # [m/rad] weight of heading differences against position differences
+SPEED_SCALE = 1.0  # [m/(m/s)] weight of speed differences
+
+
+def features(x0, xref, yaw_scale=YAW_SCALE, speed_scale=SPEED_SCALE):
+    """
+    Feature vector of a tracking problem.
+
+    Parameters
+    ----------
+    x0 : array_like
+        initial state [x, y, v, yaw].
+    xref : (4, T + 1) array_like
+        reference states, rows x, y, v, yaw.
+
+    Returns
+    -------
+    (4 * (T + 1) + 1,) ndarray
+        reference positions in the frame of `x0`, reference heading
+        relative to it, reference speeds and the initial speed.
+    """
+    x, y, v, yaw = (float(a) for a in x0[:4])
+    xref = np.asarray(xref, dtype=float)
+    dx, dy = xref[0] - x, xref[1] - y
+    cos_yaw, sin_yaw = math.cos(yaw), math.sin(yaw)
+    dyaw = np.arctan2(np.sin(xref[3] - yaw), np.cos(xref[3] - yaw))
+    return np.concatenate([cos_yaw * dx + sin_yaw * dy, -sin_yaw * dx + cos_yaw * dy,
+                           yaw_scale * dyaw, speed_scale * xref[2], [speed_scale * v]])
+
+
+class _Index:
+    # solutions of one horizon (T, DT) in preallocated arrays
+    def __init__(self, max_entries, dims, T):
+        self.features = np.empty((max_entries, dims))
+        self.solutions = np.empty((max_entries, 2, T))
+        self.last_used = np.zeros(max_entries, dtype=np.int64)
+        self.size = 0
+
+    def nearest(self, feature):
+        if self.size == 0:
+            return -1, math.inf
+        distance = np.linalg.norm(self.features[:self.size] - feature, axis=1)
+        i = int(np.argmin(distance))
+        return i, float(distance[i])
+
+    @property
+    def nbytes(self):
+        return self.features.nbytes + self.solutions.nbytes + self.last_used.nbytes
+
+
+class SolutionLibrary:
+    """
+    Bounded nearest-neighbour index of input sequences by problem features
+
+    Parameters
+    ----------
+    max_entries : int
+        size bound per horizon (T, DT), the least recently used solution is
+        evicted first.
+    max_distance : float
+        lookups farther than this from every stored problem miss.
+    merge_distance : float
+        a new solution this close to a stored one replaces it instead of
+        taking a new entry.
+    """
+
+    def __init__(self, max_entries=4096, max_distance=2.0, merge_distance=0.05):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.merge_distance = merge_distance
+        self.indices = {}
+        self.clock = 0
+        self.lookups = 0
+        self.hits = 0
+        self.inserts = 0
+        self.merged = 0
+        self.evictions = 0
+        self.fallbacks = 0
+        # start -> [solves, iterations, solves that met DU_TH within MAX_ITER]
+        self.iterations = {'library': [0, 0, 0], 'cold': [0, 0, 0]}
+
+    def lookup(self, feature, T, DT):
+        """
+        Stored (oa, od) of the nearest problem for a warm start, None on a
+        miss. Counted in the lookup and hit statistics.
+        """
+        self.lookups += 1
+        guess = self.nearest(feature, T, DT)
+        if guess is not None:
+            self.hits += 1
+        return guess
+
+    def nearest(self, feature, T, DT):
+        """
+        As `lookup`, without counting it (e.g. for fallback plans).
+        """
+        index = self.indices.get((T, DT))
+        if index is None:
+            return None
+        i, distance = index.nearest(feature)
+        if distance > self.max_distance:
+            return None
+        self.clock += 1
+        index.last_used[i] = self.clock
+        return index.solutions[i, 0].copy(), index.solutions[i, 1].copy()
+
+    def insert(self, feature, T, DT, oa, od):
+        """
+        Store the solution (oa, od) of the problem with `feature`.
+        """
+        index = self.indices.get((T, DT))
+        if index is None:
+            index = self.indices[(T, DT)] = _Index(self.max_entries, len(feature), T)
+        i, distance = index.nearest(feature)
+        if distance <= self.merge_distance:
+            self.merged += 1
+        elif index.size < self.max_entries:
+            i = index.size
+            index.size += 1
+        else:
+            i = int(np.argmin(index.last_used))
+            self.evictions += 1
+        self.inserts += 1
+        self.clock += 1
+        index.features[i] = feature
+        index.solutions[i, 0] = oa
+        index.solutions[i, 1] = od
+        index.last_used[i] = self.clock
+
+    def record_iterations(self, start, iterations, converged):
+        """
+        Count a cold solve started from the library ('library') or from
+        zero inputs ('cold') that took `iterations` linearizations,
+        `converged` if the input change fell below DU_TH before MAX_ITER
+        ran out.
+        """
+        counts = self.iterations[start]
+        counts[0] += 1
+        counts[1] += iterations
+        counts[2] += int(converged)
+
+    def __len__(self):
+        return sum(index.size for index in self.indices.values())
+
+    def clear(self):
+        self.indices.clear()
+
+    def stats(self):
+        """
+        Entries, memory, hit rate and the mean iterations of cold solves by
+        how they were started.
+        """
+        stats = {'entries': len(self), 'bytes': sum(index.nbytes for index in self.indices.values()),
+                 'lookups': self.lookups, 'hits': self.hits,
+                 'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+                 'inserts': self.inserts, 'merged': self.merged, 'evictions': self.evictions,
+                 'fallbacks': self.fallbacks}
+        for start, (solves, iterations, converged) in self.iterations.items():
+            stats[start + '_solves'] = solves
+            stats[start + '_mean_iterations'] = iterations / solves if solves else 0.0
+            stats[start + '_converged'] = converged
+        return stats
+
+
+_shared = None
+
+
+def shared(max_entries):
+    """
+    The library of this process, shared by all controllers (created, or
+    recreated with a new size bound, on demand).
+    """
+    global _shared
+    if _shared is None or _shared.max_entries != max_entries:
+        _shared = SolutionLibrary(max_entries)
+    return _shared
@@ -1,9 +1,17 @@
 class State:
     """
     vehicle state class
+
+    Slotted: no per-instance __dict__, so states are small and cheap to
+    create in the prediction loop.
     """
+    __slots__ = ('x', 'y', 'yaw', 'v')
+
     def __init__(self, x=0.0, y=0.0, yaw=0.0, v=0.0):
         self.x = x # x position [m]
         self.y = y # y position [m]
         self.yaw = yaw # yaw angle [rad]
-        self.v = v # velocity [m/s]
\ No newline at end of file
+        self.v = v # velocity [m/s]
+
+    def __repr__(self):
+        return 'State(x=%r, y=%r, yaw=%r, v=%r)' % (self.x, self.y, self.yaw, self.v)
@@ -0,0 +1,104 @@
+"""
+Invalid waypoint filtering
+
+M2I/Waymo tracks mark missing future points with (-1, -1) and/or a zero in
+`state/future/valid`. Trailing invalid points are trimmed for all agents at
+once, and tracks too short to compute yaw and curvature are extended by a
+deterministic extrapolation, so the same input always gives the same course.
+
+"""
+import numpy as np
+
+INVALID_VALUE = -1.0
+PAD_OFFSET = (0.5, 0.5)  # [m] step used when a track has no usable direction
+
+
+def valid_mask(x, y, valid=None):
+    """
+    Mask of valid waypoints, a point is invalid if it is the (-1, -1)
+    sentinel or if `valid` is zero.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    mask = ~((x == INVALID_VALUE) & (y == INVALID_VALUE))
+    if valid is not None:
+        mask &= np.asarray(valid).reshape(mask.shape) > 0
+    return mask
+
+
+def valid_lengths(x, y, valid=None):
+    """
+    Number of waypoints left after trimming the trailing invalid ones, at
+    least 1 (the first waypoint is always kept).
+
+    Parameters
+    ----------
+    x, y : array_like, shape (L,) or (N, L)
+        waypoints of one or many agents.
+    valid : array_like, optional
+        `state/future/valid` mask with the same shape.
+
+    Returns
+    -------
+    lengths : int or ndarray of shape (N,)
+    """
+    mask = np.atleast_2d(valid_mask(x, y, valid))
+    last = mask.shape[1] - np.argmax(mask[:, ::-1], axis=1)
+    lengths = np.where(mask.any(axis=1), last, 1)
+    return int(lengths[0]) if np.ndim(x) == 1 else lengths
+
+
+def filter_invalid(x, y, valid=None, min_length=3):
+    """
+    Trim trailing invalid waypoints and extend short tracks to `min_length`.
+
+    Short tracks are extended with their last displacement (constant
+    velocity), or with PAD_OFFSET when they have a single point or stand
+    still, so the extrapolated points never coincide.
+
+    Parameters
+    ----------
+    x, y : array_like, shape (L,) or (N, L)
+        waypoints of one or many agents.
+    valid : array_like, optional
+        `state/future/valid` mask with the same shape.
+    min_length : int
+        minimum number of waypoints of every output track.
+
+    Returns
+    -------
+    x, y : ndarray, shape (N, max(L, min_length)) or 1-D for a single track
+        filtered waypoints, values after `lengths` are padding.
+    lengths : int or ndarray of shape (N,)
+    """
+    single = np.ndim(x) == 1
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    lengths = np.atleast_1d(valid_lengths(x, y, None if valid is None else np.atleast_2d(valid)))
+    num, max_len = x.shape
+
+    width = max(max_len, min_length)
+    out_x = np.zeros((num, width))
+    out_y = np.zeros((num, width))
+    out_x[:, :max_len] = x
+    out_y[:, :max_len] = y
+
+    rows = np.arange(num)
+    last = lengths - 1
+    step_x = np.where(lengths >= 2, x[rows, last] - x[rows, np.maximum(last - 1, 0)], 0.0)
+    step_y = np.where(lengths >= 2, y[rows, last] - y[rows, np.maximum(last - 1, 0)], 0.0)
+    still = np.hypot(step_x, step_y) < 1e-6
+    step_x[still] = PAD_OFFSET[0]
+    step_y[still] = PAD_OFFSET[1]
+
+    # extrapolate every missing point up to min_length
+    cols = np.arange(width)[None, :]
+    k = cols - last[:, None]
+    fill = (k > 0) & (cols < min_length)
+    out_x = np.where(fill, x[rows, last][:, None] + k * step_x[:, None], out_x)
+    out_y = np.where(fill, y[rows, last][:, None] + k * step_y[:, None], out_y)
+    lengths = np.maximum(lengths, min_length)
+
+    if single:
+        return out_x[0], out_y[0], int(lengths[0])
+    return out_x, out_y, lengths